@@ -0,0 +1,11 @@
+""" Performance benchmarks for python-gsmmodem
+
+The benchmarks run against a simulated modem (no hardware required). Run them from the
+top-level source directory, either individually, e.g.::
+
+    python -m benchmarks.bench_sendsms
+
+or all at once, writing the results as JSON (see benchmarks/run.py)::
+
+    python -m benchmarks.run -o results.json
+"""
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+""" Stored SMS listing benchmark: listStoredSms() duration for various numbers of stored messages,
+compared with streaming the messages with iterStoredSms() (including the time until the first message
+is available, and peak memory use where tracemalloc is available) """
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+
+try:
+    import tracemalloc
+except ImportError: #pragma: no cover
+    tracemalloc = None # Python 2
+
+from .harness import createModem, writeResults
+from .simmodem import SimulatedModem
+
+DEFAULT_COUNTS = (50, 250, 1000)
+
+
+def peakMemory(func):
+    """ Calls func
+
+    :return: The peak memory (in bytes) allocated while func ran, or None if tracemalloc is unavailable
+    """
+    if tracemalloc == None:
+        func()
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def iterate(modem, count):
+    """ Iterates over the stored messages with iterStoredSms(), without keeping them
+
+    :return: tuple of (total duration, time until the first message)
+    """
+    start = monotonic()
+    firstMessage = None
+    received = 0
+    for message in modem.iterStoredSms():
+        if firstMessage == None:
+            firstMessage = monotonic() - start
+        received += 1
+    assert received == count, 'expected {0} messages, got {1}'.format(count, received)
+    return monotonic() - start, firstMessage
+
+
+def run(counts=DEFAULT_COUNTS, repeat=3):
+    """ :return: The best listStoredSms() and iterStoredSms() durations (of ``repeat`` runs), keyed by number of stored messages """
+    simModem = SimulatedModem()
+    modem, package = createModem(simModem)
+    modem.connect()
+    results = {}
+    for count in counts:
+        simModem.storedSms.clear()
+        for i in range(count):
+            simModem.storeSms()
+        durations = []
+        for i in range(repeat):
+            start = monotonic()
+            messages = modem.listStoredSms()
+            durations.append(monotonic() - start)
+            assert len(messages) == count, 'expected {0} messages, got {1}'.format(count, len(messages))
+        iterations = [iterate(modem, count) for i in range(repeat)]
+        results[str(count)] = {'duration': min(durations),
+                               'messageRate': count / min(durations),
+                               'iterDuration': min(duration for duration, firstMessage in iterations),
+                               'iterFirstMessage': min(firstMessage for duration, firstMessage in iterations),
+                               'listPeakMemory': peakMemory(modem.listStoredSms),
+                               'iterPeakMemory': peakMemory(lambda: iterate(modem, count))}
+    modem.close()
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='Stored SMS listing benchmark')
+    parser.add_argument('-c', '--count', type=int, action='append', help='number of stored messages (may be repeated)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of runs per message count')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('liststored', run(args.count or DEFAULT_COUNTS, args.repeat), args.output)
+
+
+if __name__ == '__main__':
+    main()
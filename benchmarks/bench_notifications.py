@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+""" Notification dispatch benchmark: latency between a +CMTI notification arriving and the
+SMS received callback being called, during a burst ("storm") of incoming messages
+"""
+
+from __future__ import print_function
+
+import threading, time
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+
+from .harness import createModem, writeResults, percentile
+from .simmodem import SimulatedModem, deliverPdu
+
+
+def run(notifications=200, latency=0.001, interval=0.005, timeout=10):
+    """ Injects +CMTI notifications, one every ``interval`` seconds
+
+    :return: Dispatch latency percentiles and throughput
+    """
+    simModem = SimulatedModem(latency=latency)
+    injectTimes = {} # key: sender number (unique per message); value: time the notification was injected
+    dispatchLatencies = []
+    dispatchTimes = []
+    done = threading.Event()
+    def smsReceived(sms):
+        now = monotonic()
+        dispatchLatencies.append(now - injectTimes[sms.number])
+        dispatchTimes.append(now)
+        if len(dispatchLatencies) >= notifications:
+            done.set()
+    modem, package = createModem(simModem, smsReceivedCallbackFunc=smsReceived)
+    modem.connect()
+    # Count the serial port queries for pending data (an ioctl system call on real serial ports)
+    inWaitingCalls = [0]
+    portInWaiting = package.port.inWaiting
+    def inWaiting():
+        inWaitingCalls[0] += 1
+        return portInWaiting()
+    package.port.inWaiting = inWaiting
+    start = monotonic()
+    for i in range(notifications):
+        number = '+2782{0:07d}'.format(i)
+        index = simModem.storeSms(deliverPdu(number))
+        injectTimes[number] = monotonic()
+        package.port.inject('\r\n+CMTI: "SM",{0}\r\n'.format(index))
+        if interval:
+            time.sleep(interval)
+    done.wait(timeout)
+    duration = (max(dispatchTimes) if dispatchTimes else monotonic()) - start
+    modem.close()
+    return {'parameters': {'notifications': notifications, 'latency': latency, 'interval': interval},
+            'dispatched': len(dispatchLatencies),
+            'lost': notifications - len(dispatchLatencies),
+            'duration': duration,
+            'dispatchRate': len(dispatchLatencies) / duration,
+            'dispatchLatencyMedian': percentile(dispatchLatencies, 0.5),
+            'dispatchLatencyP99': percentile(dispatchLatencies, 0.99),
+            'dispatchLatencyMax': max(dispatchLatencies) if dispatchLatencies else None,
+            'inWaitingCalls': inWaitingCalls[0]}
+
+
+def main():
+    parser = ArgumentParser(description='Notification dispatch latency benchmark (+CMTI storm)')
+    parser.add_argument('-n', '--notifications', type=int, default=200, help='number of +CMTI notifications to inject')
+    parser.add_argument('-l', '--latency', type=float, default=0.001, help='simulated modem response latency, in seconds')
+    parser.add_argument('-i', '--interval', type=float, default=0.005, help='time between injected notifications, in seconds (0 for a single burst)')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('notifications', run(args.notifications, args.latency, args.interval), args.output)
+
+
+if __name__ == '__main__':
+    main()
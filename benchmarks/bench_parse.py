@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+""" Response parsing benchmark: per-line cost of response grammar matching
+
+Compares the previous approach (patterns compiled on every call, and the response terminator
+regular expression run on every line) with the precompiled grammars of gsmmodem.grammar (with
+their literal prefix checks) and its set-based response terminator detection.
+
+The CMGL loops gain little, because the re module already caches compiled patterns. The set-based
+terminator check is not meant to be faster than the regular expression (it makes the terminators
+configurable per modem); responseTerm checks that it costs about the same.
+"""
+
+from __future__ import print_function
+
+import re
+from argparse import ArgumentParser
+
+from gsmmodem import grammar
+
+from .harness import measureRate, writeResults
+
+# A text mode AT+CMGL response, as the lines read from the modem
+CMGL_TEXT_LINES = []
+for i in range(20):
+    CMGL_TEXT_LINES.extend(['+CMGL: {0},"REC READ","+27820001234",,"13/04/24,13:28:07+08"'.format(i),
+                            'Hello, this is stored message number {0}'.format(i)])
+CMGL_TEXT_LINES.append('OK')
+# A PDU mode AT+CMGL response
+CMGL_PDU_LINES = []
+for i in range(20):
+    CMGL_PDU_LINES.extend(['+CMGL: {0},1,,31'.format(i),
+                           '07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619'])
+CMGL_PDU_LINES.append('OK')
+# An AT+CGDCONT? response
+CGDCONT_LINES = ['+CGDCONT: {0},"IP","internet{0}","0.0.0.0",0,0'.format(i) for i in range(1, 4)] + ['OK']
+
+
+def oldResponseTerm(lines, regex=re.compile(grammar.RESPONSE_TERM.pattern.pattern)):
+    for line in lines:
+        regex.match(line)
+
+def newResponseTerm(lines, terminators=grammar.TERMINATOR_PROFILES['standard']):
+    for line in lines:
+        terminators.match(line)
+
+def oldCmglText(lines):
+    cmglRegex = re.compile(grammar.CMGL_TEXT.pattern.pattern)
+    for line in lines:
+        cmglRegex.match(line)
+
+def newCmglText(lines):
+    cmglRegex = grammar.CMGL_TEXT.pattern
+    for line in lines:
+        cmglRegex.match(line)
+
+def oldCmglPdu(lines):
+    cmglRegex = re.compile(grammar.CMGL_PDU.pattern.pattern)
+    for line in lines:
+        cmglRegex.match(line)
+
+def newCmglPdu(lines):
+    cmglRegex = grammar.CMGL_PDU.pattern
+    for line in lines:
+        cmglRegex.match(line)
+
+def oldCgdcont(lines):
+    regex = re.compile(grammar.CGDCONT.pattern.pattern)
+    return [m for m in (regex.match(line) for line in lines) if m]
+
+def newCgdcont(lines):
+    return grammar.CGDCONT.allMatches(lines)
+
+# Parsers, by name: (lines, previous implementation, current implementation)
+PARSERS = {'responseTerm': (CMGL_TEXT_LINES, oldResponseTerm, newResponseTerm),
+           'cmglText': (CMGL_TEXT_LINES, oldCmglText, newCmglText),
+           'cmglPdu': (CMGL_PDU_LINES, oldCmglPdu, newCmglPdu),
+           'cgdcont': (CGDCONT_LINES, oldCgdcont, newCgdcont)}
+
+
+def run(minTime=1.0):
+    """ :return: per-line parse cost (in nanoseconds) of the previous and current implementations, by response type """
+    results = {}
+    for name, (lines, old, new) in sorted(PARSERS.items()):
+        oldRate = measureRate(lambda: old(lines), minTime) * len(lines)
+        newRate = measureRate(lambda: new(lines), minTime) * len(lines)
+        results[name] = {'lines': len(lines),
+                         'beforeNsPerLine': 1e9 / oldRate,
+                         'afterNsPerLine': 1e9 / newRate,
+                         'speedup': newRate / oldRate}
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='Response parsing benchmark')
+    parser.add_argument('-t', '--time', type=float, default=1.0, help='minimum measurement time per parser, in seconds')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('parse', run(args.time), args.output)
+
+
+if __name__ == '__main__':
+    main()
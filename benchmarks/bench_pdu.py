@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+""" PDU encoding/decoding benchmark: encodeSmsSubmitPdu() and decodeSmsPdu() operations per second """
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+from gsmmodem.pdu import encodeSmsSubmitPdu, decodeSmsPdu
+
+from .harness import measureRate, writeResults
+
+NUMBER = '+27820001234'
+# Message texts, by name: single-part and multipart (concatenated) messages in both alphabets
+MESSAGES = {'gsm7': 'Hello, this is a test message',
+            'ucs2': u'Привет, это тест',
+            'gsm7-multipart': 'The quick brown fox jumps over the lazy dog. ' * 10,
+            'ucs2-multipart': u'Быстрая лиса. ' * 10}
+
+
+def run(minTime=1.0):
+    """ :return: encode/decode operations (messages) per second, by message type """
+    results = {}
+    for name, text in sorted(MESSAGES.items()):
+        pdus = [str(pdu) for pdu in encodeSmsSubmitPdu(NUMBER, text)]
+        results[name] = {'parts': len(pdus),
+                         'encodeRate': measureRate(lambda: encodeSmsSubmitPdu(NUMBER, text), minTime),
+                         'decodeRate': measureRate(lambda: [decodeSmsPdu(pdu) for pdu in pdus], minTime)}
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='PDU encoding/decoding benchmark')
+    parser.add_argument('-t', '--time', type=float, default=1.0, help='minimum measurement time per operation, in seconds')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('pdu', run(args.time), args.output)
+
+
+if __name__ == '__main__':
+    main()
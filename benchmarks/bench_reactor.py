@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+""" Reactor benchmark: many modems (on pseudo-terminals) served by per-modem read threads or by a
+single shared reactor; compares thread counts, idle CPU usage and command throughput
+"""
+
+from __future__ import print_function
+
+import os, threading, time
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+from gsmmodem.modem import GsmModem
+from gsmmodem.reactor import Reactor
+
+from .harness import writeResults
+from .ptymodem import PtyModem
+from .simmodem import SimulatedModem
+
+
+def cpuTime():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def runMode(useReactor, modemCount, commands, idleTime):
+    ptyModems = [PtyModem(SimulatedModem()) for i in range(modemCount)]
+    for ptyModem in ptyModems:
+        ptyModem.start()
+    baseThreads = threading.active_count()
+    reactor = None
+    if useReactor:
+        reactor = Reactor()
+        reactor.start()
+    modems = []
+    for ptyModem in ptyModems:
+        modem = GsmModem(ptyModem.port)
+        modem.reactor = reactor
+        modem.connect()
+        modems.append(modem)
+    threadCount = threading.active_count() - baseThreads
+    # Idle: no commands and no notifications
+    cpuStart = cpuTime()
+    time.sleep(idleTime)
+    idleCpu = (cpuTime() - cpuStart) / idleTime
+    # Busy: every modem executes commands concurrently
+    def sendCommands(modem):
+        for i in range(commands):
+            modem.write('AT+CSQ')
+    threads = [threading.Thread(target=sendCommands, args=(modem,)) for modem in modems]
+    start = monotonic()
+    cpuStart = cpuTime()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = monotonic() - start
+    busyCpu = cpuTime() - cpuStart
+    closeStart = monotonic()
+    for modem in modems:
+        modem.close()
+    closeTime = monotonic() - closeStart
+    if reactor != None:
+        reactor.close()
+    for ptyModem in ptyModems:
+        ptyModem.stop()
+    return {'readThreads': threadCount,
+            'idleCpuFraction': idleCpu,
+            'commandRate': modemCount * commands / duration,
+            'cpuPerCommand': busyCpu / (modemCount * commands),
+            'closeTime': closeTime}
+
+
+def run(modems=16, commands=50, idleTime=2.0):
+    """ :return: Results for both modes ("threads" and "reactor") """
+    return {'parameters': {'modems': modems, 'commands': commands, 'idleTime': idleTime},
+            'threads': runMode(False, modems, commands, idleTime),
+            'reactor': runMode(True, modems, commands, idleTime)}
+
+
+def main():
+    parser = ArgumentParser(description='Per-modem read threads vs. shared reactor benchmark')
+    parser.add_argument('-n', '--modems', type=int, default=16, help='number of simulated modems')
+    parser.add_argument('-c', '--commands', type=int, default=50, help='commands executed per modem')
+    parser.add_argument('-i', '--idle', type=float, default=2.0, help='idle measurement time, in seconds')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('reactor', run(args.modems, args.commands, args.idle), args.output)
+
+
+if __name__ == '__main__':
+    main()
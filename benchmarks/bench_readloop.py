@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+""" Serial read loop benchmark: lines per second processed by SerialComms._readLoop() """
+
+from __future__ import print_function
+
+import threading
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+from gsmmodem.serial_comms import SerialComms
+
+from .harness import createModem, writeResults
+
+LINE = '+CSQ: 20,99'
+
+
+def run(lines=20000, batch=100):
+    """ Feeds unsolicited notification lines (in batches) to the read loop
+
+    :return: dict containing the number of lines and the lines per second
+    """
+    received = []
+    done = threading.Event()
+    def notificationCallback(notificationLines):
+        received.append(len(notificationLines))
+        if sum(received) >= lines:
+            done.set()
+    serialComms, package = createModem(modemClass=SerialComms, notifyCallbackFunc=notificationCallback)
+    serialComms.connect()
+    data = ('\r\n'.join([LINE] * batch) + '\r\n').encode()
+    start = monotonic()
+    for i in range(lines // batch):
+        package.port.inject(data)
+    done.wait(60)
+    duration = monotonic() - start
+    serialComms.close()
+    return {'lines': sum(received), 'bytes': sum(received) * (len(LINE) + 2), 'duration': duration, 'lineRate': sum(received) / duration}
+
+
+def main():
+    parser = ArgumentParser(description='Serial read loop benchmark')
+    parser.add_argument('-n', '--lines', type=int, default=20000, help='number of lines to read')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('readloop', run(args.lines), args.output)
+
+
+if __name__ == '__main__':
+    main()
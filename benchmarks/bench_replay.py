@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+""" Replay benchmark: processes a recorded serial session (see gsmmodem.capture) as fast as possible
+
+The recorded writes are written to the replayed port in order, without waiting for responses;
+all recorded data read from the modem is therefore handled as unsolicited notifications. This
+turns captures of production incidents (e.g. notification storms or large +CMGL responses) into
+repeatable read path benchmarks.
+"""
+
+from __future__ import print_function
+
+import time
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+from gsmmodem.capture import WRITE
+from gsmmodem.serial_comms import SerialComms
+
+from .harness import writeResults
+
+
+def run(path):
+    """ :return: Replay duration and throughput """
+    lines = []
+    serialComms = SerialComms('replay://{0}?speed=0'.format(path), notifyCallbackFunc=lambda notification: lines.append(len(notification)))
+    serialComms.connect()
+    replay = serialComms.serial
+    start = monotonic()
+    for direction, timestamp, data in replay.records:
+        if direction == WRITE:
+            serialComms.write(data.decode(), waitForResponse=False)
+    while not replay.finished:
+        time.sleep(0.001)
+    duration = monotonic() - start
+    serialComms.close()
+    readBytes = sum(len(data) for direction, timestamp, data in replay.records if direction != WRITE)
+    return {'capture': path,
+            'recordedDuration': replay.records[-1][1] - replay.records[0][1] if replay.records else 0,
+            'duration': duration,
+            'bytes': readBytes,
+            'byteRate': readBytes / duration,
+            'notifications': len(lines),
+            'lines': sum(lines)}
+
+
+def main():
+    parser = ArgumentParser(description='Replays a recorded serial session as fast as possible')
+    parser.add_argument('capture', help='capture file (recorded with gsmmodem.capture.CaptureWriter)')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('replay', run(args.capture), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+""" SMS sending benchmark: sendSms() messages per second at various simulated modem latencies, and
+multipart sending with and without keeping the SMS relay link open (AT+CMMS=2), and broadcasting
+with and without sending from storage (AT+CMGW/AT+CMSS) """
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+
+from .harness import createModem, writeResults, percentile
+from .simmodem import SimulatedModem
+
+DEFAULT_LATENCIES = (0, 0.001, 0.01, 0.05)
+
+
+def runMultipart(parts=3, messages=10, latency=0.001, linkSetupTime=0.05):
+    """ Sends multipart messages to simulated modems that take linkSetupTime to set up the SMS
+    relay link for every message, unless it is kept open (AT+CMMS=2)
+
+    :return: Send rate and per-part send time percentiles, with and without AT+CMMS support
+    """
+    text = 'x' * (153 * (parts - 1) + 10)
+    results = {}
+    for name, cmmsSupported in (('keepLinkOpen', True), ('linkPerPart', False)):
+        modem, package = createModem(SimulatedModem(latency=latency, linkSetupTime=linkSetupTime, cmmsSupported=cmmsSupported))
+        modem.connect()
+        if cmmsSupported and modem._commands != None:
+            modem._commands.append('+CMMS') # Not in the fake modem's list of supported commands
+        modem.smsTextMode = False
+        partDurations = []
+        start = monotonic()
+        for i in range(messages):
+            partDurations.extend(part.duration for part in modem.sendSms('+27820001234', text).parts)
+        duration = monotonic() - start
+        modem.close()
+        results[name] = {'messages': messages,
+                         'parts': parts,
+                         'messageRate': messages / duration,
+                         'partDurationMedian': percentile(partDurations, 0.5),
+                         'partDurationP99': percentile(partDurations, 0.99)}
+    return results
+
+
+def runBroadcast(recipients=50, latency=0.001):
+    """ Broadcasts a message with and without sending from storage (AT+CMGW/AT+CMSS)
+
+    :return: Send rate and serial bytes written per recipient, with and without storage support
+    """
+    text = 'Broadcast alert: please evacuate the building via the nearest emergency exit. ' * 2
+    destinations = ['+2782{0:07d}'.format(i) for i in range(recipients)]
+    results = {}
+    for name, cmssSupported in (('fromStorage', True), ('sendSms', False)):
+        modem, package = createModem(SimulatedModem(latency=latency, cmssSupported=cmssSupported))
+        modem.connect()
+        if modem._commands != None:
+            modem._commands.extend(('+CMGW', '+CMSS')) # Not in the fake modem's list of supported commands
+        modem.smsTextMode = False
+        bytesWritten = package.port.bytesWritten
+        start = monotonic()
+        modem.broadcastSms(destinations, text)
+        duration = monotonic() - start
+        bytesWritten = package.port.bytesWritten - bytesWritten
+        modem.close()
+        results[name] = {'recipients': recipients,
+                         'sendRate': recipients / duration,
+                         'bytesPerRecipient': bytesWritten / float(recipients)}
+    return results
+
+
+def run(latencies=DEFAULT_LATENCIES, messages=50, multipartMessages=10, broadcastRecipients=50):
+    """ :return: Send rate and latency percentiles, keyed by simulated modem latency (and multipart
+    and broadcast results, see runMultipart() and runBroadcast()) """
+    results = {}
+    for latency in latencies:
+        modem, package = createModem(SimulatedModem(latency=latency))
+        modem.connect()
+        sendLatencies = []
+        start = monotonic()
+        for i in range(messages):
+            sendStart = monotonic()
+            modem.sendSms('+27820001234', 'Benchmark message {0}'.format(i))
+            sendLatencies.append(monotonic() - sendStart)
+        duration = monotonic() - start
+        modem.close()
+        results[str(latency)] = {'messages': messages,
+                                 'sendRate': messages / duration,
+                                 'sendLatencyMedian': percentile(sendLatencies, 0.5),
+                                 'sendLatencyP99': percentile(sendLatencies, 0.99)}
+    results['multipart'] = runMultipart(messages=multipartMessages)
+    results['broadcast'] = runBroadcast(broadcastRecipients)
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='SMS sending benchmark')
+    parser.add_argument('-l', '--latency', type=float, action='append', help='simulated modem latency, in seconds (may be repeated)')
+    parser.add_argument('-m', '--messages', type=int, default=50, help='messages sent per latency')
+    parser.add_argument('-p', '--multipart-messages', type=int, default=10, help='multipart messages sent with and without AT+CMMS')
+    parser.add_argument('-b', '--broadcast-recipients', type=int, default=50, help='recipients of the broadcast sent with and without AT+CMSS')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    writeResults('sendsms', run(args.latency or DEFAULT_LATENCIES, args.messages, args.multipart_messages, args.broadcast_recipients), args.output)
+
+
+if __name__ == '__main__':
+    main()
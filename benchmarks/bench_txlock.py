@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+""" Transmit lock contention benchmark: sends SMS messages from several threads while incoming
+SMS notifications (+CMTI) are being handled, and reports who held (and waited for) the lock
+serializing serial port writes. An additional thread sends high priority messages (e.g. one-time
+PINs), to measure how long they wait behind the normal priority ones.
+"""
+
+from __future__ import print_function
+
+import sys, threading, time
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+from gsmmodem.scheduler import PRIORITY_HIGH
+
+from .harness import createModem, writeResults, percentile
+from .simmodem import SimulatedModem
+
+
+def run(senders=4, messages=25, urcRate=20.0, latency=0.005, jitter=0.002, urgentMessages=10):
+    """ Runs the send-while-receiving workload
+
+    :return: tuple of (results dict, the profiled lock)
+    """
+    simModem = SimulatedModem(latency=latency, jitter=jitter, seed=1)
+    received = []
+    modem, package = createModem(simModem, smsReceivedCallbackFunc=received.append)
+    lock = modem.enableLockProfiling()
+    modem.connect()
+    lock.reset() # Only profile the workload itself, not connect()
+    modem.scheduler.reset()
+    sendLatencies = []
+    urgentLatencies = []
+    sendErrors = []
+    done = threading.Event()
+
+    def sender(number):
+        for i in range(messages):
+            start = monotonic()
+            try:
+                modem.sendSms('+2782{0:07d}'.format(number), 'Benchmark message {0}'.format(i))
+            except Exception as e:
+                sendErrors.append(repr(e))
+            else:
+                sendLatencies.append(monotonic() - start)
+
+    def urgentSender():
+        for i in range(urgentMessages):
+            time.sleep(0.05)
+            start = monotonic()
+            try:
+                modem.sendSms('+27829999999', 'Your one-time PIN is {0:04d}'.format(i), priority=PRIORITY_HIGH)
+            except Exception as e:
+                sendErrors.append(repr(e))
+            else:
+                urgentLatencies.append(monotonic() - start)
+
+    def injector():
+        injected = 0
+        while not done.wait(1.0 / urcRate):
+            index = simModem.storeSms()
+            package.port.inject('\r\n+CMTI: "SM",{0}\r\n'.format(index))
+            injected += 1
+        injectedCount.append(injected)
+
+    injectedCount = []
+    injectorThread = threading.Thread(target=injector)
+    injectorThread.start()
+    start = monotonic()
+    threads = [threading.Thread(target=sender, args=(n,)) for n in range(senders)]
+    threads.append(threading.Thread(target=urgentSender))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = monotonic() - start
+    done.set()
+    injectorThread.join()
+    time.sleep(0.5) # Allow outstanding notifications to be handled
+    modem.close()
+    stats = lock.stats()
+    results = {'parameters': {'senders': senders, 'messages': messages, 'urcRate': urcRate, 'latency': latency, 'jitter': jitter, 'urgentMessages': urgentMessages},
+               'duration': duration,
+               'sent': len(sendLatencies),
+               'sendErrors': len(sendErrors),
+               'sendRate': len(sendLatencies) / duration,
+               'sendLatencyMedian': percentile(sendLatencies, 0.5),
+               'sendLatencyP99': percentile(sendLatencies, 0.99),
+               'urgentLatencyMedian': percentile(urgentLatencies, 0.5),
+               'urgentLatencyP99': percentile(urgentLatencies, 0.99),
+               'scheduler': modem.scheduler.stats(),
+               'notificationsInjected': injectedCount[0],
+               'smsReceived': len(received),
+               'lock': stats}
+    return results, lock
+
+
+def main():
+    parser = ArgumentParser(description='Transmit lock contention benchmark (send-while-receiving workload)')
+    parser.add_argument('-s', '--senders', type=int, default=4, help='number of sending threads')
+    parser.add_argument('-m', '--messages', type=int, default=25, help='messages sent per thread')
+    parser.add_argument('-u', '--urc-rate', type=float, default=20.0, help='incoming SMS notifications per second')
+    parser.add_argument('-l', '--latency', type=float, default=0.005, help='simulated modem response latency, in seconds')
+    parser.add_argument('-j', '--jitter', type=float, default=0.002, help='simulated modem response latency jitter, in seconds')
+    parser.add_argument('-U', '--urgent-messages', type=int, default=10, help='high priority messages sent by an additional thread')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    results, lock = run(args.senders, args.messages, args.urc_rate, args.latency, args.jitter, args.urgent_messages)
+    print(lock.dump(), file=sys.stderr)
+    writeResults('txlock', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
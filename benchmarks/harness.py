@@ -0,0 +1,178 @@
+""" In-process serial port and helpers shared by the benchmarks """
+
+from __future__ import print_function
+
+import sys, json, platform, threading, time
+
+from gsmmodem.compat import monotonic
+from gsmmodem.modem import GsmModem
+
+from .simmodem import SimulatedModem
+
+
+class FakeSerialPort(object):
+    """ Serial port object connected to a SimulatedModem
+
+    Unlike the mock serial port used by the test suite, reads block (up to the read timeout)
+    until data is available, and responses only become readable after the simulated modem's
+    response latency has passed.
+    """
+
+    def __init__(self, simModem, timeout=None):
+        self.simModem = simModem
+        self.timeout = timeout
+        self._rxBuffer = bytearray()
+        self._scheduled = [] # list of [ready time, data] entries, in order
+        self._cond = threading.Condition()
+        self._open = True
+        self._cancelled = False
+        self.bytesWritten = 0
+        self.bytesRead = 0
+
+    def _moveReady(self, now):
+        while self._scheduled and self._scheduled[0][0] <= now:
+            self._rxBuffer.extend(self._scheduled.pop(0)[1])
+
+    def read(self, size=1):
+        deadline = monotonic() + self.timeout if self.timeout != None else None
+        with self._cond:
+            while True:
+                now = monotonic()
+                self._moveReady(now)
+                if self._rxBuffer or not self._open or self._cancelled:
+                    break
+                waitUntil = self._scheduled[0][0] if self._scheduled else None
+                if deadline != None:
+                    if now >= deadline:
+                        break
+                    waitUntil = deadline if waitUntil == None else min(waitUntil, deadline)
+                self._cond.wait(waitUntil - now if waitUntil != None else None)
+            self._cancelled = False
+            data = bytes(self._rxBuffer[:size])
+            del self._rxBuffer[:size]
+        self.bytesRead += len(data)
+        return data
+
+    def write(self, data):
+        self.bytesWritten += len(data)
+        response = ''.join(self.simModem.handle(data))
+        if response:
+            latency = self.simModem.responseLatency()
+            with self._cond:
+                readyTime = monotonic() + latency
+                if self._scheduled:
+                    # The modem handles commands in order
+                    readyTime = max(readyTime, self._scheduled[-1][0])
+                self._scheduled.append([readyTime, response.encode()])
+                self._cond.notify_all()
+        return len(data)
+
+    def inject(self, data):
+        """ Makes data (e.g. an unsolicited notification) readable as soon as possible
+
+        Like real modems, the data is not inserted into a response that is still being sent.
+        """
+        if type(data) != bytes:
+            data = data.encode()
+        with self._cond:
+            if self._scheduled:
+                self._scheduled.append([self._scheduled[-1][0], data])
+            else:
+                self._rxBuffer.extend(data)
+            self._cond.notify_all()
+
+    def inWaiting(self):
+        with self._cond:
+            self._moveReady(monotonic())
+            return len(self._rxBuffer)
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._open = False
+            self._cond.notify_all()
+
+
+class FakeSerialPackage(object):
+    """ Replacement for the pyserial package, creating FakeSerialPort objects connected to a simulated modem """
+
+    class SerialException(Exception):
+        """ Fake serial exception """
+
+    def __init__(self, simModem):
+        self.simModem = simModem
+        self.ports = []
+
+    def Serial(self, *args, **kwargs):
+        port = FakeSerialPort(self.simModem, kwargs.get('timeout'))
+        self.ports.append(port)
+        return port
+
+    @property
+    def port(self):
+        """ :return: The most recently-opened serial port """
+        return self.ports[-1]
+
+
+def createModem(simModem=None, modemClass=GsmModem, **kwargs):
+    """ Creates a (not yet connected) modem object that talks to a simulated modem
+
+    The fake serial port is only used by the returned modem object (whenever it connects); the
+    serial package used by gsmmodem.serial_comms is not replaced, so other modems in the same
+    process (e.g. on real or pseudo-terminal ports) are not affected.
+
+    :return: tuple of (modem, serial package)
+    """
+    package = FakeSerialPackage(simModem or SimulatedModem())
+    modem = modemClass('/dev/simulated', **kwargs)
+    modem._openSerial = lambda: package.Serial(timeout=modem.timeout)
+    return modem, package
+
+
+def measureRate(func, minTime=1.0):
+    """ Calls func repeatedly for at least minTime seconds
+
+    :return: The number of calls per second
+    :rtype: float
+    """
+    calls = 0
+    start = monotonic()
+    end = start + minTime
+    while True:
+        func()
+        calls += 1
+        now = monotonic()
+        if now >= end:
+            return calls / (now - start)
+
+
+def percentile(values, fraction):
+    """ :return: The specified percentile (0-1) of the values, or None if there are none """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def writeResults(name, results, path=None):
+    """ Writes benchmark results as JSON, along with information about the environment
+
+    :param name: Name of the benchmark
+    :param results: The benchmark results (must be JSON-serializable)
+    :param path: File to write to; results are written to stdout if this is None
+    """
+    document = {'benchmark': name,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results}
+    if path == None:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
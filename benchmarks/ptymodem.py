@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+""" Simulated modem served on a pseudo-terminal (Linux/Unix only)
+
+Unlike the in-process fake serial ports used by the tests and the other benchmarks, this
+exercises real serial framing, timing and OS buffering: the modem under test is opened by
+pyserial like any other serial device. Run it standalone with::
+
+    python -m benchmarks.ptymodem --latency 0.02 --jitter 0.01 --urc-rate 1
+
+and point a GsmModem (or tools/gsmterm.py) at the device it prints, or use the PtyModem class
+directly from a load test.
+"""
+
+from __future__ import print_function
+
+import sys, os, tty, select, random, threading, time
+from argparse import ArgumentParser
+
+from gsmmodem.compat import monotonic
+
+from test import fakemodems
+from .simmodem import SimulatedModem
+
+CTRLZ = b'\x1a'
+ESC = b'\x1b'
+
+
+class PtyModem(object):
+    """ Serves a SimulatedModem on a pseudo-terminal
+
+    Commands written to the terminal are passed to the simulated modem; its responses are
+    written back after the modem's (simulated) response latency. Optionally, incoming SMS
+    notifications (+CMTI) are injected at random, at a configurable average rate.
+    """
+
+    def __init__(self, simModem=None, urcRate=0, seed=None):
+        """
+        :param simModem: The simulated modem (default: a GenericTestModem without latency)
+        :type simModem: benchmarks.simmodem.SimulatedModem
+        :param urcRate: Average number of incoming SMS notifications to inject per second (0 to disable)
+        :type urcRate: float
+        :param seed: Seed for the random number generator (notification timing)
+        """
+        self.simModem = simModem or SimulatedModem()
+        self.urcRate = urcRate
+        self.random = random.Random(seed)
+        self.port = None # Device name of the pseudo-terminal, once started
+        self.alive = False
+        self.notificationsInjected = 0
+        self._master = self._slave = None
+        self._outgoing = [] # list of [ready time, data] entries, in order
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """ Opens the pseudo-terminal and starts serving the simulated modem
+
+        :return: The device name of the pseudo-terminal
+        :rtype: str
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.alive = True
+        targets = [self._rxLoop, self._txLoop]
+        if self.urcRate > 0:
+            targets.append(self._notificationLoop)
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self.port
+
+    def stop(self):
+        """ Stops serving the simulated modem and closes the pseudo-terminal """
+        with self._cond:
+            self.alive = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def inject(self, data):
+        """ Sends data (e.g. an unsolicited notification) to the terminal as soon as possible
+
+        Like real modems, the data is not inserted into a response that is still being sent.
+        """
+        if type(data) != bytes:
+            data = data.encode()
+        self._send(data, 0)
+
+    def _send(self, data, latency):
+        with self._cond:
+            readyTime = monotonic() + latency
+            if self._outgoing:
+                # The modem handles commands in order
+                readyTime = max(readyTime, self._outgoing[-1][0])
+            self._outgoing.append([readyTime, data])
+            self._cond.notify_all()
+
+    def _rxLoop(self):
+        """ Reads commands from the terminal and passes them to the simulated modem """
+        rxBuffer = bytearray()
+        while self.alive:
+            if not select.select([self._master], [], [], 0.1)[0]:
+                continue
+            try:
+                rxBuffer.extend(os.read(self._master, 4096))
+            except OSError:
+                break
+            while True:
+                if self.simModem.awaitingSmsData:
+                    # SMS data is terminated by CTRL+Z (or cancelled by ESC) instead of CR
+                    ends = [i for i in (rxBuffer.find(CTRLZ), rxBuffer.find(ESC)) if i != -1]
+                    end = min(ends) if ends else -1
+                else:
+                    end = rxBuffer.find(b'\r')
+                if end == -1:
+                    break
+                command = bytes(rxBuffer[:end + 1])
+                del rxBuffer[:end + 1]
+                response = ''.join(self.simModem.handle(command))
+                if response:
+                    self._send(response.encode(), self.simModem.responseLatency())
+
+    def _txLoop(self):
+        """ Writes responses and notifications to the terminal once they are due """
+        while True:
+            with self._cond:
+                while self.alive and (not self._outgoing or self._outgoing[0][0] > monotonic()):
+                    self._cond.wait(max(0, self._outgoing[0][0] - monotonic()) if self._outgoing else None)
+                if not self.alive:
+                    return
+                data = self._outgoing.pop(0)[1]
+            try:
+                os.write(self._master, data)
+            except OSError:
+                return
+
+    def _notificationLoop(self):
+        """ Injects incoming SMS notifications at random intervals """
+        while self.alive:
+            time.sleep(self.random.expovariate(self.urcRate))
+            if self.alive:
+                index = self.simModem.storeSms()
+                self.inject('\r\n+CMTI: "SM",{0}\r\n'.format(index))
+                self.notificationsInjected += 1
+
+
+def main():
+    modemClasses = dict((cls.__name__, cls) for cls in fakemodems.modemClasses + [fakemodems.GenericTestModem])
+    parser = ArgumentParser(description='Simulated GSM modem, served on a pseudo-terminal')
+    parser.add_argument('-m', '--modem', default='GenericTestModem', choices=sorted(modemClasses), help='fake modem descriptor to take responses from')
+    parser.add_argument('-l', '--latency', type=float, default=0, help='mean response latency, in seconds')
+    parser.add_argument('-j', '--jitter', type=float, default=0, help='maximum response latency deviation, in seconds')
+    parser.add_argument('-u', '--urc-rate', type=float, default=0, help='average number of incoming SMS notifications per second')
+    parser.add_argument('-e', '--error-rate', type=float, default=0, help='fraction (0-1) of AT+ commands that fail with a "busy" error')
+    parser.add_argument('--error', default='CME', choices=('CME', 'CMS'), help='error type to inject (code 515)')
+    parser.add_argument('-s', '--stored', type=int, default=0, help='number of SMS messages initially stored in the modem')
+    parser.add_argument('--seed', type=int, help='random seed')
+    args = parser.parse_args()
+    simModem = SimulatedModem(modemClasses[args.modem](), args.latency, args.jitter, args.error_rate, '+{0} ERROR: 515'.format(args.error), args.seed)
+    for i in range(args.stored):
+        simModem.storeSms()
+    ptyModem = PtyModem(simModem, args.urc_rate, args.seed)
+    print('Simulated modem ready on: {0}'.format(ptyModem.start()))
+    print('Press CTRL+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    ptyModem.stop()
+    print('\n{0} commands handled, {1} errors injected, {2} notifications injected'.format(simModem.commandCount, simModem.injectedErrors, ptyModem.notificationsInjected))
+
+
+if __name__ == '__main__':
+    main()
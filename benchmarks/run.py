@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+""" Runs all benchmarks and writes their results as a single JSON document
+
+Results of different runs (e.g. releases) can be compared with --compare::
+
+    python -m benchmarks.run -o baseline.json
+    ...
+    python -m benchmarks.run --compare baseline.json
+"""
+
+from __future__ import print_function
+
+import sys, json
+from argparse import ArgumentParser
+
+from . import bench_pdu, bench_readloop, bench_sendsms, bench_notifications, bench_liststored, bench_txlock, bench_reactor, bench_parse
+from .harness import writeResults
+
+# Benchmarks, by name: (run function, arguments for a full run, arguments for a quick run)
+BENCHMARKS = [('pdu', bench_pdu.run, {}, {'minTime': 0.2}),
+              ('readloop', bench_readloop.run, {}, {'lines': 5000}),
+              ('sendsms', bench_sendsms.run, {}, {'messages': 20, 'multipartMessages': 5, 'broadcastRecipients': 20}),
+              ('notifications', bench_notifications.run, {}, {'notifications': 50}),
+              ('liststored', bench_liststored.run, {}, {'counts': (50, 250), 'repeat': 1}),
+              ('txlock', lambda **kwargs: bench_txlock.run(**kwargs)[0], {}, {'messages': 5}),
+              ('reactor', bench_reactor.run, {}, {'modems': 4, 'commands': 20, 'idleTime': 0.5}),
+              ('parse', bench_parse.run, {}, {'minTime': 0.2})]
+
+
+def flatten(results, prefix=''):
+    """ :return: dict of all numeric values in the (nested) results, keyed by their path (e.g. "pdu.gsm7.encodeRate") """
+    values = {}
+    for key, value in results.items():
+        path = prefix + str(key)
+        if isinstance(value, dict):
+            values.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(baseline, results, out=sys.stdout):
+    """ Prints the relative change of every value in results compared to the baseline """
+    baselineValues = flatten(baseline)
+    for path, value in sorted(flatten(results).items()):
+        if path.split('.')[1] == 'parameters':
+            continue
+        oldValue = baselineValues.get(path)
+        if oldValue:
+            print('{0:60} {1:>14.6g} {2:>14.6g} {3:>+8.1f}%'.format(path, oldValue, value, (value - oldValue) * 100.0 / oldValue), file=out)
+        else:
+            print('{0:60} {1:>14} {2:>14.6g}'.format(path, '-', value), file=out)
+
+
+def main():
+    parser = ArgumentParser(description='Runs the python-gsmmodem benchmarks')
+    parser.add_argument('-b', '--benchmark', action='append', choices=[b[0] for b in BENCHMARKS], help='benchmark to run (may be repeated; default: all)')
+    parser.add_argument('-q', '--quick', action='store_true', help='use smaller workloads (less accurate, but faster)')
+    parser.add_argument('-c', '--compare', metavar='FILE', help='compare the results to a previous run written to FILE')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+    results = {}
+    for name, run, fullArgs, quickArgs in BENCHMARKS:
+        if args.benchmark and name not in args.benchmark:
+            continue
+        print('Running {0} benchmark...'.format(name), file=sys.stderr)
+        results[name] = run(**(quickArgs if args.quick else fullArgs))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        compare(baseline, results, sys.stderr)
+    writeResults('suite', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
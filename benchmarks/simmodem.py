@@ -0,0 +1,185 @@
+""" Simulated modem protocol engine, driven by the fake modem descriptors used by the test suite """
+
+import random, threading, codecs
+
+from gsmmodem.pdu import encodeSemiOctets
+
+from test import fakemodems
+
+# SMS-DELIVER PDU used for stored messages, unless another PDU is specified
+DEFAULT_PDU = '06917228195339040A9110325476980000313080512061800CC8329BFD06DDDF72363904'
+
+
+def tpduLength(pdu):
+    """ :return: The TPDU length (in octets) of the specified hex-encoded PDU (i.e. excluding the SMSC header) """
+    smscLength = int(pdu[:2], 16)
+    return len(pdu) // 2 - smscLength - 1
+
+
+def deliverPdu(number):
+    """ :return: A hex-encoded SMS-DELIVER PDU like DEFAULT_PDU, but sent from the specified (international) number """
+    number = number.lstrip('+')
+    address = codecs.encode(bytes(encodeSemiOctets(number)), 'hex_codec').decode().upper()
+    return '0691722819533904{0:02X}91{1}0000313080512061800CC8329BFD06DDDF72363904'.format(len(number), address)
+
+
+class SimulatedModem(object):
+    """ Generates responses for AT commands written to a (simulated) modem
+
+    Responses are taken from a fakemodems.FakeModem descriptor; on top of that, this class
+    implements the SMS data prompt used by AT+CMGS and AT+CMGW, and a simple SMS message store for
+    AT+CMGR/AT+CMGL/AT+CMGD/AT+CMSS. It also decides how long the simulated modem takes to respond.
+    """
+
+    def __init__(self, fakeModem=None, latency=0, jitter=0, errorRate=0, errorResponse='+CME ERROR: 515', seed=None, linkSetupTime=0, cmmsSupported=True, cmssSupported=True):
+        """
+        :param fakeModem: The fake modem descriptor to take responses from (default: fakemodems.GenericTestModem)
+        :type fakeModem: test.fakemodems.FakeModem
+        :param latency: Mean response latency, in seconds
+        :type latency: float
+        :param jitter: Maximum random deviation from the mean latency, in seconds
+        :type jitter: float
+        :param errorRate: Fraction (0-1) of AT+ commands that fail with errorResponse
+        :type errorRate: float
+        :param errorResponse: The error injected for failed commands (default: "device busy")
+        :type errorResponse: str
+        :param seed: Seed for the random number generator (latency jitter and error injection)
+        :param linkSetupTime: Extra time (in seconds) taken to send an SMS if the SMS relay link is not kept open (AT+CMMS=2)
+        :type linkSetupTime: float
+        :param cmmsSupported: Whether the simulated modem supports AT+CMMS
+        :type cmmsSupported: bool
+        :param cmssSupported: Whether the simulated modem supports sending from storage (AT+CMGW and AT+CMSS)
+        :type cmssSupported: bool
+        """
+        self.fakeModem = fakeModem or fakemodems.GenericTestModem()
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.errorResponse = errorResponse
+        self.linkSetupTime = linkSetupTime
+        self.cmmsSupported = cmmsSupported
+        self.cmssSupported = cmssSupported
+        self.random = random.Random(seed)
+        self.storedSms = {} # key: index; value: (status, PDU)
+        self.commandCount = 0
+        self.injectedErrors = 0
+        self._nextIndex = 0
+        self._smsRef = 0
+        self._awaitingSmsData = False
+        self._storingSms = False # The "> " prompt was sent for AT+CMGW (rather than AT+CMGS)
+        self._keepLinkOpen = False # AT+CMMS=2 set
+        self._linkOpen = False
+        self._extraLatency = 0 # Added to the latency of the next response
+        self._lock = threading.Lock()
+
+    @property
+    def awaitingSmsData(self):
+        """ True if the modem has sent a "> " prompt, and expects SMS data (terminated by CTRL+Z) """
+        return self._awaitingSmsData
+
+    def responseLatency(self):
+        """ :return: The time (in seconds) the simulated modem takes to respond to a command """
+        extraLatency, self._extraLatency = self._extraLatency, 0
+        if self.jitter:
+            return max(0, self.latency + self.random.uniform(-self.jitter, self.jitter)) + extraLatency
+        return self.latency + extraLatency
+
+    def storeSms(self, pdu=DEFAULT_PDU, status=0):
+        """ Stores an SMS message in the simulated modem's memory
+
+        :return: The index of the stored message
+        :rtype: int
+        """
+        with self._lock:
+            index = self._nextIndex
+            self._nextIndex += 1
+            self.storedSms[index] = (status, pdu)
+        return index
+
+    def handle(self, data):
+        """ Handles a single command (or SMS data, after a "> " prompt) written to the modem
+
+        :param data: The command, including its terminator ("\\r" or CTRL+Z)
+        :type data: str or bytes
+
+        :return: The response, as a list of strings
+        :rtype: list
+        """
+        if type(data) == bytes:
+            data = data.decode()
+        with self._lock:
+            self.commandCount += 1
+            if self._awaitingSmsData:
+                self._awaitingSmsData = False
+                if data.endswith(chr(27)): # ESC: cancelled
+                    return ['OK\r\n']
+                if self._storingSms:
+                    index = self._nextIndex
+                    self._nextIndex += 1
+                    self.storedSms[index] = (2, data.rstrip(chr(26)))
+                    return ['+CMGW: {0}\r\n'.format(index), 'OK\r\n']
+                return ['+CMGS: {0}\r\n'.format(self._sendSms()), 'OK\r\n']
+            if self.errorRate and data.startswith('AT+') and self.random.random() < self.errorRate:
+                self.injectedErrors += 1
+                return [self.errorResponse + '\r\n']
+            command = data.rstrip('\r')
+            if command.startswith(('AT+CMGW=', 'AT+CMSS=')) and not self.cmssSupported:
+                return ['ERROR\r\n']
+            elif command.startswith(('AT+CMGS=', 'AT+CMGW=')):
+                self._awaitingSmsData = True
+                self._storingSms = command.startswith('AT+CMGW=')
+                return ['\r\n> ']
+            elif command.startswith('AT+CMSS='):
+                if int(command[8:].split(',')[0]) not in self.storedSms:
+                    return ['+CMS ERROR: 321\r\n']
+                return ['+CMSS: {0}\r\n'.format(self._sendSms()), 'OK\r\n']
+            elif command.startswith('AT+CMGR='):
+                return self._readSms(int(command[8:]))
+            elif command.startswith('AT+CMGL='):
+                return self._listSms(command[8:])
+            elif command.startswith('AT+CMGD='):
+                return self._deleteSms(command[8:])
+            elif command.startswith('AT+CMMS='):
+                if not self.cmmsSupported:
+                    return ['ERROR\r\n']
+                self._keepLinkOpen = command[8:] == '2'
+                self._linkOpen = self._linkOpen and self._keepLinkOpen
+                return ['OK\r\n']
+        return self.fakeModem.getResponse(data)
+
+    def _sendSms(self):
+        """ Simulates sending an SMS message
+
+        :return: The message reference
+        """
+        self._smsRef = (self._smsRef + 1) % 256
+        if not self._linkOpen:
+            self._extraLatency = self.linkSetupTime
+            self._linkOpen = self._keepLinkOpen
+        return self._smsRef
+
+    def _readSms(self, index):
+        if index not in self.storedSms:
+            return ['+CMS ERROR: 321\r\n']
+        status, pdu = self.storedSms[index]
+        return ['+CMGR: {0},,{1}\r\n'.format(status, tpduLength(pdu)), pdu + '\r\n', 'OK\r\n']
+
+    def _listSms(self, status):
+        status = int(status) if status.isdigit() else 4
+        response = []
+        for index in sorted(self.storedSms):
+            msgStatus, pdu = self.storedSms[index]
+            if status == 4 or status == msgStatus:
+                response.append('+CMGL: {0},{1},,{2}\r\n'.format(index, msgStatus, tpduLength(pdu)))
+                response.append(pdu + '\r\n')
+        response.append('OK\r\n')
+        return response
+
+    def _deleteSms(self, args):
+        args = args.split(',')
+        if len(args) > 1 and int(args[1]) > 0:
+            # Delete flag set: delete by status (approximated as "delete all")
+            self.storedSms.clear()
+        else:
+            self.storedSms.pop(int(args[0]), None)
+        return ['OK\r\n']
@@ -0,0 +1,239 @@
+""" Recording and replaying of serial port sessions
+
+To record a session, assign a CaptureWriter to the ``capture`` attribute of a modem (GsmModem
+or SerialComms) before connecting::
+
+    modem = GsmModem('/dev/ttyUSB0')
+    modem.capture = CaptureWriter('session.cap')
+    modem.connect()
+
+Every chunk of data read from or written to the serial port is then recorded, along with a
+monotonic timestamp. A recorded session can be fed back into a modem object by using a
+"replay://" port::
+
+    modem = GsmModem('replay://session.cap') # replay at the original speed
+    modem = GsmModem('replay://session.cap?speed=0') # replay as fast as possible
+
+Capture file format: the MAGIC header, followed by records consisting of a RECORD_HEADER
+(direction: "R" or "W", timestamp in seconds since the start of the capture, data length)
+and the data itself.
+"""
+
+import struct, threading, logging
+
+from .compat import monotonic
+
+MAGIC = b'GSMCAP\x01\n'
+RECORD_HEADER = struct.Struct('<cdI')
+READ = b'R'
+WRITE = b'W'
+
+
+class CaptureWriter(object):
+    """ Writes serial port data to a capture file """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the capture file, or a file object opened in binary mode
+        :type path: str or file
+        """
+        self._file = open(path, 'wb') if isinstance(path, str) else path
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._start = monotonic()
+
+    def record(self, direction, data, timestamp=None):
+        """ Records data read from (READ) or written to (WRITE) the serial port
+
+        :param timestamp: Time of the event, in seconds since the start of the capture (default: now)
+        """
+        if timestamp == None:
+            timestamp = monotonic() - self._start
+        with self._lock:
+            self._file.write(RECORD_HEADER.pack(direction, timestamp, len(data)))
+            self._file.write(data)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def readCapture(path):
+    """ Reads all records from a capture file
+
+    :param path: Path of the capture file, or a file object opened in binary mode
+    :type path: str or file
+
+    :raise ValueError: if the file is not a valid capture file
+
+    :return: list of (direction, timestamp, data) tuples
+    :rtype: list
+    """
+    captureFile = open(path, 'rb') if isinstance(path, str) else path
+    try:
+        if captureFile.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a capture file: {0}'.format(path))
+        records = []
+        while True:
+            header = captureFile.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            direction, timestamp, length = RECORD_HEADER.unpack(header)
+            records.append((direction, timestamp, captureFile.read(length)))
+        return records
+    finally:
+        if captureFile is not path:
+            captureFile.close()
+
+
+class RecordingSerial(object):
+    """ Wraps a serial port object, recording all data read from and written to it """
+
+    def __init__(self, serialPort, captureWriter):
+        self.serialPort = serialPort
+        self.captureWriter = captureWriter
+
+    def read(self, size=1):
+        data = self.serialPort.read(size)
+        if data:
+            self.captureWriter.record(READ, data)
+        return data
+
+    def write(self, data):
+        self.captureWriter.record(WRITE, data)
+        return self.serialPort.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.serialPort, name)
+
+
+class ReplaySerial(object):
+    """ Serial port object that replays a recorded session
+
+    Recorded reads are returned in order, but never before the writes that preceded them in the
+    recording have been made: the modem object drives the replay the same way it drove the
+    original session. At the original speed, recorded reads are returned with the same delays
+    (relative to the preceding write) as in the recording.
+
+    Written data is compared to the recorded writes; differences are logged and counted.
+    """
+
+    log = logging.getLogger('gsmmodem.capture.ReplaySerial')
+
+    def __init__(self, path, speed=1.0, timeout=None):
+        """
+        :param path: Path of the capture file
+        :type path: str
+        :param speed: Replay speed factor; 1 for the original speed, or 0 to replay as fast as possible
+        :type speed: float
+        :param timeout: Read timeout, in seconds (None to block until data is available)
+        :type timeout: float
+        """
+        self.records = readCapture(path)
+        self.speed = speed
+        self.timeout = timeout
+        self.mismatches = 0 # Number of writes that differed from the recording
+        self._pos = 0
+        self._rxBuffer = bytearray()
+        self._txBuffer = bytearray()
+        self._cond = threading.Condition()
+        self._open = True
+        self._cancelled = False
+        # Replay clock anchor: (real time, capture time) of the last synchronisation point
+        self._anchor = (monotonic(), self.records[0][1] if self.records else 0)
+
+    @property
+    def finished(self):
+        """ True if all recorded data has been replayed """
+        return self._pos >= len(self.records) and not self._rxBuffer
+
+    def _releaseReads(self, now, force=False):
+        """ Moves due recorded reads to the receive buffer
+
+        :return: The real time at which the next recorded read is due, or None
+        """
+        while self._pos < len(self.records):
+            direction, timestamp, data = self.records[self._pos]
+            if direction != READ:
+                return None
+            if not force and self.speed:
+                dueTime = self._anchor[0] + (timestamp - self._anchor[1]) / self.speed
+                if dueTime > now:
+                    return dueTime
+            self._rxBuffer.extend(data)
+            self._pos += 1
+        return None
+
+    def read(self, size=1):
+        deadline = monotonic() + self.timeout if self.timeout != None else None
+        with self._cond:
+            while True:
+                now = monotonic()
+                dueTime = self._releaseReads(now)
+                if self._rxBuffer or not self._open or self._cancelled:
+                    break
+                if deadline != None:
+                    if now >= deadline:
+                        break
+                    dueTime = deadline if dueTime == None else min(dueTime, deadline)
+                self._cond.wait(dueTime - now if dueTime != None else None)
+            self._cancelled = False
+            data = bytes(self._rxBuffer[:size])
+            del self._rxBuffer[:size]
+        return data
+
+    def write(self, data):
+        now = monotonic()
+        with self._cond:
+            # Anything recorded before this write has been "sent" by the modem by now
+            self._releaseReads(now, force=True)
+            self._txBuffer.extend(data)
+            while self._pos < len(self.records) and self.records[self._pos][0] == WRITE:
+                direction, timestamp, expected = self.records[self._pos]
+                if len(self._txBuffer) < len(expected):
+                    break
+                if self._txBuffer[:len(expected)] != expected:
+                    self.mismatches += 1
+                    self.log.warning('Replay mismatch: wrote %r, expected %r', bytes(self._txBuffer[:len(expected)]), expected)
+                del self._txBuffer[:len(expected)]
+                self._pos += 1
+                self._anchor = (now, timestamp)
+            self._cond.notify_all()
+        return len(data)
+
+    def inWaiting(self):
+        with self._cond:
+            self._releaseReads(monotonic())
+            return len(self._rxBuffer)
+
+    def cancel_read(self):
+        """ Makes a (concurrently) blocked read() call return immediately """
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._open = False
+            self._cond.notify_all()
+
+
+def openReplay(port, timeout=None):
+    """ Creates a ReplaySerial object for a "replay://<path>[?speed=<factor>]" port
+
+    :return: The replay serial port object
+    :rtype: ReplaySerial
+    """
+    path = port[len('replay://'):]
+    speed = 1.0
+    if '?' in path:
+        path, query = path.split('?', 1)
+        for param in query.split('&'):
+            key, _, value = param.partition('=')
+            if key == 'speed':
+                speed = float(value)
+    return ReplaySerial(path, speed, timeout)
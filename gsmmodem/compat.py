@@ -19,4 +19,10 @@ if sys.version_info[0] == 2 and sys.version_info[1] < 7:
 if sys.version_info[0] == 2:
     str = str
 else:
-    str = lambda x: x
\ No newline at end of file
+    str = lambda x: x
+
+try:
+    from time import monotonic
+except ImportError: #pragma: no cover
+    # Python 2 has no monotonic clock in the standard library
+    from time import time as monotonic
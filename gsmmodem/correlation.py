@@ -0,0 +1,291 @@
+""" Correlation of SMS status reports with the sent messages they refer to
+
+Status reports identify the message they refer to by its TP-Message-Reference, a number between
+0 and 255 that wraps around. At high send rates, the same reference is reused (possibly for the
+same destination) while earlier messages are still awaiting their status report, so the
+reference alone is not enough to find the right message.
+
+The CorrelationStore indexes sent messages by (reference, destination number), and uses the
+send time to choose between messages sharing both: a status report's "time sent" is the SMSC
+timestamp of the message, which is close to the time it was sent by the modem. Entries expire
+after a configurable time-to-live, and the number of entries is bounded. Messages are only
+referenced weakly: once the application no longer holds a sent message, its status report is
+still matched with it (so that it is not attributed to another message), but resolves to None.
+
+Optionally, the store is persisted in an SQLite database, so that status reports received after
+a restart can still be correlated. Database writes are committed in batches, outside the store's
+lock. Batching is opportunistic: there is no background timer, so pending changes are only
+written when add() or resolve() finds ``batchSize`` changes pending or ``commitInterval`` seconds
+passed since the last commit, or when flush() or close() is called. Applications that may stop
+sending for a while should call flush() periodically (and close() on shutdown)::
+
+    modem.sentSms = CorrelationStore(path='/var/lib/myapp/sent-sms.db')
+"""
+
+import re, time, calendar, threading, weakref
+from collections import OrderedDict
+
+try:
+    import sqlite3
+except ImportError: #pragma: no cover
+    sqlite3 = None # Python built without SQLite support; persistence unavailable
+
+
+def normalizeNumber(number):
+    """ Normalizes a phone number for matching purposes
+
+    National and international formats of the same number are mapped to the same value by only
+    keeping the last 9 digits. Numbers without digits (e.g. alphanumeric senders) are returned as-is.
+
+    :rtype: str
+    """
+    if number == None:
+        return None
+    digits = re.sub(r'\D', '', number)
+    return digits[-9:] if digits else number
+
+
+def isFinalStatus(deliveryStatus):
+    """ :return: False if the status report's delivery status indicates that the SMSC is still trying to deliver the message (temporary error) """
+    return not (deliveryStatus != None and 0x20 <= deliveryStatus <= 0x3F)
+
+
+def _timestamp(dateTime):
+    """ :return: The (timezone-aware) datetime as a UNIX timestamp, or None if it is unknown or naive """
+    if dateTime == None or dateTime.tzinfo == None or dateTime.utcoffset() == None:
+        return None
+    return calendar.timegm(dateTime.utctimetuple())
+
+
+class _StrongRef(object):
+    """ Callable returning an object, like a weak reference (but keeping the object alive) """
+
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __call__(self):
+        return self.obj
+
+
+class CorrelationStore(object):
+    """ Bounded, expiring index of sent SMS messages awaiting status reports
+
+    All operations take (amortized) constant time; the only lists that are searched contain
+    the messages sharing a reference number (and destination) within the time-to-live.
+    """
+
+    def __init__(self, maxSize=100000, ttl=7 * 24 * 3600, path=None, sentSmsFactory=None, maxTimeDifference=900, batchSize=100, commitInterval=1.0):
+        """
+        :param maxSize: Maximum number of messages tracked; the oldest entries are evicted first
+        :type maxSize: int
+        :param ttl: Time (in seconds) after which messages are no longer tracked
+        :type ttl: float
+        :param path: Path of an SQLite database in which to persist the store (None to only keep it in memory)
+        :type path: str
+        :param sentSmsFactory: Function used to recreate messages loaded from the database, as
+                               factory(number, text, reference); defaults to gsmmodem.modem.SentSms
+        :param maxTimeDifference: Maximum difference (in seconds) between the time a message was sent and the SMSC
+                                  timestamp of a status report referring to it (None for no limit)
+        :type maxTimeDifference: float
+        :param batchSize: Maximum number of database changes committed at once
+        :type batchSize: int
+        :param commitInterval: Time (in seconds) after which the next add() or resolve() commits the pending database
+                               changes, even if the batch is not full (see the module documentation)
+        :type commitInterval: float
+
+        :raise ValueError: if persistence is requested, but SQLite support is unavailable
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.path = path
+        self.maxTimeDifference = maxTimeDifference
+        self.batchSize = batchSize
+        self.commitInterval = commitInterval
+        self._entries = OrderedDict() # key: entry ID; value: entry ([entry ID, reference, number key, SentSms reference, send time]), oldest first
+        self._byKey = {} # key: (reference, normalized number); value: list of entries
+        self._byReference = {} # key: reference; value: list of entries
+        self._nextId = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._dbLock = threading.Lock() # Serializes database writes (which are done without holding _lock)
+        self._dbPending = [] # Database changes that have not been written yet: (SQL statement, parameters)
+        self._lastCommit = 0
+        # Metrics
+        self.resolved = 0 # Number of status reports matched with a sent message
+        self.unresolved = 0 # Number of status reports that did not match any tracked message
+        self.evicted = 0 # Number of entries dropped because the store was full
+        self.expired = 0 # Number of entries dropped because their time-to-live passed
+        if path != None:
+            if sqlite3 == None:
+                raise ValueError('SQLite support is not available; cannot persist sent SMS messages')
+            self._open(path, sentSmsFactory)
+
+    def _open(self, path, sentSmsFactory):
+        """ Opens (or creates) the database, and loads the entries that have not expired yet """
+        if sentSmsFactory == None:
+            from .modem import SentSms
+            sentSmsFactory = SentSms
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS sent_sms (id INTEGER PRIMARY KEY, reference INTEGER, number TEXT, text TEXT, send_time REAL)')
+        self._db.execute('DELETE FROM sent_sms WHERE send_time < ?', (time.time() - self.ttl,))
+        self._db.commit()
+        self._lastCommit = time.time()
+        rows = self._db.execute('SELECT id, reference, number, text, send_time FROM sent_sms ORDER BY id DESC LIMIT ?', (self.maxSize,)).fetchall()
+        for entryId, reference, number, text, sendTime in reversed(rows):
+            # Nothing else holds messages loaded from the database; keep them until their status report is received
+            self._index([entryId, reference, normalizeNumber(number), _StrongRef(sentSmsFactory(number, text, reference)), sendTime])
+            self._nextId = entryId + 1
+
+    def close(self):
+        """ Writes any pending changes to the database, and closes it (if any) """
+        self.flush()
+        with self._dbLock:
+            if self._db != None:
+                self._db.close()
+                self._db = None
+
+    def flush(self):
+        """ Writes (and commits) the pending database changes, if any """
+        with self._lock:
+            pending = self._dbPending
+            self._dbPending = []
+        if not pending:
+            return
+        with self._dbLock:
+            if self._db != None:
+                for statement, parameters in pending:
+                    self._db.execute(statement, parameters)
+                self._db.commit()
+                self._lastCommit = time.time()
+
+    def _flushIfDue(self, now):
+        """ Writes the pending database changes if the batch is full, or the commit interval has passed """
+        pending = len(self._dbPending)
+        if pending > 0 and (pending >= self.batchSize or now - self._lastCommit >= self.commitInterval):
+            self.flush()
+
+    def add(self, sms, sendTime=None):
+        """ Starts tracking a sent message
+
+        Only messages that requested a status report should be added. The message is only
+        referenced weakly (see the module documentation).
+
+        :param sms: The sent message
+        :type sms: gsmmodem.modem.SentSms
+        :param sendTime: The time the message was sent, as a UNIX timestamp (default: now)
+        :type sendTime: float
+        """
+        now = time.time()
+        if sendTime == None:
+            sendTime = now
+        with self._lock:
+            self._expire(now)
+            entryId = self._nextId
+            self._nextId = entryId + 1
+            if self._db != None:
+                self._dbPending.append(('INSERT INTO sent_sms (id, reference, number, text, send_time) VALUES (?, ?, ?, ?, ?)',
+                                        (entryId, sms.reference, sms.number, sms.text, sendTime)))
+            self._index([entryId, sms.reference, normalizeNumber(sms.number), weakref.ref(sms), sendTime])
+            while len(self._entries) > self.maxSize:
+                self._remove(self._entries[next(iter(self._entries))])
+                self.evicted += 1
+        if self._db != None:
+            self._flushIfDue(now)
+
+    def resolve(self, report):
+        """ Finds the sent message that a status report refers to
+
+        Of the tracked messages with the report's reference and destination number (or just the
+        reference, if the report has no number), the one sent closest to the report's SMSC
+        timestamp is chosen, provided that it was sent within maxTimeDifference seconds of it; if
+        the report has no (timezone-aware) timestamp, the oldest one is chosen. The message is no
+        longer tracked afterwards, unless the report indicates that the SMSC is still trying to
+        deliver it.
+
+        :param report: The status report
+        :type report: gsmmodem.modem.StatusReport
+
+        :return: The sent message, or None if no tracked message matches the report (or the
+                 matching message is no longer referenced by the application)
+        :rtype: gsmmodem.modem.SentSms
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            numberKey = normalizeNumber(report.number)
+            if numberKey != None:
+                candidates = self._byKey.get((report.reference, numberKey))
+            else:
+                candidates = self._byReference.get(report.reference)
+            entry = None
+            if candidates:
+                reportTime = _timestamp(report.timeSent)
+                if reportTime != None:
+                    entry = min(candidates, key=lambda entry: abs(entry[4] - reportTime))
+                    if self.maxTimeDifference != None and abs(entry[4] - reportTime) > self.maxTimeDifference:
+                        entry = None
+                else:
+                    entry = candidates[0]
+            if entry == None:
+                self.unresolved += 1
+                return None
+            if isFinalStatus(report.deliveryStatus):
+                self._remove(entry)
+            self.resolved += 1
+            sms = entry[3]()
+        if self._db != None:
+            self._flushIfDue(now)
+        return sms
+
+    def _index(self, entry):
+        self._entries[entry[0]] = entry
+        self._byKey.setdefault((entry[1], entry[2]), []).append(entry)
+        self._byReference.setdefault(entry[1], []).append(entry)
+
+    def _remove(self, entry):
+        del self._entries[entry[0]]
+        for index, key in ((self._byKey, (entry[1], entry[2])), (self._byReference, entry[1])):
+            entries = index[key]
+            entries.remove(entry)
+            if not entries:
+                del index[key]
+        if self._db != None:
+            self._dbPending.append(('DELETE FROM sent_sms WHERE id = ?', (entry[0],)))
+
+    def _expire(self, now):
+        """ Removes the entries whose time-to-live has passed """
+        oldest = now - self.ttl
+        while self._entries:
+            entry = self._entries[next(iter(self._entries))]
+            if entry[4] >= oldest:
+                break
+            self._remove(entry)
+            self.expired += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, reference):
+        return reference in self._byReference
+
+    def __getitem__(self, reference):
+        """ :return: The most recently sent message with the specified reference number """
+        with self._lock:
+            entries = self._byReference.get(reference)
+            sms = entries[-1][3]() if entries else None
+            if sms == None:
+                raise KeyError(reference)
+            return sms
+
+    @property
+    def metrics(self):
+        """ :return: A snapshot of this store's metrics
+        :rtype: dict
+        """
+        return {'tracked': len(self._entries),
+                'resolved': self.resolved,
+                'unresolved': self.unresolved,
+                'evicted': self.evicted,
+                'expired': self.expired}
@@ -14,9 +14,7 @@ is exploratory; I simply want to see what the possibilities are with it.
 Use the "main" branch, and the GsmModem class if you want to build normal applications.
 """
 
-import re
-
-from .util import allLinesMatchingPattern
+from . import grammar
 from .modem import GsmModem
 
 class PdpContext(object):
@@ -59,8 +57,7 @@ class GprsModem(GsmModem):
         """
         result = []
         cgdContResult = self.write('AT+CGDCONT?')
-        matches = allLinesMatchingPattern(re.compile(r'^\+CGDCONT:\s*(\d+),"([^"]+)","([^"]+)","([^"]+)",(\d+),(\d+)'), cgdContResult)
-        for cgdContMatch in matches:
+        for cgdContMatch in grammar.CGDCONT.allMatches(cgdContResult):
             cid, pdpType, apn, pdpAddress, dataCompression, headerCompression = cgdContMatch.groups()
             pdpContext = PdpContext(cid, pdpType, apn, pdpAddress, dataCompression, headerCompression)
             result.append(pdpContext)
@@ -0,0 +1,239 @@
+""" Registry of precompiled AT command response grammars
+
+Response lines are parsed with regular expressions. Compiling a pattern costs far more than
+matching it, so the grammars used to parse responses are compiled once, when this module is
+imported, and registered by name. Each grammar has a literal prefix that every line it matches
+starts with; Grammar.match() checks this prefix before running the regular expression, which
+makes rejecting lines of other responses cheap.
+
+Patterns that are only known at runtime (e.g. passed to gsmmodem.util.lineMatching()) are
+compiled once with compiled(), and kept in a bounded cache.
+
+Unsolicited notifications that can never be part of a command's response (e.g. +CMTI) are
+registered with registerNotification(). Lines matching these grammars are passed on as
+notifications even if they are read while a command is waiting for its response.
+
+The final result codes that end a command's response are detected with a TerminatorSet instead
+of a regular expression. The terminators differ between modems; TERMINATOR_PROFILES contains
+sets for common modem profiles, and sets can be extended with vendor-specific codes::
+
+    modem.responseTerminators = TERMINATOR_PROFILES['standard'].extend(['NO CARRIER', 'BUSY'])
+"""
+
+import re
+
+# Registered grammars, by name
+GRAMMARS = {}
+# Registered notification grammars (see registerNotification())
+NOTIFICATIONS = []
+_notificationFirstChars = set()
+
+# Patterns compiled by compiled(), by (regexStr, flags); cleared when it grows beyond _COMPILED_CACHE_SIZE
+_compiledCache = {}
+_COMPILED_CACHE_SIZE = 256
+
+
+class Grammar(object):
+    """ A precompiled response line pattern, with a literal prefix that is checked first """
+
+    __slots__ = ('name', 'pattern', 'prefix')
+
+    def __init__(self, name, regexStr, prefix='', flags=0):
+        """
+        :param name: Name of this grammar (used to look it up with get())
+        :type name: str
+        :param regexStr: Regular expression matching the response line
+        :type regexStr: str
+        :param prefix: Literal prefix of every line matched by the regular expression (may be empty)
+        :type prefix: str
+        :param flags: Regular expression flags
+        :type flags: int
+        """
+        self.name = name
+        self.pattern = re.compile(regexStr, flags)
+        self.prefix = prefix
+
+    def match(self, line):
+        """ :return: The regular expression match for the line, or None if it does not match
+        :rtype: re.Match
+        """
+        if line.startswith(self.prefix):
+            return self.pattern.match(line)
+        return None
+
+    def matchLines(self, lines):
+        """ :return: The match for the first matching line, or None if no line matches
+        :rtype: re.Match
+        """
+        for line in lines:
+            if line.startswith(self.prefix):
+                m = self.pattern.match(line)
+                if m:
+                    return m
+        return None
+
+    def allMatches(self, lines):
+        """ :return: The matches for all lines that match, in order
+        :rtype: list
+        """
+        result = []
+        for line in lines:
+            if line.startswith(self.prefix):
+                m = self.pattern.match(line)
+                if m:
+                    result.append(m)
+        return result
+
+    def __repr__(self):
+        return 'Grammar({0!r}, {1!r})'.format(self.name, self.pattern.pattern)
+
+
+def register(name, regexStr, prefix='', flags=0):
+    """ Compiles and registers a response grammar
+
+    :raise ValueError: if a grammar with the same name is already registered
+
+    :return: The registered grammar
+    :rtype: Grammar
+    """
+    if name in GRAMMARS:
+        raise ValueError('Response grammar already registered: {0}'.format(name))
+    grammar = GRAMMARS[name] = Grammar(name, regexStr, prefix, flags)
+    return grammar
+
+
+def registerNotification(name, regexStr, prefix, flags=0):
+    """ Compiles and registers the grammar of an unsolicited notification line that is never part
+    of a command's response
+
+    Lines that may legitimately appear in a response (e.g. "RING", which may be the text of a
+    message read in SMS text mode) must not be registered.
+
+    :param prefix: Literal prefix of every line matched by the regular expression (may not be empty)
+    :type prefix: str
+
+    :raise ValueError: if a grammar with the same name is already registered, or the prefix is empty
+
+    :return: The registered grammar
+    :rtype: Grammar
+    """
+    if not prefix:
+        raise ValueError('Notification grammar requires a prefix: {0}'.format(name))
+    grammar = register(name, regexStr, prefix, flags)
+    NOTIFICATIONS.append(grammar)
+    _notificationFirstChars.add(prefix[0])
+    return grammar
+
+
+def isNotification(line):
+    """ :return: True if the line matches a registered notification grammar
+    :rtype: bool
+    """
+    if line[:1] in _notificationFirstChars:
+        for grammar in NOTIFICATIONS:
+            if grammar.match(line):
+                return True
+    return False
+
+
+def get(name):
+    """ :return: The registered grammar with the specified name
+    :rtype: Grammar
+
+    :raise KeyError: if no such grammar is registered
+    """
+    return GRAMMARS[name]
+
+
+def compiled(regexStr, flags=0):
+    """ Compiles a regular expression string, caching the result
+
+    The cache is bounded: like the re module's own cache, it is cleared when it is full, so
+    callers passing many distinct (e.g. generated) patterns do not grow it without limit.
+
+    :return: The compiled pattern
+    :rtype: re.Pattern
+    """
+    key = (regexStr, flags)
+    pattern = _compiledCache.get(key)
+    if pattern == None:
+        if len(_compiledCache) >= _COMPILED_CACHE_SIZE:
+            _compiledCache.clear()
+        pattern = _compiledCache[key] = re.compile(regexStr, flags)
+    return pattern
+
+
+class TerminatorSet(object):
+    """ Detects the final result code lines that end a command's response
+
+    A line ends a response if it is one of the terminators (the whole line, so data lines such
+    as "OKAY" do not), or if it starts with one of the prefixes (e.g. "+CME ERROR:"). This costs
+    about the same per line as the RESPONSE_TERM regular expression it replaces; unlike that
+    pattern, the terminators can be configured per modem.
+    """
+
+    __slots__ = ('terminators', 'prefixes')
+
+    def __init__(self, terminators=None, prefixes=None):
+        """
+        :param terminators: Lines that end a response (exact matches); defaults to RESPONSE_TERMINATORS
+        :type terminators: iterable of str
+        :param prefixes: Prefixes of lines that end a response (e.g. error codes); defaults to RESPONSE_TERMINATOR_PREFIXES
+        :type prefixes: iterable of str
+        """
+        self.terminators = frozenset(RESPONSE_TERMINATORS if terminators == None else terminators)
+        self.prefixes = tuple(RESPONSE_TERMINATOR_PREFIXES if prefixes == None else prefixes)
+
+    def extend(self, terminators=(), prefixes=()):
+        """ :return: A new TerminatorSet with the terminators (and prefixes) of this one, and the specified ones
+        :rtype: TerminatorSet
+        """
+        return TerminatorSet(self.terminators.union(terminators), self.prefixes + tuple(prefix for prefix in prefixes if prefix not in self.prefixes))
+
+    def match(self, line):
+        """ :return: True if the line ends a command's response
+        :rtype: bool
+        """
+        return line in self.terminators or line.startswith(self.prefixes)
+
+    __contains__ = match
+
+    def __repr__(self):
+        return 'TerminatorSet({0!r}, {1!r})'.format(sorted(self.terminators), self.prefixes)
+
+
+# Final result codes that end a command's response
+RESPONSE_TERMINATORS = ('OK', 'ERROR', 'COMMAND NOT SUPPORT')
+# Prefixes of final result codes that end a command's response
+RESPONSE_TERMINATOR_PREFIXES = ('+CME ERROR:', '+CMS ERROR:')
+# Final result codes of call setup commands (ITU-T V.250) that some modems return instead of OK
+CALL_TERMINATORS = ('NO CARRIER', 'BUSY', 'NO ANSWER', 'NO DIALTONE')
+
+# Response terminator sets, by modem profile name (see SerialComms.responseTerminators)
+TERMINATOR_PROFILES = {'standard': TerminatorSet(),
+                       # Modems that end call setup (and data connection) commands with a V.250 result code
+                       'dialup': TerminatorSet().extend(CALL_TERMINATORS)}
+
+# Regular expression matching the standard response terminators (superseded by TerminatorSet)
+RESPONSE_TERM = register('RESPONSE_TERM', r'^OK|ERROR|(\+CM[ES] ERROR: \d+)|(COMMAND NOT SUPPORT)$')
+
+# Stored SMS message listings (AT+CMGL)
+CMGL_TEXT = register('CMGL_TEXT', r'^\+CMGL: (\d+),"([^"]+)","([^"]+)",[^,]*,"([^"]+)"$', '+CMGL: ')
+CMGL_PDU = register('CMGL_PDU', r'^\+CMGL:\s*(\d+),\s*(\d+),.*$', '+CMGL:')
+# Stored SMS message reads (AT+CMGR)
+CMGR_TEXT_DELIVER = register('CMGR_TEXT_DELIVER', r'^\+CMGR: "([^"]+)","([^"]+)",[^,]*,"([^"]+)"$', '+CMGR: ')
+CMGR_TEXT_REPORT = register('CMGR_TEXT_REPORT', r'^\+CMGR: ([^,]*),\d+,(\d+),"{0,1}([^"]*)"{0,1},\d*,"([^"]+)","([^"]+)",(\d+)$', '+CMGR: ')
+CMGR_PDU = register('CMGR_PDU', r'^\+CMGR:\s*(\d*),\s*"{0,1}([^"]*)"{0,1},\s*(\d+)$', '+CMGR:')
+# SMS messages routed directly to the TE (text mode +CMT header: originating address, alpha, SMSC timestamp)
+CMT_TEXT = register('CMT_TEXT', r'^\+CMT:\s*"([^"]*)",[^,]*,"([^"]+)"', '+CMT:')
+# PDP context definitions (AT+CGDCONT?)
+CGDCONT = register('CGDCONT', r'^\+CGDCONT:\s*(\d+),"([^"]+)","([^"]+)","([^"]+)",(\d+),(\d+)', '+CGDCONT:')
+
+# Unsolicited notifications (see registerNotification())
+URC_CMTI = registerNotification('URC_CMTI', r'^\+CMTI:\s*"[^"]*",\s*\d+$', '+CMTI:') # New SMS message stored
+URC_CDSI = registerNotification('URC_CDSI', r'^\+CDSI:\s*"[^"]*",\s*\d+$', '+CDSI:') # New SMS status report stored
+URC_CMT = registerNotification('URC_CMT', r'^\+CMT:', '+CMT:') # SMS message routed directly to the TE
+URC_CDS = registerNotification('URC_CDS', r'^\+CDS:', '+CDS:') # SMS status report routed directly to the TE
+URC_CBM = registerNotification('URC_CBM', r'^\+CBM:', '+CBM:') # Cell broadcast message routed directly to the TE
+URC_CRING = registerNotification('URC_CRING', r'^\+CRING:', '+CRING:') # Incoming call (extended format)
+URC_CLIP = registerNotification('URC_CLIP', r'^\+CLIP:\s*"', '+CLIP:') # Caller ID (unlike the response to AT+CLIP?, which starts with a number)
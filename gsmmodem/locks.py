@@ -0,0 +1,163 @@
+""" Instrumented locks, used for profiling lock contention """
+
+import sys, os, threading
+from bisect import bisect_left
+
+from .compat import monotonic
+
+try:
+    from threading import get_ident
+except ImportError: #pragma: no cover
+    from thread import get_ident # Python 2
+
+# Used to skip library-internal stack frames when determining call sites
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_THIS_MODULE = os.path.splitext(os.path.abspath(__file__))[0]
+
+
+class ProfiledRLock(object):
+    """ Drop-in replacement for threading.RLock that records contention statistics
+
+    Recorded statistics include the number of (contended) acquisitions, the current and maximum
+    number of waiting threads, a distribution of wait times, and hold times grouped by the call
+    site that acquired the lock. Call sites are the first stack frames outside of the
+    "pass-through" functions of the gsmmodem package (by default: the various write() methods),
+    so that time spent holding the lock is attributed to e.g. sendSms() or a notification handler.
+    """
+
+    # Upper bounds (in seconds) of the wait time distribution buckets
+    WAIT_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1, 10, float('inf'))
+
+    def __init__(self, name=None, passThrough=('write', 'acquire', '__enter__'), lock=None):
+        """
+        :param name: Name of this lock (used in dump())
+        :type name: str
+        :param passThrough: Names of gsmmodem-internal functions that are skipped when determining call sites
+        :type passThrough: tuple
+        :param lock: The re-entrant lock to instrument (default: a new threading.RLock), e.g. a gsmmodem.scheduler.PriorityLock
+        """
+        self.name = name
+        self.passThrough = frozenset(passThrough)
+        self._lock = lock if lock != None else threading.RLock()
+        self._statsLock = threading.Lock()
+        self._owner = None
+        self._depth = 0
+        self._acquiredAt = None
+        self._site = None
+        self.reset()
+
+    def reset(self):
+        """ Clears all recorded statistics """
+        with self._statsLock:
+            self.acquisitions = 0 # Number of (outermost) acquisitions
+            self.contended = 0 # Number of acquisitions that had to wait for another thread
+            self.waiting = 0 # Number of threads currently waiting for the lock
+            self.maxWaiting = 0 # Maximum number of threads that waited for the lock simultaneously
+            self.totalWait = 0 # Total time spent waiting for the lock, in seconds
+            self.maxWait = 0 # Longest time spent waiting for the lock, in seconds
+            self.waitHistogram = [0] * len(self.WAIT_BUCKETS) # Number of contended acquisitions per wait time bucket
+            self.holders = {} # key: call site; value: [acquisitions, total wait time, total hold time, max hold time]
+
+    def _callSite(self):
+        """ :return: the first stack frame (as "file:line (function)") outside of the lock and gsmmodem pass-through functions """
+        frame = sys._getframe(1)
+        while frame != None:
+            code = frame.f_code
+            path = os.path.abspath(code.co_filename)
+            if not (os.path.splitext(path)[0] == _THIS_MODULE or (os.path.dirname(path) == _PACKAGE_DIR and code.co_name in self.passThrough)):
+                return '{0}:{1} ({2})'.format(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)
+            frame = frame.f_back
+        return '<unknown>'
+
+    def acquire(self, blocking=True, timeout=-1):
+        me = get_ident()
+        if self._owner == me:
+            # Re-entrant acquisition; not recorded separately
+            self._lock.acquire()
+            self._depth += 1
+            return True
+        waitTime = 0
+        if not self._lock.acquire(False):
+            if not blocking:
+                return False
+            with self._statsLock:
+                self.waiting += 1
+                self.maxWaiting = max(self.maxWaiting, self.waiting)
+            waitStart = monotonic()
+            try:
+                acquired = self._lock.acquire(True, timeout) if timeout >= 0 else self._lock.acquire()
+            finally:
+                with self._statsLock:
+                    self.waiting -= 1
+            if not acquired:
+                return False
+            waitTime = monotonic() - waitStart
+        self._owner = me
+        self._depth = 1
+        self._site = self._callSite()
+        self._acquiredAt = monotonic()
+        with self._statsLock:
+            self.acquisitions += 1
+            if waitTime > 0:
+                self.contended += 1
+                self.totalWait += waitTime
+                self.maxWait = max(self.maxWait, waitTime)
+                self.waitHistogram[bisect_left(self.WAIT_BUCKETS, waitTime)] += 1
+            holder = self.holders.get(self._site)
+            if holder == None:
+                holder = self.holders[self._site] = [0, 0, 0, 0]
+            holder[0] += 1
+            holder[1] += waitTime
+        return True
+
+    def release(self):
+        if self._depth == 1:
+            holdTime = monotonic() - self._acquiredAt
+            with self._statsLock:
+                holder = self.holders[self._site]
+                holder[2] += holdTime
+                holder[3] = max(holder[3], holdTime)
+            self._owner = None
+            self._depth = 0
+        else:
+            self._depth -= 1
+        self._lock.release()
+
+    def _is_owned(self):
+        """ :return: True if the calling thread holds the lock (like threading.RLock._is_owned()) """
+        return self._owner == get_ident()
+
+    __enter__ = acquire
+
+    def __exit__(self, *args):
+        self.release()
+
+    def stats(self):
+        """ :return: A snapshot of the recorded statistics
+        :rtype: dict
+        """
+        with self._statsLock:
+            return {'name': self.name,
+                    'acquisitions': self.acquisitions,
+                    'contended': self.contended,
+                    'waiting': self.waiting,
+                    'maxWaiting': self.maxWaiting,
+                    'totalWait': self.totalWait,
+                    'maxWait': self.maxWait,
+                    'waitHistogram': dict(zip([str(bound) for bound in self.WAIT_BUCKETS], self.waitHistogram)),
+                    'holders': dict((site, {'acquisitions': holder[0], 'totalWait': holder[1], 'totalHold': holder[2], 'maxHold': holder[3]})
+                                    for site, holder in self.holders.items())}
+
+    def dump(self):
+        """ :return: A human-readable report of the recorded statistics, with call sites ordered by total hold time
+        :rtype: str
+        """
+        stats = self.stats()
+        lines = ['Lock {0}: {1} acquisitions, {2} contended, max {3} waiting, total wait {4:.6f}s, max wait {5:.6f}s'.format(
+                    stats['name'], stats['acquisitions'], stats['contended'], stats['maxWaiting'], stats['totalWait'], stats['maxWait'])]
+        lines.append('  Wait times: ' + ', '.join('<={0}s: {1}'.format(bound, count) for bound, count in zip(self.WAIT_BUCKETS, self.waitHistogram)))
+        lines.append('  Holders (by total hold time):')
+        for site, holder in sorted(stats['holders'].items(), key=lambda item: item[1]['totalHold'], reverse=True):
+            lines.append('    {0}: {1} acquisitions, hold {2:.6f}s total / {3:.6f}s max, wait {4:.6f}s total'.format(
+                site, holder['acquisitions'], holder['totalHold'], holder['maxHold'], holder['totalWait']))
+        return '\n'.join(lines)
@@ -0,0 +1,212 @@
+""" Optional, dependency-free metrics for GsmModem and SerialComms
+
+Metrics are disabled by default. To enable them, assign a MetricsRegistry instance to the
+``metrics`` attribute of a modem (a single registry may be shared by several modems; every
+metric is labelled with the modem's port)::
+
+    registry = MetricsRegistry()
+    modem = GsmModem('/dev/ttyUSB0')
+    modem.metrics = registry
+    ...
+    print(registry.exposition()) # Prometheus text exposition format
+
+Alternatively, listener functions may be registered with addListener() to push each metric
+update to another monitoring system as it happens.
+"""
+
+import threading, re
+from bisect import bisect_left
+
+# Used to restrict notification types to a bounded set of label values
+NOTIFICATION_TYPE_REGEX = re.compile(r'^[\+\^]?[A-Z][A-Z0-9 ]{0,15}$')
+
+
+def notificationType(line):
+    """ :return: The type of the unsolicited notification starting with the specified line (e.g. "+CMTI" or "RING"), for use as a metric label """
+    notifType = line.split(':', 1)[0].strip()
+    if NOTIFICATION_TYPE_REGEX.match(notifType):
+        return notifType
+    else:
+        return 'other'
+
+
+def _formatLabels(labelNames, labelValues, extra=None):
+    """ Formats a label set in Prometheus text exposition format """
+    pairs = list(zip(labelNames, labelValues))
+    if extra != None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs) + '}'
+
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """ Base class for metrics; holds one value per label value combination """
+
+    metricType = None
+
+    def __init__(self, registry, name, description, labelNames=()):
+        self._registry = registry
+        self.name = name
+        self.description = description
+        self.labelNames = tuple(labelNames)
+        self._values = {} # key: tuple of label values
+        self._lock = threading.Lock()
+
+    def _notify(self, labels, value):
+        for listener in self._registry.listeners:
+            listener(self, labels, value)
+
+    def samples(self):
+        """ :return: list of (label values, value) tuples """
+        with self._lock:
+            return list(self._values.items())
+
+    def exposition(self):
+        """ :return: This metric in Prometheus text exposition format """
+        lines = ['# HELP {0} {1}'.format(self.name, self.description), '# TYPE {0} {1}'.format(self.name, self.metricType)]
+        for labels, value in sorted(self.samples()):
+            lines.append('{0}{1} {2}'.format(self.name, _formatLabels(self.labelNames, labels), _formatValue(value)))
+        return lines
+
+
+class Counter(Metric):
+    """ Monotonically increasing count """
+
+    metricType = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+        if self._registry.listeners:
+            self._notify(labels, amount)
+
+
+class Gauge(Metric):
+    """ Value that can go up and down """
+
+    metricType = 'gauge'
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+        if self._registry.listeners:
+            self._notify(labels, value)
+
+
+class Histogram(Metric):
+    """ Distribution of observed values (e.g. latencies, in seconds), counted in cumulative buckets """
+
+    metricType = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, registry, name, description, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(registry, name, description, labelNames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, labels=(), value=0):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry == None:
+                # [per-bucket counts, sum, count]
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+        if self._registry.listeners:
+            self._notify(labels, value)
+
+    def samples(self):
+        with self._lock:
+            return [(labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items()]
+
+    def exposition(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.description), '# TYPE {0} histogram'.format(self.name)]
+        for labels, (bucketCounts, total, count) in sorted(self.samples()):
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets, bucketCounts):
+                cumulative += bucketCount
+                lines.append('{0}_bucket{1} {2}'.format(self.name, _formatLabels(self.labelNames, labels, ('le', _formatValue(bound))), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(self.name, _formatLabels(self.labelNames, labels), _formatValue(total)))
+            lines.append('{0}_count{1} {2}'.format(self.name, _formatLabels(self.labelNames, labels), count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """ Registry holding the metrics reported by python-gsmmodem (and any custom metrics) """
+
+    def __init__(self, namespace='gsmmodem'):
+        """
+        :param namespace: Prefix for all metric names
+        :type namespace: str
+        """
+        self.namespace = namespace
+        self.listeners = [] # Functions called for every metric update, as listener(metric, labelValues, value)
+        self._metrics = []
+        # AT commands
+        self.commands = self.counter('commands_total', 'AT commands sent, by command family', ('port', 'command'))
+        self.commandLatency = self.histogram('command_latency_seconds', 'AT command response latency, by command family', ('port', 'command'))
+        self.commandRetries = self.counter('command_retries_total', 'AT commands retried because of transient busy errors', ('port', 'command'))
+        self.commandWait = self.histogram('command_wait_seconds', 'Time AT commands waited for the serial port to become available, by priority class', ('port', 'priority'))
+        self.timeouts = self.counter('response_timeouts_total', 'AT command response timeouts, by command family', ('port', 'command'))
+        self.errors = self.counter('command_errors_total', 'CME/CMS errors returned by the modem, by error code', ('port', 'type', 'code'))
+        # Unsolicited notifications
+        self.notifications = self.counter('notifications_total', 'Unsolicited notifications received, by type', ('port', 'type'))
+        self.notificationHandlerDuration = self.histogram('notification_handler_seconds', 'Time spent handling unsolicited notifications, by type', ('port', 'type'))
+        # SMS
+        self.sms = self.counter('sms_total', 'SMS messages sent, received and delivered (or failed), as reported by status reports', ('port', 'event'))
+        self.rateLimitWait = self.histogram('sms_rate_limit_wait_seconds', 'Time SMS messages waited for the send rate limiter', ('port',))
+        # Serial port
+        self.bytesRead = self.counter('serial_read_bytes_total', 'Bytes read from the serial port', ('port',))
+        self.bytesWritten = self.counter('serial_written_bytes_total', 'Bytes written to the serial port', ('port',))
+        self.readIdle = self.counter('serial_read_idle_seconds_total', 'Time the read loop spent waiting without receiving data', ('port',))
+        self.reconnects = self.counter('reconnects_total', 'Reconnection attempts after fatal serial port errors, by result', ('port', 'result'))
+
+    def _register(self, metric):
+        metric.name = '{0}_{1}'.format(self.namespace, metric.name) if self.namespace else metric.name
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labelNames=()):
+        """ Creates and registers a new counter """
+        return self._register(Counter(self, name, description, labelNames))
+
+    def gauge(self, name, description, labelNames=()):
+        """ Creates and registers a new gauge """
+        return self._register(Gauge(self, name, description, labelNames))
+
+    def histogram(self, name, description, labelNames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        """ Creates and registers a new histogram """
+        return self._register(Histogram(self, name, description, labelNames, buckets))
+
+    def addListener(self, listener):
+        """ Registers a function that is called for every metric update, as listener(metric, labelValues, value)
+
+        Listeners are called synchronously from the thread updating the metric, so they should return quickly.
+        """
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        """ Removes a previously-registered listener function """
+        self.listeners.remove(listener)
+
+    @property
+    def metrics(self):
+        """ :return: all registered metrics """
+        return list(self._metrics)
+
+    def exposition(self):
+        """ :return: All metrics in Prometheus text exposition format
+        :rtype: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
@@ -7,9 +7,17 @@ from datetime import datetime
 from time import sleep
 
 from .serial_comms import SerialComms
+from .retry import RetryPolicy
+from .correlation import CorrelationStore, isFinalStatus
+from .timeouts import TimeoutProfile
+from .compat import monotonic
+from .metrics import notificationType
+from .tracing import CommandTrace
+from . import grammar
+from .scheduler import PRIORITY_HIGH, PRIORITY_BULK, commandPriority
 from .exceptions import CommandError, InvalidStateException, CmeError, CmsError, InterruptedException, TimeoutException, PinRequiredError, IncorrectPinError, SmscNumberUnknownError
 from .pdu import encodeSmsSubmitPdu, decodeSmsPdu, encodeGsm7, encodeTextMode
-from .util import SimpleOffsetTzInfo, lineStartingWith, allLinesMatchingPattern, parseTextModeTimeStr
+from .util import SimpleOffsetTzInfo, commandFamily, lineStartingWith, allLinesMatchingPattern, parseTextModeTimeStr
 
 #from . import compat # For Python 2.6 compatibility
 from gsmmodem.util import lineMatching
@@ -82,8 +90,35 @@ class SentSms(Sms):
 
     def __init__(self, number, text, reference, smsc=None):
         super(SentSms, self).__init__(number, text, smsc)
-        self.report = None # Status report for this SMS (StatusReport object)
+        self._report = None # Status report for this SMS (StatusReport object)
+        self._reportEvent = threading.Event() # Set when a final status report has been received
+        self._reportAwaited = False # Whether a sendSms() call is waiting for this SMS's status report
         self.reference = reference
+        self.parts = None # Outcome of sending each part (list of SentSmsPart objects); only set for messages sent in PDU mode
+
+    @property
+    def report(self):
+        """ Status report for this SMS (StatusReport object), or None if none has been received yet """
+        return self._report
+
+    @report.setter
+    def report(self, report):
+        self._report = report
+        if report != None and isFinalStatus(report.deliveryStatus):
+            self._reportEvent.set()
+
+    def waitForReport(self, timeout=None):
+        """ Blocks until a final status report has been received for this SMS
+
+        Any number of threads may wait for the status reports of their own messages at the same time.
+
+        :param timeout: Maximum time to wait, in seconds (None to wait indefinitely)
+        :type timeout: int or float
+
+        :return: True if a final status report was received, False if the wait timed out
+        :rtype: bool
+        """
+        return self._reportEvent.wait(timeout)
 
     @property
     def status(self):
@@ -98,6 +133,23 @@ class SentSms(Sms):
             return SentSms.DELIVERED if self.report.deliveryStatus == StatusReport.DELIVERED else SentSms.FAILED
 
 
+class SentSmsPart(object):
+    """ The outcome of sending one part (PDU) of an SMS message """
+
+    def __init__(self, index, pdu):
+        self.index = index # Index of this part (0 for the first part)
+        self.pdu = pdu # The SMS-SUBMIT PDU (gsmmodem.pdu.Pdu object)
+        self.reference = None # Message reference assigned to this part by the modem, or None if it was not sent
+        self.error = None # Error that occurred while sending this part, if any
+        self.duration = None # Time taken to send this part, in seconds
+        self.sms = None # SentSms object tracking this part's delivery status (sendSmsParts() only)
+
+    @property
+    def sent(self):
+        """ True if this part was sent successfully """
+        return self.reference != None
+
+
 class StatusReport(Sms):
     """ An SMS status/delivery report
 
@@ -145,6 +197,10 @@ class GsmModem(SerialComms):
     # Used for parsing SMS status reports
     CDSI_REGEX = re.compile('\+CDSI:\s*"([^"]+)",(\d+)$')
     CDS_REGEX  = re.compile('\+CDS:\s*([0-9]+)"$')
+    # Families of commands (other than read "?" and test "=?" commands) that may safely be sent again if the
+    # connection is lost while waiting for their response: commands without side effects, and settings
+    IDEMPOTENT_COMMANDS = frozenset(('AT', 'E', 'I', '+CSQ', '+CGMI', '+CGMM', '+CGMR', '+CGSN', '+CIMI', '+CNUM', '+CLCC', '+CPAS',
+                                     '+CMGR=', '+CMGL=', '+CMEE=', '+CMGF=', '+CSCS=', '+CPMS=', '+CNMI=', '+CSMP=', '+CLIP=', '+CRC=', '+CVHU=', '+CSCA='))
 
     def __init__(self, port, baudrate=115200, incomingCallCallbackFunc=None, smsReceivedCallbackFunc=None, smsStatusReportCallback=None, requestDelivery=True, AT_CNMI="", *a, **kw):
         super(GsmModem, self).__init__(port, baudrate, notifyCallbackFunc=self._handleModemNotification, *a, **kw)
@@ -159,11 +215,10 @@ class GsmModem(SerialComms):
         self._extendedIncomingCallIndication = False
         # Current active calls (ringing and/or answered), key is the unique call ID (not the remote number)
         self.activeCalls = {}
-        # Dict containing sent SMS messages (for auto-tracking their delivery status)
-        self.sentSms = weakref.WeakValueDictionary()
+        # Sent SMS messages awaiting status reports (for auto-tracking their delivery status)
+        self.sentSms = CorrelationStore()
         self._ussdSessionEvent = None # threading.Event
         self._ussdResponse = None # gsmmodem.modem.Ussd
-        self._smsStatusReportEvent = None # threading.Event
         self._dialEvent = None # threading.Event
         self._dialResponse = None # gsmmodem.modem.Call
         self._waitForAtdResponse = True # Flag that controls if we should wait for an immediate response to ATD, or not
@@ -171,14 +226,27 @@ class GsmModem(SerialComms):
         self._callStatusUpdates = [] # populated during connect() - contains regexes and handlers for detecting/handling call status updates
         self._mustPollCallStatus = False # whether or not the modem must be polled for outgoing call status updates
         self._pollCallStatusRegex = None # Regular expression used when polling outgoing call status
-        self._writeWait = 0 # Time (in seconds to wait after writing a command (adjusted when 515 errors are detected)
+        self.retryPolicy = RetryPolicy() # Retry/pacing policy for commands failing with "device/SIM busy" errors
+        self.timeoutProfile = TimeoutProfile() # Command timeouts, learned from observed command latencies
+        self.rateLimiter = None # gsmmodem.ratelimit.SendRateLimiter limiting the rate at which SMS messages are sent; disabled if None
+        self.storageManager = None # gsmmodem.storage.StorageManager draining stored SMS messages before the storage fills up; disabled if None
+        self.reconnectPolicy = None # RetryPolicy for reconnecting after fatal serial port errors (e.g. a USB modem re-enumerating); disabled if None
+        self.reconnects = 0 # Number of times the connection was restored after a fatal serial port error
+        self._connectArgs = None # Arguments of the last connect() call (replayed when reconnecting)
+        self._reconnecting = False # Whether the connection is currently being restored
+        self._reconnectThread = None
+        self._online = threading.Event() # Cleared while reconnecting; writes issued in the meantime wait for this
+        self._online.set()
+        self._ussdError = None # Exception to raise in the sendUssd() call waiting for a +CUSD response (e.g. if the connection was lost)
         self._smsTextMode = False # Storage variable for the smsTextMode property
         self._gsmBusy = 0 # Storage variable for the GSMBUSY property
         self._smscNumber = None # Default SMSC number
         self._smsRef = 0 # Sent SMS reference counter
+        self._cmmsSupported = None # Whether the modem supports keeping the SMS relay link open (AT+CMMS); None if unknown
         self._smsMemReadDelete = None # Preferred message storage memory for reads/deletes (<mem1> parameter used for +CPMS)
         self._smsMemWrite = None # Preferred message storage memory for writes (<mem2> parameter used for +CPMS)
         self._smsReadSupported = True # Whether or not reading SMS messages is supported via AT commands
+        self._smsAckRequired = False # Whether messages routed directly to the TE (+CMT/+CDS) must be acknowledged with AT+CNMA
         self._smsEncoding = 'GSM' # Default SMS encoding
         self._smsSupportedEncodingNames = None # List of available encoding names
         self._commands = None # List of supported AT commands
@@ -196,11 +264,15 @@ class GsmModem(SerialComms):
         """
         self.log.info('Connecting to modem on port %s at %dbps', self.port, self.baudrate)
         super(GsmModem, self).connect()
+        self._connectArgs = (pin, waitingForModemToStartInSeconds)
+        self._initializeModem(pin, waitingForModemToStartInSeconds)
 
+    def _initializeModem(self, pin, waitingForModemToStartInSeconds):
+        """ Initializes the (just opened) modem and SIM card; also used when reconnecting """
         if waitingForModemToStartInSeconds > 0:
             while waitingForModemToStartInSeconds > 0:
                 try:
-                    self.write('AT', waitForResponse=True, timeout=0.5)
+                    self.write('AT', waitForResponse=True, timeout=self.timeoutProfile.timeout('AT', 0.5))
                     break
                 except TimeoutException:
                     waitingForModemToStartInSeconds -= 0.5
@@ -346,6 +418,8 @@ class GsmModem(SerialComms):
         if currentSmscNumber != None and self.smsc != currentSmscNumber:
             self.smsc = currentSmscNumber
 
+        if self.storageManager != None:
+            self.storageManager.reset()
         # Set message storage, but first check what the modem supports - example response: +CPMS: (("SM","BM","SR"),("SM"))
         try:
             cpmsLine = lineStartingWith('+CPMS', self.write('AT+CPMS=?'))
@@ -373,20 +447,30 @@ class GsmModem(SerialComms):
                                 self._smsMemReadDelete = memType
                             cpmsItems[i] = memType
                             break
-                self.write('AT+CPMS={0}'.format(','.join(cpmsItems))) # Set message storage
+                cpmsResponse = self.write('AT+CPMS={0}'.format(','.join(cpmsItems))) # Set message storage
+                if self.storageManager != None:
+                    self.storageManager.updateFromResponse(cpmsResponse, cpmsItems)
             del cpmsSupport
             del cpmsLine
 
+        self._smsAckRequired = False
         if self._smsReadSupported and (self.smsReceivedCallback or self.smsStatusReportCallback):
+            cnmi = self.AT_CNMI
             try:
-                self.write('AT+CNMI=' + self.AT_CNMI)  # Set message notifications
+                self.write('AT+CNMI=' + cnmi)  # Set message notifications
             except CommandError:
                 try:
-                    self.write('AT+CNMI=2,1,0,1,0') # Set message notifications, using TE for delivery reports <ds>
+                    cnmi = '2,1,0,1,0'
+                    self.write('AT+CNMI=' + cnmi) # Set message notifications, using TE for delivery reports <ds>
                 except CommandError:
                     # Message notifications not supported
                     self._smsReadSupported = False
                     self.log.warning('Incoming SMS notifications not supported by modem. SMS receiving unavailable.')
+                    cnmi = None
+            if cnmi != None:
+                self._setupSmsAcknowledgement(cnmi)
+        if self.storageManager != None and self._smsReadSupported:
+            self._reconcileSmsStorage()
 
         # Incoming call notification setup
         try:
@@ -407,11 +491,116 @@ class GsmModem(SerialComms):
         # Call control setup
         self.write('AT+CVHU=0', parseError=False) # Enable call hang-up with ATH command (ignore if command not supported)
 
+    def _handleFatalError(self, error):
+        """ Handles an error that makes the device unusable (e.g. it was unplugged)
+
+        If the ``reconnectPolicy`` attribute is set, the connection is restored in the background
+        (see _reconnect()) instead of reporting the error to the fatal error callback straight away.
+        """
+        if self.reconnectPolicy == None or self._connectArgs == None or self._stopEvent.is_set():
+            super(GsmModem, self)._handleFatalError(error)
+            return
+        self.log.warning('Fatal serial port error: %s; reconnecting', error)
+        self._online.clear()
+        alreadyReconnecting = self._reconnecting
+        self._reconnecting = True
+        self.alive = False
+        try:
+            self.serial.close()
+        except Exception: #pragma: no cover
+            pass
+        responseEvent = self._responseEvent
+        if responseEvent != None:
+            # Interrupt the command waiting for a response; it is retried once the connection has been restored
+            responseEvent.set()
+        ussdSessionEvent = self._ussdSessionEvent
+        if ussdSessionEvent != None:
+            # The USSD request is not sent again: it may already have been executed (e.g. a top-up)
+            self._ussdError = InterruptedException('Connection lost while waiting for a USSD response; the request may or may not have been executed')
+            ussdSessionEvent.set()
+        if not alreadyReconnecting:
+            self._startWorker(self._reconnect, error)
+
+    def _reconnect(self, error):
+        """ Restores the connection after a fatal serial port error (runs in a worker thread)
+
+        The port is reopened and the modem is initialized again (using the arguments of the last
+        connect() call), waiting for the backoff delays of the ``reconnectPolicy`` between attempts,
+        for at most ``reconnectPolicy.maxAttempts`` attempts. Writes issued in the meantime wait for
+        the connection to be restored. If all attempts fail, the fatal error callback is called (before
+        the waiting writes fail with InterruptedException).
+        """
+        self._reconnectThread = threading.current_thread()
+        policy = self.reconnectPolicy
+        attempt = 0
+        connected = False
+        try:
+            while not connected and attempt < policy.maxAttempts:
+                if self._stopEvent.wait(policy.backoffDelay(attempt)):
+                    return # close() was called
+                attempt += 1
+                try:
+                    with self._connectionLock:
+                        if self._stopEvent.is_set():
+                            return
+                        self._openConnection()
+                    self._initializeModem(*self._connectArgs)
+                except Exception as e:
+                    self.log.warning('Reconnection attempt %d failed: %s', attempt, e)
+                    error = e
+                    self.alive = False
+                    self._closeConnection()
+                    if self.metrics != None:
+                        self.metrics.reconnects.inc((self.port, 'failed'))
+                else:
+                    connected = True
+            if connected:
+                self.reconnects += 1
+                if self.metrics != None:
+                    self.metrics.reconnects.inc((self.port, 'succeeded'))
+                self.log.info('Connection to modem on port %s restored', self.port)
+                self._restoreSession()
+            else:
+                self.log.error('Could not reconnect to modem on port %s after %d attempts', self.port, attempt)
+                self.fatalErrorCallback(error)
+        finally:
+            self._reconnecting = False
+            self._online.set()
+
+    def _restoreSession(self):
+        """ Handles the SMS messages and status reports stored by the modem while disconnected, after reconnecting
+
+        Messages are only handled if an SMS received callback is set, and are deleted once they
+        have been handled successfully (see _handleStoredSms()). If a storage manager is set,
+        this was already done while re-initializing the modem. (A pending USSD request is not
+        sent again; see _handleFatalError().)
+        """
+        if not self._smsReadSupported or self.smsReceivedCallback == self._placeholderCallback or self.storageManager != None:
+            return
+        try:
+            self._handleStoredSms(Sms.STATUS_RECEIVED_UNREAD)
+        except (CommandError, TimeoutException) as e:
+            self.log.warning('Could not read SMS messages stored while disconnected: %s', e)
+
+    def _waitUntilOnline(self):
+        """ Waits while the connection is being restored after a fatal serial port error (does nothing otherwise)
+
+        :raise InterruptedException: if the connection could not be restored, or if the calling thread holds
+                                     the transmit lock (which is needed to re-initialize the modem)
+        """
+        if self._reconnecting and threading.current_thread() != self._reconnectThread:
+            isOwned = getattr(self._txLock, '_is_owned', None)
+            if isOwned != None and isOwned():
+                raise InterruptedException('Connection lost')
+            self._online.wait()
+            if not self.alive:
+                raise InterruptedException('Connection lost')
+
     def _unlockSim(self, pin):
         """ Unlocks the SIM card using the specified PIN (if necessary, else does nothing) """
         # Unlock the SIM card if needed
         try:
-            cpinResponse = lineStartingWith('+CPIN', self.write('AT+CPIN?', timeout=15))
+            cpinResponse = lineStartingWith('+CPIN', self.write('AT+CPIN?'))
         except TimeoutException as timeout:
             # Wavecom modems do not end +CPIN responses with "OK" (github issue #19) - see if just the +CPIN response was returned
             if timeout.data != None:
@@ -428,37 +617,100 @@ class GsmModem(SerialComms):
             else:
                 raise PinRequiredError('AT+CPIN')
 
-    def write(self, data, waitForResponse=True, timeout=10, parseError=True, writeTerm=TERMINATOR, expectedResponseTermSeq=None):
+    def write(self, data, waitForResponse=True, timeout=None, parseError=True, writeTerm=TERMINATOR, expectedResponseTermSeq=None, priority=None, responseLineCallback=None, idempotent=None, family=None):
         """ Write data to the modem.
 
         This method adds the ``\\r\\n`` end-of-line sequence to the data parameter, and
         writes it to the modem.
 
+        Commands failing with transient "device/SIM busy" errors (CME 515/14) are retried
+        as specified by the ``retryPolicy`` attribute.
+
         :param data: Command/data to be written to the modem
         :type data: str
         :param waitForResponse: Whether this method should block and return the response from the modem or not
         :type waitForResponse: bool
-        :param timeout: Maximum amount of time in seconds to wait for a response from the modem
-        :type timeout: int
+        :param timeout: Maximum amount of time in seconds to wait for a response from the modem. If None,
+                        the timeout is determined by the ``timeoutProfile`` attribute, based on the
+                        latencies previously observed for this type of command
+        :type timeout: int or float
         :param parseError: If True, a CommandError is raised if the modem responds with an error (otherwise the response is returned as-is)
         :type parseError: bool
         :param writeTerm: The terminating sequence to append to the written data
         :type writeTerm: str
         :param expectedResponseTermSeq: The expected terminating sequence that marks the end of the modem's response (defaults to ``\\r\\n``)
         :type expectedResponseTermSeq: str
+        :param priority: Priority class of this command (PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_BULK from
+                         gsmmodem.scheduler); if None, the priority set for the calling thread is used
+        :type priority: int
+        :param responseLineCallback: If set, the lines of the response (except the final status line) are passed to
+                                     this function as they are received (in the read thread), instead of being returned
+        :type responseLineCallback: func
+        :param idempotent: Whether the command may be sent again if the connection is lost (and restored, see
+                           ``reconnectPolicy``) while waiting for its response. If None, only read/test commands
+                           and the commands in IDEMPOTENT_COMMANDS are sent again.
+        :type idempotent: bool
+        :param family: The command family (see gsmmodem.util.commandFamily()) used for this command's timeout and
+                       metrics; if None, it is determined from the data. Data written after a prompt should
+                       specify the family of the prompting command, followed by "<data>" (e.g. "+CMGS=<data>")
+        :type family: str
 
         :raise CommandError: if the command returns an error (only if parseError parameter is True)
         :raise TimeoutException: if no response to the command was received from the modem
+        :raise InterruptedException: if the connection was lost while waiting for the response to a command that is
+                                     not sent again; the modem may or may not have executed the command
 
         :return: A list containing the response lines from the modem, or None if waitForResponse is False
         :rtype: list
         """
 
         self.log.debug('write: %s', data)
-        responseLines = super(GsmModem, self).write(data + writeTerm, waitForResponse=waitForResponse, timeout=timeout, expectedResponseTermSeq=expectedResponseTermSeq)
-        if self._writeWait > 0: # Sleep a bit if required (some older modems suffer under load)
-            time.sleep(self._writeWait)
-        if waitForResponse:
+        if family == None:
+            family = commandFamily(data)
+            if family == None:
+                # Raw data, usually written after a prompt (e.g. the SMS text/PDU after AT+CMGS)
+                family = '<data>'
+        if timeout == None:
+            timeout = self.timeoutProfile.timeout(family)
+        attempt = 0
+        while True:
+            self._waitUntilOnline()
+            reconnects = self.reconnects
+            metrics = self.metrics
+            if metrics != None:
+                metrics.commands.inc((self.port, family))
+            if self.tracer != None:
+                trace = CommandTrace(self.tracer, self.port, data)
+                trace.attempt = attempt
+            else:
+                trace = None
+            startTime = monotonic()
+            try:
+                responseLines = super(GsmModem, self).write(data + writeTerm, waitForResponse=waitForResponse, timeout=timeout, expectedResponseTermSeq=expectedResponseTermSeq, trace=trace, priority=priority, responseLineCallback=responseLineCallback)
+            except TimeoutException:
+                self.timeoutProfile.record(family, timeout)
+                if metrics != None:
+                    metrics.timeouts.inc((self.port, family))
+                raise
+            except InterruptedException as e:
+                if (self._reconnecting or self.reconnects != reconnects) and threading.current_thread() != self._reconnectThread:
+                    if self._isIdempotent(family, expectedResponseTermSeq) if idempotent == None else idempotent:
+                        # Connection lost while waiting for the response; send the command again once it has been restored
+                        self.log.debug('Connection lost while waiting for a response to %s; retrying after reconnecting', family)
+                        continue
+                    raise InterruptedException('Connection lost while waiting for a response to {0}; the command may or may not have been executed'.format(family), e)
+                raise
+            if waitForResponse:
+                latency = monotonic() - startTime
+                self.retryPolicy.recordLatency(latency)
+                self.timeoutProfile.record(family, latency)
+                if metrics != None:
+                    metrics.commandLatency.observe((self.port, family), latency)
+            pace = self.retryPolicy.pace
+            if pace > 0: # Sleep a bit if required (some older modems suffer under load)
+                time.sleep(pace)
+            if not waitForResponse:
+                return None
             cmdStatusLine = responseLines[-1]
             if parseError:
                 if 'ERROR' in cmdStatusLine:
@@ -466,30 +718,43 @@ class GsmModem(SerialComms):
                     if cmErrorMatch:
                         errorType = cmErrorMatch.group(1)
                         errorCode = int(cmErrorMatch.group(2))
-                        if errorCode == 515 or errorCode == 14:
-                            # 515 means: "Please wait, init or command processing in progress."
-                            # 14 means "SIM busy"
-                            self._writeWait += 0.2 # Increase waiting period temporarily
-                            # Retry the command after waiting a bit
-                            self.log.debug('Device/SIM busy error detected; self._writeWait adjusted to %fs', self._writeWait)
-                            time.sleep(self._writeWait)
-                            result = self.write(data, waitForResponse, timeout, parseError, writeTerm, expectedResponseTermSeq)
-                            self.log.debug('self_writeWait set to 0.1 because of recovering from device busy (515) error')
-                            if errorCode == 515:
-                                self._writeWait = 0.1 # Set this to something sane for further commands (slow modem)
-                            else:
-                                self._writeWait = 0 # The modem was just waiting for the SIM card
-                            return result
+                        if metrics != None:
+                            metrics.errors.inc((self.port, errorType, str(errorCode)))
+                        retryDelay = self.retryPolicy.retryDelay(errorType, errorCode, attempt)
+                        if retryDelay != None:
+                            # Transient device/SIM busy error; retry the command after waiting a bit
+                            self.log.debug('Device/SIM busy error detected (%s %d); retrying in %fs', errorType, errorCode, retryDelay)
+                            if metrics != None:
+                                metrics.commandRetries.inc((self.port, family))
+                            time.sleep(retryDelay)
+                            attempt += 1
+                            continue
                         if errorType == 'CME':
-                            raise CmeError(data, int(errorCode))
+                            error = CmeError(data, int(errorCode))
                         else: # CMS error
-                            raise CmsError(data, int(errorCode))
+                            error = CmsError(data, int(errorCode))
                     else:
-                        raise CommandError(data)
+                        error = CommandError(data)
                 elif cmdStatusLine == 'COMMAND NOT SUPPORT': # Some Huawei modems respond with this for unknown commands
-                    raise CommandError('{} ({})'.format(data,cmdStatusLine))
+                    error = CommandError('{} ({})'.format(data,cmdStatusLine))
+                else:
+                    error = None
+                if error != None:
+                    if trace != None:
+                        trace.error = error
+                        trace.tracer.onError(trace, error)
+                    raise error
             return responseLines
 
+    def _isIdempotent(self, family, expectedResponseTermSeq=None):
+        """ :return: True if commands of the family may safely be sent again after the connection was lost while
+                     waiting for their response (data prompts, and the data written after them, never are)
+        :rtype: bool
+        """
+        if expectedResponseTermSeq or family.endswith('<data>'):
+            return False
+        return family.endswith('?') or family in self.IDEMPOTENT_COMMANDS
+
     @property
     def signalStrength(self):
         """ Checks the modem's cellular network signal strength
@@ -547,14 +812,16 @@ class GsmModem(SerialComms):
         try:
             # AT+CLAC responses differ between modems. Most respond with +CLAC: and then a comma-separated list of commands
             # while others simply return each command on a new line, with no +CLAC: prefix
-            response = self.write('AT+CLAC', timeout=10)
-            if len(response) == 2: # Single-line response, comma separated
+            # Multi-line responses may be hundreds of lines long; process each line as it arrives
+            response = []
+            self.write('AT+CLAC', responseLineCallback=lambda line: response.append(line.strip()))
+            if len(response) == 1: # Single-line response, comma separated
                 commands = response[0]
                 if commands.startswith('+CLAC'):
                     commands = commands[6:] # remove the +CLAC: prefix before splitting
                 return commands.split(',')
-            elif len(response) > 2: # Multi-line response
-                return [cmd.strip() for cmd in response[:-1]]
+            elif len(response) > 1: # Multi-line response
+                return response
             else:
                 self.log.debug('Unhandled +CLAC response: {0}'.format(response))
                 return None
@@ -714,21 +981,132 @@ class GsmModem(SerialComms):
         if write != None and write != self._smsMemWrite:
             self.write()
             readDel = readDelete or self._smsMemReadDelete
-            self.write('AT+CPMS="{0}","{1}"'.format(readDel, write))
+            cpmsResponse = self.write('AT+CPMS="{0}","{1}"'.format(readDel, write))
             self._smsMemReadDelete = readDel
             self._smsMemWrite = write
+            if self.storageManager != None:
+                self.storageManager.updateFromResponse(cpmsResponse, (readDel, write))
         elif readDelete != None and readDelete != self._smsMemReadDelete:
-            self.write('AT+CPMS="{0}"'.format(readDelete))
+            cpmsResponse = self.write('AT+CPMS="{0}"'.format(readDelete))
             self._smsMemReadDelete = readDelete
+            if self.storageManager != None:
+                self.storageManager.updateFromResponse(cpmsResponse, (readDelete,))
+
+    def _reconcileSmsStorage(self):
+        """ Processes the SMS messages left in storage (e.g. received while not connected, or whose
+        callback failed), and queries the storage usage for the storage manager """
+        try:
+            if self.smsReceivedCallback != self._placeholderCallback:
+                for status in (Sms.STATUS_RECEIVED_READ, Sms.STATUS_RECEIVED_UNREAD):
+                    self._handleStoredSms(status)
+            self.storageManager.updateFromResponse(self.write('AT+CPMS?'))
+        except (CommandError, TimeoutException):
+            self.log.warning('Failed to process SMS messages left in storage', exc_info=True)
+
+    def _checkSmsStorage(self, memory):
+        """ Drains the messages stored in the memory if its usage has reached the storage manager's high-water mark """
+        manager = self.storageManager
+        try:
+            if manager.usage(memory) == None:
+                manager.updateFromResponse(self.write('AT+CPMS?'))
+            if manager.needsDrain(memory) and manager.startDrain():
+                try:
+                    self._drainStoredSms(memory)
+                finally:
+                    manager.endDrain()
+        except CommandError:
+            self.log.warning('Failed to drain SMS message storage', exc_info=True)
+
+    def _drainStoredSms(self, memory):
+        """ Reads all received messages stored in the memory in batches (one AT+CMGL command per
+        read status), passes them to the SMS received callback, and deletes the ones that were
+        handled successfully
+
+        Messages that are already read were left in storage, e.g. because their callback failed;
+        they are passed to the callback again. Messages that are being handled by a +CMTI
+        notification handler are skipped. A +CMTI notification that arrives after its message
+        was drained finds the message's storage index empty (or holding a newer message), see
+        _handleSmsReceived().
+        """
+        manager = self.storageManager
+        self.log.info('SMS message storage %s reached high-water mark (used, total: %s); draining stored messages', memory, manager.usage(memory))
+        for status in (Sms.STATUS_RECEIVED_READ, Sms.STATUS_RECEIVED_UNREAD):
+            self._handleStoredSms(status, memory)
+        manager.updateFromResponse(self.write('AT+CPMS?'))
+
+    def _handleStoredSms(self, status, memory=None):
+        """ Reads the received messages with the specified status from storage (one AT+CMGL command),
+        passes them to the SMS received callback (or status reports to the status report callback),
+        and deletes the ones that were handled successfully
+
+        If a storage manager is set, messages that are being handled by a +CMTI notification
+        handler are skipped.
+
+        :param memory: The memory to read from; if None, the current SMS read memory is used
+        :type memory: str
+
+        :return: The number of messages that were handled
+        :rtype: int
+        """
+        manager = self.storageManager
+        self._setSmsMemory(readDelete=memory)
+        memory = memory or self._smsMemReadDelete
+        messages = list(self._parseSmsList(self.write(self._listSmsCommand(status), priority=PRIORITY_BULK), self.smsTextMode))
+        if len(messages) == 0:
+            return 0
+        indexes = [msgIndex for msgIndex, sms in messages]
+        claimed = manager.claim(memory, indexes) if manager != None else indexes
+        handled = []
+        try:
+            for msgIndex, sms in messages:
+                if msgIndex not in claimed:
+                    continue # Being handled by a +CMTI notification handler
+                try:
+                    if isinstance(sms, StatusReport):
+                        self._dispatchStatusReport(sms)
+                    else:
+                        if self.metrics != None:
+                            self.metrics.sms.inc((self.port, 'received'))
+                        self.smsReceivedCallback(sms)
+                except Exception:
+                    self.log.error('error handling stored SMS message', exc_info=True)
+                else:
+                    handled.append(msgIndex)
+            if handled:
+                self._deleteListedSms(status, handled)
+                if manager != None:
+                    manager.drained(memory, handled)
+        finally:
+            if manager != None:
+                manager.release(memory, claimed)
+        return len(handled)
+
+    def _setupSmsAcknowledgement(self, cnmi):
+        """ Determines whether messages routed directly to the TE must be acknowledged with AT+CNMA
+
+        This is the case if the modem uses the phase 2+ SMS service (AT+CSMS=1), and messages
+        (<mt> = 2 or 3) or status reports (<ds> = 1) are routed directly to the TE, according to
+        the specified AT+CNMI parameters.
+        """
+        params = cnmi.split(',')
+        directDelivery = len(params) > 1 and params[1].strip() in ('2', '3')
+        directStatusReports = len(params) > 3 and params[3].strip() == '1'
+        self._smsAckRequired = False
+        if directDelivery or directStatusReports:
+            try:
+                csmsMatch = lineMatching(r'^\+CSMS:\s*(\d+)', self.write('AT+CSMS?'))
+            except CommandError:
+                csmsMatch = None
+            self._smsAckRequired = csmsMatch != None and csmsMatch.group(1) == '1'
 
     def _compileSmsRegexes(self):
         """ Compiles regular expression used for parsing SMS messages based on current mode """
         if self.smsTextMode:
             if self.CMGR_SM_DELIVER_REGEX_TEXT == None:
-                self.CMGR_SM_DELIVER_REGEX_TEXT = re.compile('^\+CMGR: "([^"]+)","([^"]+)",[^,]*,"([^"]+)"$')
-                self.CMGR_SM_REPORT_REGEXT_TEXT = re.compile('^\+CMGR: ([^,]*),\d+,(\d+),"{0,1}([^"]*)"{0,1},\d*,"([^"]+)","([^"]+)",(\d+)$')
+                self.CMGR_SM_DELIVER_REGEX_TEXT = grammar.CMGR_TEXT_DELIVER.pattern
+                self.CMGR_SM_REPORT_REGEXT_TEXT = grammar.CMGR_TEXT_REPORT.pattern
         elif self.CMGR_REGEX_PDU == None:
-            self.CMGR_REGEX_PDU = re.compile('^\+CMGR:\s*(\d*),\s*"{0,1}([^"]*)"{0,1},\s*(\d+)$')
+            self.CMGR_REGEX_PDU = grammar.CMGR_PDU.pattern
 
     @property
     def gsmBusy(self):
@@ -874,7 +1252,7 @@ class GsmModem(SerialComms):
             # If this is reached, the timer task has triggered
             raise TimeoutException()
 
-    def sendSms(self, destination, text, waitForDeliveryReport=False, deliveryTimeout=15, sendFlash=False):
+    def sendSms(self, destination, text, waitForDeliveryReport=False, deliveryTimeout=15, sendFlash=False, priority=None):
         """ Send an SMS text message
 
         :param destination: the recipient's phone number
@@ -882,9 +1260,13 @@ class GsmModem(SerialComms):
         :param text: the message text
         :type text: str
         :param waitForDeliveryReport: if True, this method blocks until a delivery report is received for the sent message
+                                      (several threads may wait for the reports of their own messages at the same time)
         :type waitForDeliveryReport: boolean
         :param deliveryTimeout: the maximum time in seconds to wait for a delivery report (if "waitForDeliveryReport" is True)
         :type deliveryTimeout: int or float
+        :param priority: the priority class of the commands sending the message (see gsmmodem.scheduler), e.g.
+                         PRIORITY_HIGH for one-time PINs; if None, the priority set for the calling thread is used
+        :type priority: int
 
         :raise CommandError: if an error occurs while attempting to send the message
         :raise TimeoutException: if the operation times out
@@ -897,71 +1279,342 @@ class GsmModem(SerialComms):
             except ValueError:
                 self.smsTextMode = False
 
+        with commandPriority(priority):
+            if self.smsTextMode:
+                # Send SMS via AT commands (holding the transmit lock, so that no other commands are written between the prompt and the message data)
+                self._waitForSendRate(destination)
+                self._waitUntilOnline()
+                with self._txLock:
+                    self.write('AT+CMGS="{0}"'.format(destination), expectedResponseTermSeq='> ')
+                    result = lineStartingWith('+CMGS:', self.write(text, writeTerm=CTRLZ, family='+CMGS=<data>'))
+                if result == None:
+                    raise CommandError('Modem did not respond with +CMGS response')
+                reference = int(result[7:])
+                parts = None
+            else:
+                # Send SMS PDUs via AT commands
+                parts = self._sendSmsPdus(self._encodeSmsPdus(destination, text, sendFlash), stopOnError=True, destination=destination)
+                reference = parts[-1].reference
+
+        # Keep SMS reference number in order to pair delivery reports with sent message
+        self._updateSmsRef(reference)
+
+        # Create sent SMS object for future delivery checks
+        sms = SentSms(destination, text, reference)
+        sms.parts = parts
+        if self.metrics != None:
+            self.metrics.sms.inc((self.port, 'sent'))
+
+        # Track this SMS (allows us to update the SMS state if a status report is received)
+        sms._reportAwaited = waitForDeliveryReport
+        self._trackSentSms(sms)
+        if waitForDeliveryReport and not sms.waitForReport(deliveryTimeout):
+            # Response timed out; a late status report is passed to the status report callback instead
+            sms._reportAwaited = False
+            raise TimeoutException()
+        return sms
+
+    def sendSmsParts(self, destination, text, sendFlash=False, pdus=None):
+        """ Sends an SMS text message in PDU mode, part by part, reporting the outcome of each part
+
+        Unlike sendSms(), this does not stop at the first part that fails to send: all parts are
+        attempted, and the failed ones can be retried individually afterwards (the retried parts
+        keep their original concatenation headers, so they are still reassembled correctly)::
+
+            parts = modem.sendSmsParts(destination, text)
+            failed = [part for part in parts if not part.sent]
+            if failed:
+                parts = modem.sendSmsParts(destination, text, pdus=[part.pdu for part in failed])
+
+        Each part that is sent is tracked (as a SentSms object, available as the part's ``sms``
+        attribute) so that its status report can be matched to it. If the modem is in SMS text
+        mode, it is switched to PDU mode while sending the parts, and back to text mode afterwards.
+
+        :param destination: the recipient's phone number
+        :type destination: str
+        :param text: the message text
+        :type text: str
+        :param pdus: the PDUs to send; if None, the text is encoded into PDUs
+        :type pdus: list of gsmmodem.pdu.Pdu
+
+        :return: The outcome of sending each part
+        :rtype: list of gsmmodem.modem.SentSmsPart
+        """
+        textMode = self.smsTextMode
+        if textMode:
+            self.smsTextMode = False
+        try:
+            if pdus == None:
+                pdus = self._encodeSmsPdus(destination, text, sendFlash)
+            parts = self._sendSmsPdus(pdus, stopOnError=False, destination=destination)
+        finally:
+            if textMode:
+                self.smsTextMode = True
+        for part in parts:
+            if part.sent:
+                self._updateSmsRef(part.reference)
+                part.sms = SentSms(destination, text, part.reference)
+                self._trackSentSms(part.sms)
+        if self.metrics != None and all(part.sent for part in parts):
+            self.metrics.sms.inc((self.port, 'sent'))
+        return parts
+
+    def broadcastSms(self, destinations, text, sendFlash=False, priority=PRIORITY_BULK):
+        """ Sends the same SMS text message to many recipients
+
+        The message is written to the modem's message storage once (AT+CMGW), and then sent from
+        there to each recipient (AT+CMSS), so that the message itself is only transferred to the
+        modem once, instead of once per recipient. The stored message is deleted afterwards. If the
+        modem does not support sending messages from storage, the message is sent to each
+        recipient using sendSms() instead.
+
+        Failing to send the message to one recipient does not stop the broadcast.
+
+        :param destinations: the recipients' phone numbers
+        :type destinations: list of str
+        :param text: the message text
+        :type text: str
+        :param priority: the priority class of the commands sending the message (see gsmmodem.scheduler)
+        :type priority: int
+
+        :return: For each recipient (in order): the SentSms object, or the error (CommandError or
+                 TimeoutException) that occurred while sending the message to that recipient
+        :rtype: list
+        """
+        destinations = list(destinations)
+        results = []
+        if not destinations:
+            return results
+        with commandPriority(priority):
+            indexes = None
+            if self._commands == None or ('+CMGW' in self._commands and '+CMSS' in self._commands):
+                try:
+                    indexes = self._writeStoredSms(destinations[0], text, sendFlash)
+                except CommandError as e:
+                    self.log.info('Could not write SMS message to storage (%s); sending to each recipient instead', e)
+            try:
+                for destination in destinations:
+                    if indexes != None:
+                        try:
+                            results.append(self._sendStoredSms(indexes, destination, text))
+                            continue
+                        except CmsError as e:
+                            # Network/SMS service error; specific to this recipient
+                            results.append(e)
+                            continue
+                        except CommandError as e:
+                            self.log.info('Could not send SMS message from storage (%s); sending to each recipient instead', e)
+                            indexes = self._deleteStoredSmsIndexes(indexes)
+                        except TimeoutException as e:
+                            results.append(e)
+                            continue
+                    try:
+                        results.append(self.sendSms(destination, text, sendFlash=sendFlash))
+                    except (CommandError, TimeoutException) as e:
+                        results.append(e)
+            finally:
+                if indexes != None:
+                    self._deleteStoredSmsIndexes(indexes)
+        return results
+
+    def _writeStoredSms(self, destination, text, sendFlash=False):
+        """ Writes an (outgoing) SMS message to the modem's message storage (AT+CMGW)
+
+        :return: The storage indexes of the message's parts
+        :rtype: list of int
+        """
         if self.smsTextMode:
-            # Send SMS via AT commands
-            self.write('AT+CMGS="{0}"'.format(destination), timeout=5, expectedResponseTermSeq='> ')
-            result = lineStartingWith('+CMGS:', self.write(text, timeout=35, writeTerm=CTRLZ))
-        else:
-            # Check encoding
             try:
-                encodedText = encodeGsm7(text)
+                encodeTextMode(text)
             except ValueError:
-                encodedText = None
-
-            # Set GSM modem SMS encoding format
-            # Encode message text and set data coding scheme based on text contents
-            if encodedText == None:
-                # Cannot encode text using GSM-7; use UCS2 instead
-                self.smsEncoding = 'UCS2'
+                self.smsTextMode = False
+        indexes = []
+        try:
+            if self.smsTextMode:
+                self._waitUntilOnline()
+                with self._txLock:
+                    self.write('AT+CMGW="{0}"'.format(destination), expectedResponseTermSeq='> ')
+                    result = lineStartingWith('+CMGW:', self.write(text, writeTerm=CTRLZ, family='+CMGW=<data>'))
+                if result == None:
+                    raise CommandError('Modem did not respond with +CMGW response')
+                indexes.append(int(result[7:]))
             else:
-                self.smsEncoding = 'GSM'
+                for pdu in self._encodeSmsPdus(destination, text, sendFlash):
+                    self._waitUntilOnline()
+                    with self._txLock:
+                        self.write('AT+CMGW={0}'.format(pdu.tpduLength), expectedResponseTermSeq='> ')
+                        result = lineStartingWith('+CMGW:', self.write(str(pdu), writeTerm=CTRLZ, family='+CMGW=<data>')) # example: +CMGW: 3
+                    if result == None:
+                        raise CommandError('Modem did not respond with +CMGW response')
+                    indexes.append(int(result[7:]))
+        except (CommandError, TimeoutException):
+            self._deleteStoredSmsIndexes(indexes)
+            raise
+        return indexes
 
-            # Encode text into PDUs
-            pdus = encodeSmsSubmitPdu(destination, text, reference=self._smsRef, sendFlash=sendFlash)
+    def _sendStoredSms(self, indexes, destination, text):
+        """ Sends a message written to storage by _writeStoredSms() to the specified destination (AT+CMSS)
 
-            # Send SMS PDUs via AT commands
-            for pdu in pdus:
-                self.write('AT+CMGS={0}'.format(pdu.tpduLength), timeout=5, expectedResponseTermSeq='> ')
-                result = lineStartingWith('+CMGS:', self.write(str(pdu), timeout=35, writeTerm=CTRLZ)) # example: +CMGS: xx
+        :return: The sent SMS (tracked for status reports)
+        :rtype: gsmmodem.modem.SentSms
+        """
+        self._waitForSendRate(destination, len(indexes))
+        if len(indexes) > 1:
+            self._keepSmsLinkOpen()
+        addressType = 145 if destination.startswith('+') else 129
+        for index in indexes:
+            result = lineStartingWith('+CMSS:', self.write('AT+CMSS={0},"{1}",{2}'.format(index, destination, addressType))) # example: +CMSS: 12
+            if result == None:
+                raise CommandError('Modem did not respond with +CMSS response')
+        reference = int(result[7:])
+        self._updateSmsRef(reference)
+        sms = SentSms(destination, text, reference)
+        if self.metrics != None:
+            self.metrics.sms.inc((self.port, 'sent'))
+        self._trackSentSms(sms)
+        return sms
 
-        if result == None:
-            raise CommandError('Modem did not respond with +CMGS response')
+    def _deleteStoredSmsIndexes(self, indexes):
+        """ Deletes the messages written to storage by _writeStoredSms() (logging any errors)
 
-        # Keep SMS reference number in order to pair delivery reports with sent message
-        reference = int(result[7:])
+        :return: None
+        """
+        for index in indexes:
+            try:
+                self.deleteStoredSms(index, self._smsMemWrite)
+            except (CommandError, TimeoutException) as e:
+                self.log.warning('Could not delete stored SMS message %d: %s', index, e)
+        return None
+
+    def _trackSentSms(self, sms):
+        """ Tracks a sent message in ``sentSms``, so that its status report can be matched with it (only if
+        status reports were requested; see the ``requestDelivery`` attribute) """
+        if self.requestDelivery:
+            self.sentSms.add(sms)
+
+    def _encodeSmsPdus(self, destination, text, sendFlash=False):
+        """ Selects the SMS encoding for the text, and encodes the text into (one or more) SMS-SUBMIT PDUs
+
+        :rtype: list of gsmmodem.pdu.Pdu
+        """
+        # Check encoding
+        try:
+            encodedText = encodeGsm7(text)
+        except ValueError:
+            encodedText = None
+
+        # Set GSM modem SMS encoding format
+        # Encode message text and set data coding scheme based on text contents
+        if encodedText == None:
+            # Cannot encode text using GSM-7; use UCS2 instead
+            self.smsEncoding = 'UCS2'
+        else:
+            self.smsEncoding = 'GSM'
+
+        # Encode text into PDUs
+        return encodeSmsSubmitPdu(destination, text, reference=self._smsRef, requestStatusReport=self.requestDelivery, sendFlash=sendFlash)
+
+    def _sendSmsPdus(self, pdus, stopOnError, destination=None):
+        """ Sends (already encoded) SMS PDUs, one AT+CMGS command per PDU
+
+        For multipart messages, the modem is first asked to keep the SMS relay link open between
+        the parts (AT+CMMS=2), if it supports this; this avoids setting up the link for every part.
+
+        :param stopOnError: Whether to raise the error of the first part that fails to send, or continue with the next part
+        :type stopOnError: bool
+        :param destination: The recipient of the PDUs (used for rate limiting)
+        :type destination: str
+
+        :return: The outcome of sending each part
+        :rtype: list of gsmmodem.modem.SentSmsPart
+        """
+        parts = [SentSmsPart(index, pdu) for index, pdu in enumerate(pdus)]
+        # Wait for the rate limiter once for all parts, so that they are sent back to back
+        self._waitForSendRate(destination, len(parts))
+        if len(parts) > 1:
+            self._keepSmsLinkOpen()
+        for part in parts:
+            startTime = monotonic()
+            try:
+                self._waitUntilOnline()
+                with self._txLock:
+                    self.write('AT+CMGS={0}'.format(part.pdu.tpduLength), expectedResponseTermSeq='> ')
+                    result = lineStartingWith('+CMGS:', self.write(str(part.pdu), writeTerm=CTRLZ, family='+CMGS=<data>')) # example: +CMGS: xx
+                if result == None:
+                    raise CommandError('Modem did not respond with +CMGS response')
+                part.reference = int(result[7:])
+            except (CommandError, TimeoutException, InterruptedException) as e:
+                part.error = e
+                if stopOnError:
+                    raise
+            finally:
+                part.duration = monotonic() - startTime
+        return parts
+
+    def _waitForSendRate(self, destination, count=1):
+        """ Waits until the rate limiter (if any) allows count SMS messages (parts) to be sent to the destination
+
+        :raise InterruptedException: if the modem is closed while waiting
+        """
+        if self.rateLimiter != None:
+            wait = self.rateLimiter.reserve(destination, count)
+            if self.metrics != None:
+                self.metrics.rateLimitWait.observe((self.port,), wait)
+            if wait > 0:
+                self.log.debug('Waiting %.3fs for the send rate limit', wait)
+                if self._stopEvent.wait(wait):
+                    raise InterruptedException('Connection closed while waiting for the send rate limit')
+
+    def _keepSmsLinkOpen(self):
+        """ Asks the modem to keep the SMS relay link open between consecutive messages (AT+CMMS=2), if supported
+
+        :return: True if the modem supports this
+        :rtype: bool
+        """
+        if self._cmmsSupported == None and self._commands != None and '+CMMS' not in self._commands:
+            self._cmmsSupported = False
+        if self._cmmsSupported != False:
+            try:
+                self.write('AT+CMMS=2')
+            except CommandError:
+                self._cmmsSupported = False
+            except TimeoutException:
+                # Support is still unknown; the parts are sent without keeping the link open
+                self.log.warning('Timed out asking the modem to keep the SMS relay link open (AT+CMMS=2)')
+                return False
+            else:
+                self._cmmsSupported = True
+        return self._cmmsSupported
+
+    def _updateSmsRef(self, reference):
+        """ Sets the SMS reference counter to follow the specified (last used) message reference """
         self._smsRef = reference + 1
         if self._smsRef > 255:
             self._smsRef = 0
 
-        # Create sent SMS object for future delivery checks
-        sms = SentSms(destination, text, reference)
-
-        # Add a weak-referenced entry for this SMS (allows us to update the SMS state if a status report is received)
-        self.sentSms[reference] = sms
-        if waitForDeliveryReport:
-            self._smsStatusReportEvent = threading.Event()
-            if self._smsStatusReportEvent.wait(deliveryTimeout):
-                self._smsStatusReportEvent = None
-            else: # Response timed out
-                self._smsStatusReportEvent = None
-                raise TimeoutException()
-        return sms
-
-    def sendUssd(self, ussdString, responseTimeout=15):
+    def sendUssd(self, ussdString, responseTimeout=None, priority=None):
         """ Starts a USSD session by dialing the the specified USSD string, or \
         sends the specified string in the existing USSD session (if any)
 
         :param ussdString: The USSD access number to dial
-        :param responseTimeout: Maximum time to wait a response, in seconds
+        :param responseTimeout: Maximum time to wait a response, in seconds. If None, the timeout
+                                is determined by the ``timeoutProfile`` attribute
+        :param priority: Priority class of the command (see gsmmodem.scheduler); if None, the
+                         priority set for the calling thread is used
 
         :raise TimeoutException: if no response is received in time
+        :raise InterruptedException: if the connection to the modem is lost while waiting for the
+                                     response (the request is not sent again, as it may already
+                                     have been executed)
 
         :return: The USSD response message/session (as a Ussd object)
         :rtype: gsmmodem.modem.Ussd
         """
+        self._ussdError = None
         self._ussdSessionEvent = threading.Event()
+        startTime = monotonic()
         try:
-            cusdResponse = self.write('AT+CUSD=1,"{0}",15'.format(ussdString), timeout=responseTimeout) # Should respond with "OK"
+            cusdResponse = self.write('AT+CUSD=1,"{0}",15'.format(ussdString), timeout=responseTimeout, priority=priority) # Should respond with "OK"
         except Exception:
             self._ussdSessionEvent = None # Cancel the thread sync lock
             raise
@@ -973,11 +1626,18 @@ class GsmModem(SerialComms):
                 self._ussdSessionEvent = None # Cancel thread sync lock
                 return self._parseCusdResponse(cusdResponse)
         # Wait for the +CUSD notification message
-        if self._ussdSessionEvent.wait(responseTimeout):
+        notificationTimeout = responseTimeout or self.timeoutProfile.timeout('+CUSD')
+        if self._ussdSessionEvent.wait(notificationTimeout):
             self._ussdSessionEvent = None
+            if self._ussdError != None:
+                error = self._ussdError
+                self._ussdError = None
+                raise error
+            self.timeoutProfile.record('+CUSD', monotonic() - startTime)
             return self._ussdResponse
         else: # Response timed out
             self._ussdSessionEvent = None
+            self.timeoutProfile.record('+CUSD', notificationTimeout)
             raise TimeoutException()
 
 
@@ -1044,7 +1704,7 @@ class GsmModem(SerialComms):
 
         if self._mustPollCallStatus:
             # Fake a call notification by polling call status until the status indicates that the call is being dialed
-            threading.Thread(target=self._pollCallStatus, kwargs={'expectedState': 0, 'timeout': timeout}).start()
+            self._startWorker(self._pollCallStatus, expectedState=0, timeout=timeout)
 
         if self._dialEvent.wait(timeout):
             self._dialEvent = None
@@ -1097,26 +1757,67 @@ class GsmModem(SerialComms):
         self._setSmsMemory(readDelete=memory)
         messages = []
         delMessages = set()
+        result = self.write(self._listSmsCommand(status), priority=PRIORITY_BULK)
+        for msgIndex, sms in self._parseSmsList(result, self.smsTextMode):
+            messages.append(sms)
+            delMessages.add(msgIndex)
+        if delete:
+            self._deleteListedSms(status, delMessages)
+        return messages
+
+    def iterStoredSms(self, status=Sms.STATUS_ALL, memory=None, delete=False):
+        """ Iterates over the SMS messages currently stored on the device/SIM card.
+
+        Like listStoredSms(), but messages are yielded while the rest of the modem's response is
+        still being received, and the response is never held in memory as a whole. The modem
+        cannot accept other commands until the response is complete; messages are therefore only
+        deleted (if requested) once the iteration is complete.
+
+        :param status: Filter messages based on this read status; must be 0-4 (see Sms class)
+        :type status: int
+        :param memory: The memory type to read from. If None, use the current default SMS read memory
+        :type memory: str or None
+        :param delete: If True, delete the messages from the device/SIM card after they have all been read
+        :type delete: bool
+
+        :return: A generator of Sms objects (ReceivedSms or StatusReport)
+        """
+        self._setSmsMemory(readDelete=memory)
+        lines = self.iterResponse(self._listSmsCommand(status), priority=PRIORITY_BULK)
+        delMessages = set()
+        for msgIndex, sms in self._parseSmsList(lines, self.smsTextMode):
+            delMessages.add(msgIndex)
+            yield sms
+        if delete:
+            self._deleteListedSms(status, delMessages)
+
+    def _listSmsCommand(self, status):
+        """ :return: The AT+CMGL command listing the stored messages with the specified status (in the current SMS mode) """
         if self.smsTextMode:
-            cmglRegex= re.compile('^\+CMGL: (\d+),"([^"]+)","([^"]+)",[^,]*,"([^"]+)"$')
             for key, val in dictItemsIter(Sms.TEXT_MODE_STATUS_MAP):
                 if status == val:
-                    statusStr = key
-                    break
-            else:
-                raise ValueError('Invalid status value: {0}'.format(status))
-            result = self.write('AT+CMGL="{0}"'.format(statusStr))
+                    return 'AT+CMGL="{0}"'.format(key)
+            raise ValueError('Invalid status value: {0}'.format(status))
+        else:
+            return 'AT+CMGL={0}'.format(status)
+
+    def _parseSmsList(self, lines, textMode):
+        """ Parses the lines of an AT+CMGL response, yielding each message as soon as it is complete
+
+        :return: A generator of (storage index, Sms object) tuples
+        """
+        if textMode:
+            cmglRegex = grammar.CMGL_TEXT.pattern
             msgLines = []
             msgIndex = msgStatus = number = msgTime = None
-            for line in result:
+            for line in lines:
                 cmglMatch = cmglRegex.match(line)
                 if cmglMatch:
                     # New message; save old one if applicable
                     if msgIndex != None and len(msgLines) > 0:
                         msgText = '\n'.join(msgLines)
                         msgLines = []
-                        messages.append(ReceivedSms(self, Sms.TEXT_MODE_STATUS_MAP[msgStatus], number, parseTextModeTimeStr(msgTime), msgText))
-                        delMessages.add(int(msgIndex))
+                        yield int(msgIndex), ReceivedSms(self, Sms.TEXT_MODE_STATUS_MAP[msgStatus], number, parseTextModeTimeStr(msgTime), msgText)
                     msgIndex, msgStatus, number, msgTime = cmglMatch.groups()
                     msgLines = []
                 else:
@@ -1125,13 +1826,11 @@ class GsmModem(SerialComms):
             if msgIndex != None and len(msgLines) > 0:
                 msgText = '\n'.join(msgLines)
                 msgLines = []
-                messages.append(ReceivedSms(self, Sms.TEXT_MODE_STATUS_MAP[msgStatus], number, parseTextModeTimeStr(msgTime), msgText))
-                delMessages.add(int(msgIndex))
+                yield int(msgIndex), ReceivedSms(self, Sms.TEXT_MODE_STATUS_MAP[msgStatus], number, parseTextModeTimeStr(msgTime), msgText)
         else:
-            cmglRegex = re.compile('^\+CMGL:\s*(\d+),\s*(\d+),.*$')
+            cmglRegex = grammar.CMGL_PDU.pattern
             readPdu = False
-            result = self.write('AT+CMGL={0}'.format(status))
-            for line in result:
+            for line in lines:
                 if not readPdu:
                     cmglMatch = cmglRegex.match(line)
                     if cmglMatch:
@@ -1154,17 +1853,17 @@ class GsmModem(SerialComms):
                             sms = StatusReport(self, int(msgStat), smsDict['reference'], smsDict['number'], smsDict['time'], smsDict['discharge'], smsDict['status'])
                         else:
                             raise CommandError('Invalid PDU type for readStoredSms(): {0}'.format(smsDict['type']))
-                        messages.append(sms)
-                        delMessages.add(msgIndex)
+                        yield msgIndex, sms
                         readPdu = False
-        if delete:
-            if status == Sms.STATUS_ALL:
-                # Delete all messages
-                self.deleteMultipleStoredSms()
-            else:
-                for msgIndex in delMessages:
-                    self.deleteStoredSms(msgIndex)
-        return messages
+
+    def _deleteListedSms(self, status, indexes):
+        """ Deletes the listed messages with the specified status, stored at the specified indexes """
+        if status == Sms.STATUS_ALL:
+            # Delete all messages
+            self.deleteMultipleStoredSms()
+        else:
+            for msgIndex in indexes:
+                self.deleteStoredSms(msgIndex)
 
     def _handleModemNotification(self, lines):
         """ Handler for unsolicited notifications from the modem
@@ -1174,16 +1873,41 @@ class GsmModem(SerialComms):
 
         :param lines The lines that were read
         """
-        threading.Thread(target=self.__threadedHandleModemNotification, kwargs={'lines': lines}).start()
+        self._startWorker(self.__threadedHandleModemNotification, lines=lines)
 
     def __threadedHandleModemNotification(self, lines):
         """ Implementation of _handleModemNotification() to be run in a separate thread
 
+        :param lines The lines that were read
+        """
+        metrics = self.metrics
+        if metrics != None:
+            notifType = notificationType(lines[0])
+            metrics.notifications.inc((self.port, notifType))
+            startTime = monotonic()
+            try:
+                self._dispatchModemNotification(lines)
+            finally:
+                metrics.notificationHandlerDuration.observe((self.port, notifType), monotonic() - startTime)
+        else:
+            self._dispatchModemNotification(lines)
+
+    def _dispatchModemNotification(self, lines):
+        """ Determines the type of an unsolicited notification, and calls the appropriate handler
+
         :param lines The lines that were read
         """
         next_line_is_te_statusreport = False
-        for line in lines:
-            if 'RING' in line:
+        cmtLine = None
+        for index, line in enumerate(lines):
+            if cmtLine != None:
+                # SMS message routed directly to the TE: this line contains its PDU (or text, in text mode; the text may span several lines)
+                self._handleSmsDelivered(cmtLine, '\n'.join(lines[index:]))
+                return
+            elif line.startswith('+CMT:'):
+                # SMS message at next line
+                cmtLine = line
+            elif 'RING' in line:
                 # Incoming call (or existing call is ringing)
                 self._handleIncomingCall(lines)
                 return
@@ -1350,13 +2074,83 @@ class GsmModem(SerialComms):
             if cmtiMatch:
                 msgMemory = cmtiMatch.group(1)
                 msgIndex = cmtiMatch.group(2)
-                sms = self.readStoredSms(msgIndex, msgMemory)
+                manager = self.storageManager
+                if manager != None:
+                    if not manager.claim(msgMemory, [int(msgIndex)]):
+                        self.log.debug('SMS message %s in %s is being handled while draining storage', msgIndex, msgMemory)
+                        return
+                    manager.stored(msgMemory)
                 try:
-                    self.smsReceivedCallback(sms)
-                except Exception:
-                    self.log.error('error in smsReceivedCallback', exc_info=True)
-                else:
-                    self.deleteStoredSms(msgIndex)
+                    try:
+                        sms = self.readStoredSms(msgIndex, msgMemory)
+                    except CommandError:
+                        if manager == None:
+                            raise
+                        # The message was already handled (and deleted) by a drain; the index is empty
+                        self.log.debug('SMS message %s in %s no longer stored; already handled while draining storage', msgIndex, msgMemory)
+                        return
+                    if self.metrics != None:
+                        self.metrics.sms.inc((self.port, 'received'))
+                    try:
+                        self.smsReceivedCallback(sms)
+                    except Exception:
+                        self.log.error('error in smsReceivedCallback', exc_info=True)
+                    else:
+                        self.deleteStoredSms(msgIndex)
+                finally:
+                    if manager != None:
+                        manager.release(msgMemory, [int(msgIndex)])
+                if manager != None:
+                    self._checkSmsStorage(msgMemory)
+
+    def _handleSmsDelivered(self, headerLine, dataLine):
+        """ Handler for SMS messages routed directly to the TE (+CMT notification, followed by the message)
+
+        The message is not stored by the modem, so no commands are needed to read or delete it;
+        it is only acknowledged with AT+CNMA if required. In text mode, text spanning several
+        lines is only received completely if the modem includes the message length in the +CMT
+        header (AT+CSDH=1; see gsmmodem.notifications).
+        """
+        self.log.debug('SMS message delivered to TE')
+        if self.smsTextMode:
+            cmtMatch = grammar.CMT_TEXT.match(headerLine)
+            if not cmtMatch:
+                self.log.debug('Discarding unparseable +CMT notification: %s', headerLine)
+                self._acknowledgeSms()
+                return
+            number, msgTime = cmtMatch.groups()
+            sms = ReceivedSms(self, Sms.STATUS_RECEIVED_UNREAD, number, parseTextModeTimeStr(msgTime), dataLine)
+        else:
+            try:
+                smsDict = decodeSmsPdu(dataLine)
+            except EncodingError:
+                smsDict = None
+            if smsDict == None or smsDict['type'] != 'SMS-DELIVER':
+                self.log.debug('Discarding invalid +CMT PDU: %s', dataLine)
+                self._acknowledgeSms(False)
+                return
+            sms = ReceivedSms(self, Sms.STATUS_RECEIVED_UNREAD, smsDict['number'], smsDict['time'], smsDict['text'], smsDict['smsc'], smsDict.get('udh', []))
+        self._acknowledgeSms()
+        if self.metrics != None:
+            self.metrics.sms.inc((self.port, 'received'))
+        try:
+            self.smsReceivedCallback(sms)
+        except Exception:
+            self.log.error('error in smsReceivedCallback', exc_info=True)
+
+    def _acknowledgeSms(self, success=True):
+        """ Acknowledges a message (or status report) routed directly to the TE with AT+CNMA, if required
+
+        If a required acknowledgement is not received in time, the modem reports an error to the
+        network (which retries delivery later) and may disable routing messages to the TE.
+
+        :param success: False to reject the message (PDU mode only), e.g. because it could not be decoded
+        """
+        if self._smsAckRequired:
+            try:
+                self.write('AT+CNMA' if success or self.smsTextMode else 'AT+CNMA=2', priority=PRIORITY_HIGH)
+            except (CommandError, TimeoutException):
+                self.log.warning('Failed to acknowledge SMS message routed to TE', exc_info=True)
 
     def _handleSmsStatusReport(self, notificationLine):
         """ Handler for SMS status reports """
@@ -1367,12 +2161,13 @@ class GsmModem(SerialComms):
             msgIndex = cdsiMatch.group(2)
             report = self.readStoredSms(msgIndex, msgMemory)
             self.deleteStoredSms(msgIndex)
+            self._recordStatusReportMetrics(report)
             # Update sent SMS status if possible
-            if report.reference in self.sentSms:
-                self.sentSms[report.reference].report = report
-            if self._smsStatusReportEvent:
-                # A sendSms() call is waiting for this response - notify waiting thread
-                self._smsStatusReportEvent.set()
+            sms = self.sentSms.resolve(report)
+            if sms != None:
+                sms.report = report
+            if sms != None and sms._reportAwaited:
+                pass # A sendSms() call is waiting for this report (and has been notified by setting sms.report)
             elif self.smsStatusReportCallback:
                 # Nothing is waiting for this report directly - use callback
                 try:
@@ -1390,20 +2185,34 @@ class GsmModem(SerialComms):
             smsDict = decodeSmsPdu(notificationLine)
         except EncodingError:
             self.log.debug('Discarding notification line from +CDS response: %s', notificationLine)
+            self._acknowledgeSms(False)
+            return
         else:
+            self._acknowledgeSms()
             if smsDict['type'] == 'SMS-STATUS-REPORT':
                 report = StatusReport(self, int(smsDict['status']), smsDict['reference'], smsDict['number'], smsDict['time'], smsDict['discharge'], smsDict['status'])
             else:
                 raise CommandError('Invalid PDU type for readStoredSms(): {0}'.format(smsDict['type']))
+        self._dispatchStatusReport(report)
+
+    def _dispatchStatusReport(self, report):
+        """ Updates the sent SMS (if any) that the status report refers to, and notifies the waiting sendSms() call or the status report callback """
+        self._recordStatusReportMetrics(report)
         # Update sent SMS status if possible
-        if report.reference in self.sentSms:
-            self.sentSms[report.reference].report = report
-        if self._smsStatusReportEvent:
-            # A sendSms() call is waiting for this response - notify waiting thread
-            self._smsStatusReportEvent.set()
-        else:
+        sms = self.sentSms.resolve(report)
+        if sms != None:
+            sms.report = report
+        if sms == None or not sms._reportAwaited:
             # Nothing is waiting for this report directly - use callback
-            self.smsStatusReportCallback(report)
+            try:
+                self.smsStatusReportCallback(report)
+            except Exception:
+                self.log.error('error in smsStatusReportCallback', exc_info=True)
+
+    def _recordStatusReportMetrics(self, report):
+        """ Counts a received SMS status report as "delivered" or "delivery_failed" (if metrics are enabled) """
+        if self.metrics != None:
+            self.metrics.sms.inc((self.port, 'delivered' if report.deliveryStatus == StatusReport.DELIVERED else 'delivery_failed'))
 
     def readStoredSms(self, index, memory=None):
         """ Reads and returns the SMS message at the specified index
@@ -1471,6 +2280,8 @@ class GsmModem(SerialComms):
         """
         self._setSmsMemory(readDelete=memory)
         self.write('AT+CMGD={0},0'.format(index))
+        if self.storageManager != None:
+            self.storageManager.removed(self._smsMemReadDelete)
         # TODO: make a check how many params are supported by the modem and use the right command. For example, Siemens MC35, TC35 take only one parameter.
         #self.write('AT+CMGD={0}'.format(index))
 
@@ -1497,6 +2308,12 @@ class GsmModem(SerialComms):
         if 0 < delFlag <= 4:
             self._setSmsMemory(readDelete=memory)
             self.write('AT+CMGD=1,{0}'.format(delFlag))
+            if self.storageManager != None:
+                if delFlag == 4:
+                    self.storageManager.removed(self._smsMemReadDelete, None)
+                else:
+                    # The number of deleted messages is unknown
+                    self.storageManager.invalidate(self._smsMemReadDelete)
         else:
             raise ValueError('"delFlag" must be in range [1,4]')
 
@@ -1557,7 +2374,8 @@ class GsmModem(SerialComms):
         callDone = False
         timeLeft = timeout or 999999
         while self.alive and not callDone and timeLeft > 0:
-            time.sleep(0.5)
+            if self._stopEvent.wait(0.5):
+                break # Connection closed
             if expectedState == 0: # Only call initializing can timeout
                 timeLeft -= 0.5
             try:
@@ -1565,6 +2383,8 @@ class GsmModem(SerialComms):
             except TimeoutException as timeout:
                 # Can happend if the call was ended during our time.sleep() call
                 clcc = None
+            except InterruptedException:
+                break # Connection closed
             if clcc:
                 direction = int(clcc.group(2))
                 if direction == 0: # Outgoing call
@@ -1642,7 +2462,7 @@ class Call(object):
             toneLen = len(tones)
             for tone in list(tones):
               try:
-                 self._gsmModem.write('AT{0}{1}'.format(dtmfCommandBase,tone), timeout=(5 + toneLen))
+                 self._gsmModem.write('AT{0}{1}'.format(dtmfCommandBase,tone), timeout=(5 + toneLen), priority=PRIORITY_HIGH)
 
               except CmeError as e:
                 if e.code == 30:
@@ -1662,7 +2482,7 @@ class Call(object):
         Does nothing if the call is already inactive.
         """
         if self.active:
-            self._gsmModem.write('ATH')
+            self._gsmModem.write('ATH', priority=PRIORITY_HIGH)
             self.answered = False
             self.active = False
         if self.id in self._gsmModem.activeCalls:
@@ -1697,7 +2517,7 @@ class IncomingCall(Call):
         :return: self (for chaining method calls)
         """
         if self.ringing:
-            self._gsmModem.write('ATA')
+            self._gsmModem.write('ATA', priority=PRIORITY_HIGH)
             self.ringing = False
             self.answered = True
         return self
@@ -1728,7 +2548,7 @@ class Ussd(object):
         :return: The USSD response message/session (as a Ussd object)
         """
         if self.sessionActive:
-            return self._gsmModem.sendUssd(message)
+            return self._gsmModem.sendUssd(message, priority=PRIORITY_HIGH)
         else:
             raise InvalidStateException('USSD session is inactive')
 
@@ -1738,4 +2558,4 @@ class Ussd(object):
         Does nothing if the USSD session is inactive.
         """
         if self.sessionActive:
-            self._gsmModem.write('AT+CUSD=2')
+            self._gsmModem.write('AT+CUSD=2', priority=PRIORITY_HIGH)
@@ -0,0 +1,192 @@
+""" Assembly of unsolicited notifications (unsolicited result codes) from the lines read from a modem
+
+A notification can consist of several lines (e.g. an incoming call's RING and +CLIP lines, or an
+SMS message delivered with +CMT followed by its PDU). The NotificationAssembler groups the lines
+of each notification without querying the serial port for pending data: notifications that are
+known to consist of a header followed by a fixed number of data lines (+CMT, +CBM and PDU mode
++CDS) are complete once those lines have been read, and other extended result codes (e.g.
++CMTI, +CLIP, ^CEND or HANGUP) and basic result codes (e.g. NO CARRIER) are complete
+immediately. USSD messages (+CUSD) are complete once their closing quote has been read. Any
+other lines (e.g. RING, which is usually followed by +CLIP) are grouped until no further line
+has been read for a short idle time.
+
+In SMS text mode, the text of a message delivered with +CMT may span several lines. It is only
+collected completely if the +CMT header includes the length of the message (i.e. if the modem
+shows the text mode parameters, AT+CSDH=1); otherwise only the first line of the text is part
+of the notification.
+"""
+
+import re, threading, logging
+
+from .compat import monotonic
+
+
+class NotificationAssembler(object):
+    """ Groups notification lines, and passes each complete notification to a callback """
+
+    log = logging.getLogger('gsmmodem.notifications.NotificationAssembler')
+
+    # Notification headers that are followed by a fixed number of data lines: (header regex, number of data lines)
+    FOLLOWING_LINES = ((re.compile(r'^\+CMT:'), 1), # SMS message delivered to the TE (text: message text; PDU mode: PDU)
+                       (re.compile(r'^\+CDS:\s*\d+"?$'), 1), # SMS status report delivered to the TE (PDU mode)
+                       (re.compile(r'^\+CBM:'), 1)) # Cell broadcast message delivered to the TE
+    # Text mode +CMT header including the text mode parameters (AT+CSDH=1): (dcs, length), e.g. +CMT: "+27820001234",,"13/03/08,15:02:16+08",145,4,0,0,"+27829999999",145,12
+    CMT_TEXT_LENGTH_REGEX = re.compile(r'^\+CMT:\s*"[^"]*",(?:"[^"]*")?[^,]*,"[^"]*",\d+,\d+,\d+,(\d+),"[^"]*",\d+,(\d+)\s*$')
+    # Extended (and vendor-specific, e.g. "HANGUP: 1") result codes; these complete a notification, unless they are listed in INCOMPLETE_PREFIXES
+    URC_REGEX = re.compile(r'^[\+\^]?[A-Z][A-Z0-9]*:')
+    # Prefixes of extended result codes that may be followed by further lines of the same notification
+    INCOMPLETE_PREFIXES = ('+CRING:', '+CLCC:')
+    # Basic result codes that are sent on their own (e.g. when a call is answered or ended)
+    COMPLETE_LINES = frozenset(('OK', 'CONNECT', 'NO CARRIER', 'BUSY', 'NO ANSWER', 'NO DIALTONE', 'ERROR'))
+    # End of a (possibly multi-line) +CUSD notification: the closing quote of the message and its data coding scheme, or no message
+    CUSD_END_REGEX = re.compile(r'(^\+CUSD:\s*\d+\s*$)|(",\s*\d+\s*$)')
+
+    def __init__(self, callback, idleTime=0.05, dataIdleTime=1.0):
+        """
+        :param callback: Function called with the list of lines of each complete notification
+        :type callback: func
+        :param idleTime: Time (in seconds) after the last line was read that an incomplete notification is passed on
+        :type idleTime: float
+        :param dataIdleTime: Time (in seconds) after the last line was read that a notification that is
+                             still expecting data lines (e.g. a +CMT header without its PDU) is passed on
+        :type dataIdleTime: float
+        """
+        self.callback = callback
+        self.idleTime = idleTime
+        self.dataIdleTime = dataIdleTime
+        self.expecting = 0 # Number of data lines still expected for the current notification
+        self._remainingChars = None # Number of characters of data still expected, for data of a known length
+        self._lines = []
+        self._cusdStatus = None # Status of the last +CUSD line of the current notification
+        self._lastLineTime = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = None # Idle flush thread; started when the first incomplete notification is read
+        self._closed = False
+        # Statistics
+        self.completed = 0 # Number of notifications completed based on their contents
+        self.idleFlushed = 0 # Number of notifications passed on after the idle time
+
+    def feed(self, line):
+        """ Adds a line read from the modem to the current notification; passes the notification
+        to the callback if it is complete """
+        with self._cond:
+            lines = self._lines
+            lines.append(line)
+            if self.expecting > 0:
+                if self._remainingChars != None:
+                    # Data of a known length; the line breaks between its lines count as one character
+                    self._remainingChars -= len(line)
+                    if self._remainingChars > 0:
+                        self._remainingChars -= 1
+                    else:
+                        self.expecting = 0
+                else:
+                    self.expecting -= 1
+                complete = self.expecting == 0
+            else:
+                complete = self._isComplete(line)
+            if complete:
+                self._lines = []
+                self._cusdStatus = None
+                self._remainingChars = None
+                self.completed += 1
+            else:
+                self._lastLineTime = monotonic()
+                if len(lines) == 1:
+                    self._startIdleTimer()
+                return
+        self._deliver(lines)
+
+    def _isComplete(self, line):
+        """ :return: True if the line completes the notification (also sets the number of expected data lines) """
+        lengthMatch = self.CMT_TEXT_LENGTH_REGEX.match(line)
+        if lengthMatch:
+            dcs, length = int(lengthMatch.group(1)), int(lengthMatch.group(2))
+            self.expecting = 1
+            self._remainingChars = self._textDataLength(dcs, length)
+            return False
+        for regex, count in self.FOLLOWING_LINES:
+            if regex.match(line):
+                self.expecting = count
+                return False
+        if line.startswith('+CUSD:'):
+            self._cusdStatus = line[6:].lstrip()[:1]
+        if self._cusdStatus != None:
+            # USSD messages may span several lines, and some modems follow a "session released"
+            # +CUSD notification (status 2 or 3) with the actual response
+            return self._cusdStatus not in ('2', '3') and self.CUSD_END_REGEX.search(line) != None
+        if line in self.COMPLETE_LINES:
+            return True
+        return self.URC_REGEX.match(line) != None and not line.startswith(self.INCOMPLETE_PREFIXES)
+
+    @staticmethod
+    def _textDataLength(dcs, length):
+        """ :return: The number of characters of text mode message data with the specified data coding scheme and length """
+        group = dcs & 0xF0
+        if group < 0x80 and not dcs & 0x0C or group in (0xC0, 0xD0) or group == 0xF0 and not dcs & 0x04:
+            return length # GSM 7-bit default alphabet: the length is the number of characters
+        return length * 2 # 8-bit data or UCS2: the length is the number of octets, which are hex-encoded
+
+    def _startIdleTimer(self):
+        """ Wakes up (or starts) the idle flush thread; must be called while holding the lock """
+        if self._thread == None:
+            self._closed = False
+            self._thread = threading.Thread(target=self._idleLoop, name='NotificationAssembler')
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._cond.notify()
+
+    def _idleLoop(self):
+        """ Passes on incomplete notifications once no line has been read for the idle time """
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._closed:
+                    if self._lines:
+                        remaining = self._lastLineTime + (self.dataIdleTime if self.expecting else self.idleTime) - monotonic()
+                        if remaining <= 0:
+                            break
+                        cond.wait(remaining)
+                    else:
+                        cond.wait()
+                if self._closed:
+                    return
+                lines = self._lines
+                self._lines = []
+                self._cusdStatus = None
+                self.expecting = 0
+                self._remainingChars = None
+                self.idleFlushed += 1
+            self._deliver(lines)
+
+    def _deliver(self, lines):
+        try:
+            self.callback(lines)
+        except Exception:
+            self.log.error('error in notification callback', exc_info=True)
+
+    def flush(self):
+        """ Passes on the current notification (if any), even if it is incomplete """
+        with self._cond:
+            lines = self._lines
+            self._lines = []
+            self._cusdStatus = None
+            self.expecting = 0
+            self._remainingChars = None
+        if lines:
+            self._deliver(lines)
+
+    def close(self):
+        """ Stops the idle flush thread, discarding any incomplete notification """
+        with self._cond:
+            self._closed = True
+            self._lines = []
+            self._cusdStatus = None
+            self.expecting = 0
+            self._remainingChars = None
+            thread = self._thread
+            self._thread = None
+            self._cond.notify()
+        if thread != None and thread != threading.current_thread():
+            thread.join()
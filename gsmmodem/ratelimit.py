@@ -0,0 +1,165 @@
+""" Send rate limiting for outgoing SMS messages
+
+Network operators throttle or block SIM cards that send messages too quickly. To stay below
+their limits, assign a SendRateLimiter to the ``rateLimiter`` attribute of a modem::
+
+    modem.rateLimiter = SendRateLimiter(perMinute=30, prefixes={'2782': 10})
+
+Every SMS message (part) sent by the modem then takes a token from the modem's bucket, and from
+the bucket of the longest matching destination prefix (if any); if a bucket is empty, sending
+waits until it has been refilled. Queueing layers can use delay() to find out how long a message
+would have to wait, without taking any tokens.
+"""
+
+import threading, time
+
+from .compat import monotonic
+
+
+class TokenBucket(object):
+    """ Token bucket: tokens are added at a fixed rate, up to the bucket's capacity
+
+    Tokens may be reserved before they are available (the token count becomes negative); later
+    reservations then have to wait until the earlier ones have been paid back, so that waiting
+    callers are served in order. Requests for more tokens than the bucket's capacity are allowed
+    once the bucket is full.
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: Number of tokens added per second
+        :type rate: float
+        :param capacity: Maximum number of tokens in the bucket (i.e. the largest burst)
+        :type capacity: float
+        """
+        if rate <= 0:
+            raise ValueError('Token bucket rate must be positive: {0}'.format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def delay(self, tokens=1, now=None):
+        """ :return: The time (in seconds) until the specified number of tokens is available (or, if
+                     this exceeds the bucket's capacity, until the bucket is full)
+        """
+        if now == None:
+            now = monotonic()
+        self._refill(now)
+        # The token count may refer to a later time, if tokens were consumed for the future
+        return max(0, self._updated - now + (min(tokens, self.capacity) - self._tokens) / self.rate)
+
+    def consume(self, tokens=1, now=None):
+        """ Takes the specified number of tokens from the bucket (even if they are not available yet)
+
+        :return: The time (in seconds) the caller has to wait before the tokens are available
+        :rtype: float
+        """
+        delay = self.delay(tokens, now)
+        self._tokens -= tokens
+        return delay
+
+    @property
+    def tokens(self):
+        """ The number of tokens currently in the bucket (negative if tokens have been reserved) """
+        self._refill(monotonic())
+        return self._tokens
+
+
+class SendRateLimiter(object):
+    """ Limits the rate at which SMS messages are sent: overall (per modem), and per destination prefix """
+
+    def __init__(self, perMinute=None, burst=1, prefixes=None):
+        """
+        :param perMinute: Maximum number of messages sent per minute (None for no overall limit)
+        :type perMinute: float
+        :param burst: Number of messages that may be sent at once after an idle period
+        :type burst: int
+        :param prefixes: Per destination prefix limits: dict of prefix (international format, without
+                         "+", e.g. "2782") to a maximum number of messages per minute, or a
+                         (messages per minute, burst) tuple. A message only counts towards the
+                         limit of the longest matching prefix.
+        :type prefixes: dict
+        """
+        self.bucket = TokenBucket(perMinute / 60.0, burst) if perMinute else None
+        self.prefixBuckets = {}
+        for prefix, limit in (prefixes or {}).items():
+            if isinstance(limit, tuple):
+                limit, prefixBurst = limit
+            else:
+                prefixBurst = burst
+            self.prefixBuckets[prefix.lstrip('+')] = TokenBucket(limit / 60.0, prefixBurst)
+        self._maxPrefixLength = max([len(prefix) for prefix in self.prefixBuckets] or [0])
+        self._lock = threading.Lock()
+        # Statistics
+        self.reservations = 0 # Number of messages (parts) that passed the limiter
+        self.delayed = 0 # Number of messages that had to wait
+        self.totalWait = 0 # Total time messages had to wait, in seconds
+        self.maxWait = 0 # Longest time a message had to wait, in seconds
+
+    def _buckets(self, destination):
+        """ :return: The buckets that apply to messages sent to the destination """
+        buckets = [self.bucket] if self.bucket != None else []
+        if self._maxPrefixLength > 0 and destination != None:
+            number = destination.lstrip('+')
+            for length in range(min(len(number), self._maxPrefixLength), 0, -1):
+                prefixBucket = self.prefixBuckets.get(number[:length])
+                if prefixBucket != None:
+                    buckets.append(prefixBucket)
+                    break
+        return buckets
+
+    def delay(self, destination, count=1):
+        """ :return: The time (in seconds) that sending count messages to the destination would have to wait now
+        :rtype: float
+        """
+        with self._lock:
+            now = monotonic()
+            return max([bucket.delay(count, now) for bucket in self._buckets(destination)] or [0])
+
+    def reserve(self, destination, count=1):
+        """ Reserves the capacity to send count messages to the destination
+
+        The caller must wait for the returned time before sending the messages.
+
+        :return: The time (in seconds) to wait before sending
+        :rtype: float
+        """
+        with self._lock:
+            now = monotonic()
+            buckets = self._buckets(destination)
+            wait = max([bucket.delay(count, now) for bucket in buckets] or [0])
+            for bucket in buckets:
+                bucket.consume(count, now + wait)
+            self.reservations += count
+            if wait > 0:
+                self.delayed += count
+                self.totalWait += wait
+                self.maxWait = max(self.maxWait, wait)
+            return wait
+
+    def acquire(self, destination, count=1):
+        """ Waits until count messages may be sent to the destination
+
+        :return: The time (in seconds) spent waiting
+        :rtype: float
+        """
+        wait = self.reserve(destination, count)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        """ :return: A snapshot of this limiter's statistics
+        :rtype: dict
+        """
+        with self._lock:
+            return {'reservations': self.reservations,
+                    'delayed': self.delayed,
+                    'totalWait': self.totalWait,
+                    'maxWait': self.maxWait}
@@ -0,0 +1,204 @@
+""" Single I/O thread serving many modems
+
+By default, every modem object runs its own read thread. On hosts with many modems, a shared
+Reactor can be used instead: it waits for data on all registered modems' file descriptors at
+once (using the selectors module), reads everything that is available without blocking, and
+passes it to the modems' line handling code. To use it, assign the reactor to the ``reactor``
+attribute of each modem before connecting::
+
+    reactor = Reactor()
+    reactor.start()
+    for port in ports:
+        modem = GsmModem(port)
+        modem.reactor = reactor
+        modem.connect()
+
+The modem API is unchanged. The transport of every modem using a reactor must provide a file
+descriptor (fileno()); this is the case for local serial ports on POSIX systems, and for the
+socket:// and fd:// transports.
+"""
+
+import os, threading, logging
+
+try:
+    import selectors
+except ImportError: #pragma: no cover
+    import selectors34 as selectors # Python 2: pip install selectors34
+
+import serial # pyserial: http://pyserial.sourceforge.net
+
+from .transport import readAvailable
+
+
+class _RegistrationChange(object):
+    """ A registration change to apply in the I/O thread """
+
+    __slots__ = ('register', 'modem', 'event', 'error')
+
+    def __init__(self, register, modem):
+        self.register = register
+        self.modem = modem
+        self.event = threading.Event()
+        self.error = None # Exception raised while applying the change (re-raised in the caller)
+
+
+class Reactor(object):
+    """ Multiplexes reads for many modems (SerialComms/GsmModem objects) in a single thread """
+
+    log = logging.getLogger('gsmmodem.reactor.Reactor')
+
+    # Interval (in seconds) at which callers waiting for a registration change check that the I/O thread is still running
+    CHANGE_POLL_INTERVAL = 0.5
+
+    def __init__(self):
+        self.alive = False
+        self.thread = None
+        self._selector = selectors.DefaultSelector()
+        self._modems = {} # key: modem; value: file descriptor
+        self._pending = [] # Registration changes to apply in the I/O thread (_RegistrationChange objects)
+        self._lock = threading.Lock()
+        # Self-pipe used to wake up the I/O thread
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        self._selector.register(self._wakeupRead, selectors.EVENT_READ)
+
+    def start(self):
+        """ Starts the I/O thread """
+        self.alive = True
+        self.thread = threading.Thread(target=self._loop, name='gsmmodem-reactor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stops the I/O thread (registered modems are not closed) """
+        self.alive = False
+        self._wakeup()
+        if self.thread != None and self.thread != threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def close(self):
+        """ Stops the I/O thread, and releases the reactor's resources """
+        self.stop()
+        self._selector.close()
+        os.close(self._wakeupRead)
+        os.close(self._wakeupWrite)
+
+    def register(self, modem):
+        """ Starts handling data read from the modem's (already opened) transport
+
+        :param modem: The modem
+        :type modem: gsmmodem.serial_comms.SerialComms
+
+        :raise ValueError: if the modem's transport does not provide a file descriptor
+        """
+        if not callable(getattr(modem.serial, 'fileno', None)):
+            raise ValueError('Transport of {0} does not provide a file descriptor (fileno()); it cannot be used with a reactor'.format(modem.port))
+        self._change(True, modem)
+
+    def unregister(self, modem):
+        """ Stops handling data read from the modem's transport
+
+        This waits for the I/O thread to stop using the modem, so that its transport can be
+        closed safely afterwards.
+        """
+        self._change(False, modem)
+
+    @property
+    def modems(self):
+        """ :return: The registered modems """
+        with self._lock:
+            return list(self._modems)
+
+    def _change(self, register, modem):
+        """ Applies a registration change in the I/O thread (or directly, if it is not running)
+
+        :raise Exception: the error raised while applying the change, if any
+        """
+        change = _RegistrationChange(register, modem)
+        with self._lock:
+            self._pending.append(change)
+        thread = self.thread
+        if thread == threading.current_thread():
+            self._applyChanges()
+        else:
+            self._wakeup()
+            while not change.event.wait(self.CHANGE_POLL_INTERVAL if self.alive else 0):
+                if not self.alive or thread == None or not thread.is_alive():
+                    # The I/O thread is not running (anymore); apply the change here
+                    self._applyChanges()
+        if change.error != None:
+            raise change.error
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeupWrite, b'x')
+        except OSError: #pragma: no cover
+            pass # Reactor was closed
+
+    def _applyChanges(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            for change in pending:
+                modem = change.modem
+                try:
+                    if change.register:
+                        fd = modem.serial.fileno()
+                        self._selector.register(fd, selectors.EVENT_READ, modem)
+                        self._modems[modem] = fd
+                    elif modem in self._modems:
+                        self._selector.unregister(self._modems.pop(modem))
+                except Exception as e:
+                    change.error = e
+                finally:
+                    change.event.set()
+
+    def _loop(self):
+        """ I/O thread main loop """
+        try:
+            self._select()
+        except Exception:
+            self.log.error('Reactor I/O thread failed', exc_info=True)
+        finally:
+            self.alive = False
+            # Release anything still waiting for a registration change
+            self._applyChanges()
+
+    def _select(self):
+        while self.alive:
+            for key, events in self._selector.select():
+                modem = key.data
+                if modem == None:
+                    # Wake-up: apply registration changes (or stop)
+                    os.read(self._wakeupRead, 4096)
+                    self._applyChanges()
+                    continue
+                if modem not in self._modems:
+                    continue # Unregistered during this iteration
+                try:
+                    data = readAvailable(modem.serial)
+                    if data:
+                        modem._handleRxBytes(data)
+                except serial.SerialException as e:
+                    self._unregisterNow(modem)
+                    modem._handleFatalError(e)
+                except Exception:
+                    self.log.error('Error handling data read from %s', modem.port, exc_info=True)
+
+    def _unregisterNow(self, modem):
+        with self._lock:
+            if modem in self._modems:
+                self._selector.unregister(self._modems.pop(modem))
+
+
+_defaultReactor = None
+_defaultReactorLock = threading.Lock()
+
+def getDefaultReactor():
+    """ :return: A shared, started Reactor instance (created on first use) """
+    global _defaultReactor
+    with _defaultReactorLock:
+        if _defaultReactor == None or not _defaultReactor.alive:
+            _defaultReactor = Reactor()
+            _defaultReactor.start()
+        return _defaultReactor
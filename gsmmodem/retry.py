@@ -0,0 +1,137 @@
+""" Retry and write pacing policies for modems that report transient "busy" errors """
+
+import random, threading
+
+
+class LatencyModel(object):
+    """ Exponentially-weighted moving average (EWMA) of command round-trip latency for a single modem """
+
+    def __init__(self, alpha=0.2):
+        """
+        :param alpha: Smoothing factor (0 < alpha <= 1); higher values favour recent samples
+        :type alpha: float
+        """
+        self.alpha = alpha
+        self.average = None # Current EWMA latency, in seconds (None until the first sample is recorded)
+        self.samples = 0 # Number of samples recorded
+
+    def record(self, latency):
+        """ Adds a latency sample (in seconds) to the model """
+        if self.average == None:
+            self.average = latency
+        else:
+            self.average += self.alpha * (latency - self.average)
+        self.samples += 1
+
+
+class RetryPolicy(object):
+    """ Retry policy for AT commands that fail with transient "device/SIM busy" errors
+
+    Failed commands are retried a bounded number of times, waiting a jittered, exponentially
+    increasing delay between attempts.
+
+    The policy also keeps a per-modem latency model which is used to pace writes (i.e. sleep a bit
+    after each command) - but only while the modem is struggling: pacing starts when a busy error
+    is seen, and stops again after ``recoveryCount`` consecutive commands completed without one.
+    """
+
+    # (error type, error code) pairs that are considered transient:
+    # CME 515 means: "Please wait, init or command processing in progress."
+    # CME 14 means: "SIM busy"
+    RETRY_ERRORS = frozenset((('CME', 515), ('CME', 14)))
+
+    def __init__(self, maxAttempts=5, baseDelay=0.2, maxDelay=5.0, jitter=0.5, alpha=0.2, paceFactor=0.5, maxPace=1.0, recoveryCount=10):
+        """
+        :param maxAttempts: Maximum number of times a command is sent (including the first attempt)
+        :type maxAttempts: int
+        :param baseDelay: Delay before the first retry, in seconds
+        :type baseDelay: float
+        :param maxDelay: Upper bound for the delay between retries, in seconds
+        :type maxDelay: float
+        :param jitter: Fraction (0-1) of each retry delay that is randomized
+        :type jitter: float
+        :param alpha: Smoothing factor of the command latency EWMA
+        :type alpha: float
+        :param paceFactor: While struggling, writes are paced by this fraction of the average command latency
+        :type paceFactor: float
+        :param maxPace: Upper bound for the pacing delay, in seconds
+        :type maxPace: float
+        :param recoveryCount: Number of busy-free commands after which pacing is disabled again
+        :type recoveryCount: int
+        """
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+        self.paceFactor = paceFactor
+        self.maxPace = maxPace
+        self.recoveryCount = recoveryCount
+        self.latency = LatencyModel(alpha)
+        self._congestion = 0 # Number of busy-free commands still required before pacing stops
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        # Metrics
+        self.busyErrors = 0 # Number of transient busy errors received
+        self.retries = 0 # Number of command retries issued
+        self.exhausted = 0 # Number of commands that failed after using up all attempts
+
+    def recordLatency(self, latency):
+        """ Records the round-trip time (in seconds) of a command that received a response """
+        with self._lock:
+            self.latency.record(latency)
+            if self._congestion > 0:
+                self._congestion -= 1
+
+    def retryDelay(self, errorType, errorCode, attempt):
+        """ Determines whether a failed command should be retried, and how long to wait before doing so
+
+        :param errorType: The error type ("CME" or "CMS")
+        :type errorType: str
+        :param errorCode: The error code returned by the modem
+        :type errorCode: int
+        :param attempt: The number of retries already done for this command (0 for the first attempt)
+        :type attempt: int
+
+        :return: the time to wait (in seconds) before retrying, or None if the command should not be retried
+        :rtype: float or None
+        """
+        if (errorType, errorCode) not in self.RETRY_ERRORS:
+            return None
+        with self._lock:
+            self.busyErrors += 1
+            self._congestion = self.recoveryCount
+            if attempt + 1 >= self.maxAttempts:
+                self.exhausted += 1
+                return None
+            self.retries += 1
+            return self._backoffDelay(attempt)
+
+    def backoffDelay(self, attempt):
+        """ :return: The jittered, exponentially increasing delay (in seconds) to wait before the specified retry attempt (0 for the first retry)
+        :rtype: float
+        """
+        with self._lock:
+            return self._backoffDelay(attempt)
+
+    def _backoffDelay(self, attempt):
+        delay = min(self.maxDelay, self.baseDelay * (2 ** attempt))
+        return delay * (1 - self.jitter * self._random.random())
+
+    @property
+    def pace(self):
+        """ :return: The time (in seconds) to wait after writing a command; 0 if the modem is not struggling """
+        if self._congestion > 0 and self.latency.average != None:
+            return min(self.maxPace, self.paceFactor * self.latency.average)
+        return 0
+
+    @property
+    def metrics(self):
+        """ :return: A snapshot of this policy's metrics
+        :rtype: dict
+        """
+        return {'busyErrors': self.busyErrors,
+                'retries': self.retries,
+                'exhausted': self.exhausted,
+                'latencyAverage': self.latency.average,
+                'latencySamples': self.latency.samples,
+                'pace': self.pace}
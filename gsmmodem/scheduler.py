@@ -0,0 +1,204 @@
+""" Priority scheduling of the commands written to a modem
+
+All commands written to a modem are serialized by its transmit lock. By default, this is a
+PriorityLock: threads waiting for the lock are served in order of the priority class of the
+command they want to write (and in arrival order within a class), so that latency-critical
+commands (e.g. answering or ending a call) are not queued behind bulk work (e.g. reading all
+stored messages, or a burst of SMS messages).
+
+The priority of the commands written by a thread is set with commandPriority()::
+
+    with commandPriority(PRIORITY_HIGH):
+        modem.sendSms('+27820000000', 'Your one-time PIN is 1234')
+
+Many GsmModem methods also accept a ``priority`` parameter. To prevent starvation, a waiting
+thread's priority is raised by one class for every ``agingInterval`` seconds it has waited.
+"""
+
+import threading
+
+from .compat import monotonic
+
+try:
+    from threading import get_ident
+except ImportError: #pragma: no cover
+    from thread import get_ident # Python 2
+
+# Priority classes (lower values are served first)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ('high', 'normal', 'bulk')
+
+_context = threading.local()
+
+
+def currentPriority():
+    """ :return: The priority class of the commands written by the calling thread (PRIORITY_NORMAL unless set with commandPriority()) """
+    return getattr(_context, 'priority', PRIORITY_NORMAL)
+
+
+class commandPriority(object):
+    """ Context manager setting the priority class of the commands written by the calling thread
+
+    If the priority is None, the current priority is kept.
+    """
+
+    __slots__ = ('priority', '_previous')
+
+    def __init__(self, priority):
+        self.priority = priority
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_context, 'priority', None)
+        if self.priority != None:
+            _context.priority = self.priority
+        return self
+
+    def __exit__(self, *args):
+        if self._previous == None:
+            if hasattr(_context, 'priority'):
+                del _context.priority
+        else:
+            _context.priority = self._previous
+
+
+class _Waiter(object):
+    """ A thread waiting for a PriorityLock """
+
+    __slots__ = ('priority', 'sequence', 'since', 'owner', 'event')
+
+    def __init__(self, priority, sequence, since, owner):
+        self.priority = priority
+        self.sequence = sequence
+        self.since = since
+        self.owner = owner
+        self.event = threading.Event()
+
+
+class PriorityLock(object):
+    """ Re-entrant lock (like threading.RLock) that is handed over to waiting threads by priority class
+
+    When the lock is released, it is handed over directly to the waiting thread with the highest
+    effective priority: the priority class of its command (see commandPriority()), raised by one
+    class for every agingInterval seconds it has waited. Threads with the same effective priority
+    are served in arrival order. Because the lock is handed over, a thread that releases the lock
+    cannot immediately take it back while others are waiting.
+
+    Wait times are recorded per priority class; see stats().
+    """
+
+    def __init__(self, name=None, agingInterval=2.0):
+        """
+        :param name: Name of this lock (used in stats())
+        :type name: str
+        :param agingInterval: Time (in seconds) after which a waiting thread's priority is raised by one class
+        :type agingInterval: float
+        """
+        self.name = name
+        self.agingInterval = agingInterval
+        self._mutex = threading.Lock()
+        self._owner = None
+        self._depth = 0
+        self._waiters = [] # _Waiter objects, in arrival order
+        self._sequence = 0
+        self._statsLock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Clears all recorded statistics """
+        with self._statsLock:
+            # Per priority class: [acquisitions, contended acquisitions, total wait time, max wait time]
+            self._stats = [[0, 0, 0, 0] for name in PRIORITY_NAMES]
+            self.promotions = 0 # Number of times a waiting thread was served ahead of a higher priority class because of aging
+
+    def acquire(self, blocking=True, timeout=-1):
+        me = get_ident()
+        with self._mutex:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            priority = currentPriority()
+            if self._owner == None and not self._waiters:
+                self._owner = me
+                self._depth = 1
+                self._record(priority, None)
+                return True
+            if not blocking:
+                return False
+            self._sequence += 1
+            waiter = _Waiter(priority, self._sequence, monotonic(), me)
+            self._waiters.append(waiter)
+        waiter.event.wait(timeout if timeout >= 0 else None)
+        with self._mutex:
+            if self._owner == me:
+                # Handed over by release() (possibly just as the wait timed out)
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self._mutex:
+            if self._owner != get_ident():
+                raise RuntimeError('cannot release un-acquired lock')
+            self._depth -= 1
+            if self._depth > 0:
+                return
+            if not self._waiters:
+                self._owner = None
+                return
+            now = monotonic()
+            waiter = min(self._waiters, key=lambda waiter: (self._effectivePriority(waiter, now), waiter.sequence))
+            self._waiters.remove(waiter)
+            self._owner = waiter.owner
+            self._depth = 1
+            self._record(waiter.priority, now - waiter.since,
+                         any(other.priority < waiter.priority for other in self._waiters))
+        waiter.event.set()
+
+    def _effectivePriority(self, waiter, now):
+        if self.agingInterval:
+            return waiter.priority - int((now - waiter.since) / self.agingInterval)
+        return waiter.priority
+
+    def _record(self, priority, waitTime, promoted=False):
+        with self._statsLock:
+            stats = self._stats[priority]
+            stats[0] += 1
+            if waitTime != None:
+                stats[1] += 1
+                stats[2] += waitTime
+                stats[3] = max(stats[3], waitTime)
+            if promoted:
+                self.promotions += 1
+
+    def _is_owned(self):
+        """ :return: True if the calling thread holds the lock (like threading.RLock._is_owned()) """
+        return self._owner == get_ident()
+
+    __enter__ = acquire
+
+    def __exit__(self, *args):
+        self.release()
+
+    @property
+    def waiting(self):
+        """ The number of threads currently waiting for the lock, by priority class name """
+        with self._mutex:
+            counts = dict((name, 0) for name in PRIORITY_NAMES)
+            for waiter in self._waiters:
+                counts[PRIORITY_NAMES[waiter.priority]] += 1
+            return counts
+
+    def stats(self):
+        """ :return: A snapshot of the recorded statistics: acquisitions, contended acquisitions and
+                     total/maximum wait time (in seconds) per priority class, and the number of
+                     waiting threads
+        :rtype: dict
+        """
+        waiting = self.waiting
+        with self._statsLock:
+            classes = dict((name, {'acquisitions': stats[0], 'contended': stats[1], 'totalWait': stats[2], 'maxWait': stats[3], 'waiting': waiting[name]})
+                           for name, stats in zip(PRIORITY_NAMES, self._stats))
+            return {'name': self.name, 'promotions': self.promotions, 'classes': classes}
@@ -7,8 +7,21 @@ import sys, threading, logging
 import re
 import serial # pyserial: http://pyserial.sourceforge.net
 
-from .exceptions import TimeoutException
+try:
+    import queue
+except ImportError: #pragma: no cover
+    import Queue as queue # Python 2
+
+from .exceptions import TimeoutException, InterruptedException
 from . import compat # For Python 2.6 compatibility
+from .compat import monotonic
+from .tracing import CommandTrace
+from .locks import ProfiledRLock
+from .scheduler import PriorityLock, PRIORITY_NAMES, commandPriority, currentPriority
+from .capture import RecordingSerial, openReplay
+from .transport import SocketTransport, FdTransport, parseHostPort
+from . import grammar
+from .notifications import NotificationAssembler
 
 class SerialComms(object):
     """ Wraps all low-level serial communications (actual read/write operations) """
@@ -17,10 +30,14 @@ class SerialComms(object):
 
     # End-of-line read terminator
     RX_EOL_SEQ = b'\r\n'
-    # End-of-response terminator
-    RESPONSE_TERM = re.compile('^OK|ERROR|(\+CM[ES] ERROR: \d+)|(COMMAND NOT SUPPORT)$')
+    # End-of-response terminator regex (kept for compatibility; responses are ended by the lines in responseTerminators)
+    RESPONSE_TERM = grammar.RESPONSE_TERM.pattern
     # Default timeout for serial port reads (in seconds)
     timeout = 1
+    # Maximum time (in seconds) that close() waits for worker threads (e.g. notification handlers) to finish
+    closeTimeout = 5
+    # Time (in seconds) after which an unsolicited notification that is not known to be complete is passed on, if no further lines are read
+    notificationIdleTime = 0.05
 
     def __init__(self, port, baudrate=115200, notifyCallbackFunc=None, fatalErrorCallbackFunc=None, *args, **kwargs):
         """ Constructor
@@ -35,9 +52,32 @@ class SerialComms(object):
         self._responseEvent = None # threading.Event()
         self._expectResponseTermSeq = None # expected response terminator sequence
         self._response = None # Buffer containing response to a written command
-        self._notification = [] # Buffer containing lines from an unsolicited notification from the modem
-        # Reentrant lock for managing concurrent write access to the underlying serial port
-        self._txLock = threading.RLock()
+        self._responseLineCallback = None # Function receiving the lines of the response to the current command as they arrive (see write())
+        # Groups the lines of unsolicited notifications from the modem
+        self._notifications = NotificationAssembler(self._handleNotification, self.notificationIdleTime)
+        # Final result codes that end a command's response: a gsmmodem.grammar.TerminatorSet, e.g. one of
+        # the modem profiles in gsmmodem.grammar.TERMINATOR_PROFILES, or a set extended with vendor-specific codes
+        self.responseTerminators = grammar.TERMINATOR_PROFILES['standard']
+        # Reentrant lock for managing concurrent write access to the underlying serial port; waiting
+        # commands are served by priority class (see gsmmodem.scheduler)
+        self.scheduler = PriorityLock('{0} txLock'.format(port))
+        self._txLock = self.scheduler
+
+        # Optional gsmmodem.metrics.MetricsRegistry instance; metrics are only recorded if this is set
+        self.metrics = None
+        # Optional gsmmodem.tracing.Tracer instance; command round trips are only traced if this is set
+        self.tracer = None
+        self._activeTrace = None # CommandTrace of the command currently waiting for a response
+        # Optional gsmmodem.capture.CaptureWriter instance; all serial port traffic is recorded if this is set when connecting
+        self.capture = None
+        # Optional gsmmodem.reactor.Reactor instance; if this is set when connecting, the reactor's I/O
+        # thread reads data from the device instead of a dedicated read thread
+        self.reactor = None
+        self.rxThread = None
+        self._workers = set() # Running worker threads (see _startWorker())
+        self._workersLock = threading.Lock()
+        self._stopEvent = threading.Event() # Set when the connection is closed; used for interruptible waits
+        self._connectionLock = threading.RLock() # Serializes opening and closing the transport
 
         self.notifyCallback = notifyCallbackFunc or self._placeholderCallback
         self.fatalErrorCallback = fatalErrorCallbackFunc or self._placeholderCallback
@@ -45,41 +85,205 @@ class SerialComms(object):
         self.com_args = args
         self.com_kwargs = kwargs
 
+        self._readTermSeq = bytearray(self.RX_EOL_SEQ)
+        self._rxBuffer = bytearray() # Received data that has not been handled yet (partial line)
+
     def connect(self):
         """ Connects to the device and starts the read thread """
-        self.serial = serial.Serial(dsrdtr=True, rtscts=True, port=self.port, baudrate=self.baudrate,
-                                    timeout=self.timeout,*self.com_args,**self.com_kwargs)
-        # Start read thread
-        self.alive = True
-        self.rxThread = threading.Thread(target=self._readLoop)
-        self.rxThread.daemon = True
-        self.rxThread.start()
+        self._stopEvent.clear()
+        self._openConnection()
+
+    def _openConnection(self):
+        """ Opens the transport and starts reading from it (in the read thread, or via the reactor) """
+        with self._connectionLock:
+            self.serial = self._openSerial()
+            if self.capture != None:
+                self.serial = RecordingSerial(self.serial, self.capture)
+            self.alive = True
+            del self._rxBuffer[:]
+            if self.reactor != None:
+                try:
+                    self.reactor.register(self)
+                except Exception:
+                    self.alive = False
+                    self.serial.close()
+                    raise
+            else:
+                # Start read thread
+                self.rxThread = threading.Thread(target=self._readLoop)
+                self.rxThread.daemon = True
+                self.rxThread.start()
+
+    def _openSerial(self):
+        """ Opens the transport for the port: a local serial port, or one of the URL-style ports
+        described in gsmmodem.transport """
+        port = str(self.port)
+        if port.startswith('socket://'):
+            host, tcpPort = parseHostPort(port[9:])
+            return SocketTransport(host, tcpPort, self.timeout)
+        elif port.startswith('rfc2217://'):
+            return serial.serial_for_url(port, baudrate=self.baudrate, timeout=self.timeout, **self.com_kwargs)
+        elif port.startswith('fd://'):
+            return FdTransport(int(port[5:]), self.timeout)
+        elif port.startswith('replay://'):
+            return openReplay(port, self.timeout)
+        return serial.Serial(dsrdtr=True, rtscts=True, port=self.port, baudrate=self.baudrate,
+                             timeout=self.timeout,*self.com_args,**self.com_kwargs)
+
+    def enableLockProfiling(self):
+        """ Replaces the transmit lock (which serializes all writes to the device) with an
+        instrumented lock that records contention statistics.
+
+        This should be called before connect(), or at least while no commands are being written.
+
+        :return: The instrumented lock; use its stats() or dump() methods to retrieve the statistics
+        :rtype: gsmmodem.locks.ProfiledRLock
+        """
+        if not isinstance(self._txLock, ProfiledRLock):
+            self._txLock = ProfiledRLock('{0} txLock'.format(self.port), lock=self.scheduler)
+        return self._txLock
 
     def close(self):
-        """ Stops the read thread, waits for it to exit cleanly, then closes the underlying serial port """
+        """ Stops the read thread (or unregisters from the reactor), waits for it to exit cleanly, then closes the underlying serial port
+
+        Blocking reads are cancelled where the serial port supports it, and commands waiting for a
+        response are interrupted (raising InterruptedException), so this normally completes within
+        milliseconds. Finally, worker threads (such as notification handlers) are given up to
+        closeTimeout seconds to finish.
+        """
         self.alive = False
-        self.rxThread.join()
-        self.serial.close()
+        self._stopEvent.set()
+        self._closeConnection()
+        self._notifications.close()
+        self._joinWorkers(self.closeTimeout)
+
+    def _closeConnection(self):
+        """ Stops reading from the transport (waking up any command waiting for a response), then closes it """
+        with self._connectionLock:
+            if self.reactor != None:
+                self.reactor.unregister(self)
+            else:
+                cancelRead = getattr(self.serial, 'cancel_read', None)
+                if cancelRead != None:
+                    cancelRead()
+                if self.rxThread != threading.current_thread():
+                    self.rxThread.join()
+            responseEvent = self._responseEvent
+            if responseEvent != None:
+                # Wake up the thread waiting for a response
+                responseEvent.set()
+            self.serial.close()
+            if self.capture != None:
+                self.capture.flush()
+
+    def _startWorker(self, target, *args, **kwargs):
+        """ Runs target(*args, **kwargs) in a new (tracked) worker thread; close() waits for worker threads to finish
+
+        :return: The worker thread
+        :rtype: threading.Thread
+        """
+        def run():
+            try:
+                target(*args, **kwargs)
+            finally:
+                with self._workersLock:
+                    self._workers.discard(thread)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        with self._workersLock:
+            self._workers.add(thread)
+        thread.start()
+        return thread
+
+    def _joinWorkers(self, timeout):
+        """ Waits (up to timeout seconds in total) for all worker threads, except the calling thread, to finish """
+        deadline = monotonic() + timeout
+        currentThread = threading.current_thread()
+        with self._workersLock:
+            workers = [worker for worker in self._workers if worker != currentThread]
+        for worker in workers:
+            worker.join(max(0, deadline - monotonic()))
+            if worker.is_alive():
+                self.log.warning('Worker thread %s did not finish within %s seconds', worker.name, timeout)
+                break
 
     def _handleLineRead(self, line, checkForResponseTerm=True):
         #print 'sc.hlineread:',line
-        if self._responseEvent and not self._responseEvent.is_set():
+        if self._notifications.expecting and checkForResponseTerm:
+            # Data line of a notification (e.g. the PDU following a +CMT header); notifications are not interrupted by responses
+            self._notifications.feed(line)
+        elif self._responseEvent and not self._responseEvent.is_set() and not (checkForResponseTerm and grammar.isNotification(line)):
             # A response event has been set up (another thread is waiting for this response)
-            self._response.append(line)
-            if not checkForResponseTerm or self.RESPONSE_TERM.match(line):
+            if self._activeTrace != None:
+                self._activeTrace.responseSize += len(line) + len(self.RX_EOL_SEQ)
+            if not checkForResponseTerm or self.responseTerminators.match(line):
                 # End of response reached; notify waiting thread
                 #print 'response:', self._response
+                self._response.append(line)
                 self.log.debug('response: %s', self._response)
                 self._responseEvent.set()
+            elif self._responseLineCallback != None:
+                try:
+                    self._responseLineCallback(line)
+                except Exception:
+                    self.log.error('error in response line callback', exc_info=True)
+            else:
+                self._response.append(line)
         else:
-            # Nothing was waiting for this - treat it as a notification
-            self._notification.append(line)
-            if self.serial.inWaiting() == 0:
-                # No more chars on the way for this notification - notify higher-level callback
-                #print 'notification:', self._notification
-                self.log.debug('notification: %s', self._notification)
-                self.notifyCallback(self._notification)
-                self._notification = []
+            # Nothing was waiting for this, or it is a notification that arrived while waiting for a
+            # response (e.g. +CMTI in the middle of a +CMGR response) - treat it as a notification
+            self._notifications.feed(line)
+
+    def _handleNotification(self, lines):
+        """ Passes a complete notification (see gsmmodem.notifications.NotificationAssembler) to the higher-level callback """
+        self.log.debug('notification: %s', lines)
+        self.notifyCallback(lines)
+
+    def iterResponse(self, data, **kwargs):
+        """ Writes a command, and iterates over the lines of its response as they are received
+
+        This allows long responses (e.g. listings of stored messages) to be processed while the
+        rest of the response is still arriving, without holding the whole response in memory.
+        The command is written by a worker thread (which holds the transmit lock until the
+        response is complete); if the calling thread already holds the transmit lock, the whole
+        response is read before it is iterated over instead.
+
+        The final status line of the response (e.g. "OK") is not included. Errors are raised
+        by the iterator, when they are detected by write().
+
+        :param data: The command to write
+        :type data: str
+        :param kwargs: Further arguments for write() (such as timeout or priority; if no priority
+                       is given, the priority set for the calling thread is used)
+
+        :return: A generator of response lines
+        """
+        isOwned = getattr(self._txLock, '_is_owned', None)
+        if isOwned != None and isOwned():
+            lines = []
+            self.write(data, responseLineCallback=lines.append, **kwargs)
+            for line in lines:
+                yield line
+            return
+        if kwargs.get('priority') == None:
+            # The worker thread does not share the calling thread's priority (see gsmmodem.scheduler)
+            kwargs['priority'] = currentPriority()
+        lines = queue.Queue()
+        def writeCommand():
+            try:
+                self.write(data, responseLineCallback=lines.put, **kwargs)
+            except Exception as e:
+                lines.put(e)
+            else:
+                lines.put(None)
+        self._startWorker(writeCommand)
+        while True:
+            line = lines.get()
+            if line == None:
+                return
+            elif isinstance(line, Exception):
+                raise line
+            yield line
 
     def _placeholderCallback(self, *args, **kwargs):
         """ Placeholder callback function (does nothing) """
@@ -87,60 +291,161 @@ class SerialComms(object):
     def _readLoop(self):
         """ Read thread main loop
 
-        Reads lines from the connected device
+        Reads data from the connected device (blocking until at least one byte is available, then
+        reading everything that is available), and passes it to _handleRxBytes()
         """
         try:
-            readTermSeq = bytearray(self.RX_EOL_SEQ)
-            readTermLen = len(readTermSeq)
-            rxBuffer = bytearray()
             while self.alive:
+                metrics = self.metrics
+                if metrics != None:
+                    readStart = monotonic()
                 data = self.serial.read(1)
                 if len(data) != 0: # check for timeout
-                    #print >> sys.stderr, ' RX:', data,'({0})'.format(ord(data))
-                    rxBuffer.append(ord(data))
-                    if rxBuffer[-readTermLen:] == readTermSeq:
-                        # A line (or other logical segment) has been read
-                        line = rxBuffer[:-readTermLen].decode()
-                        rxBuffer = bytearray()
-                        if len(line) > 0:
-                            #print 'calling handler'
-                            self._handleLineRead(line)
-                    elif self._expectResponseTermSeq:
-                        if rxBuffer[-len(self._expectResponseTermSeq):] == self._expectResponseTermSeq:
-                            line = rxBuffer.decode()
-                            rxBuffer = bytearray()
-                            self._handleLineRead(line, checkForResponseTerm=False)
-            #else:
-                #' <RX timeout>'
+                    waiting = self.serial.inWaiting()
+                    if waiting > 0:
+                        data += self.serial.read(waiting)
+                    self._handleRxBytes(data)
+                elif metrics != None:
+                    # <RX timeout>
+                    metrics.readIdle.inc((self.port,), monotonic() - readStart)
         except serial.SerialException as e:
-            self.alive = False
-            try:
-                self.serial.close()
-            except Exception: #pragma: no cover
-                pass
-            # Notify the fatal error handler
-            self.fatalErrorCallback(e)
+            self._handleFatalError(e)
+
+    def _handleRxBytes(self, data):
+        """ Handles a chunk of data read from the device, splitting it into lines (or other
+        logical segments, such as the "> " SMS data prompt) for _handleLineRead()
 
-    def write(self, data, waitForResponse=True, timeout=5, expectedResponseTermSeq=None):
+        Partial lines are kept until the rest of the line is received. This is used by both the
+        read thread and gsmmodem.reactor.Reactor.
+
+        :param data: The data that was read
+        :type data: bytes
+        """
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.encode() # Some serial port implementations return text
+        trace = self._activeTrace
+        if trace != None and trace.firstByteTime == None:
+            trace.firstByteTime = monotonic()
+            trace.tracer.onFirstByte(trace)
+        data = bytearray(data)
+        rxBuffer = self._rxBuffer
+        readTermSeq = self._readTermSeq
+        readTermLen = len(readTermSeq)
+        metrics = self.metrics
+        pos = 0
+        length = len(data)
+        while pos < length:
+            expectResponseTermSeq = self._expectResponseTermSeq
+            if expectResponseTermSeq:
+                # Check for the expected response terminator after every byte
+                rxBuffer.append(data[pos])
+                pos += 1
+            else:
+                # Consume everything up to (and including) the last byte of the next line terminator
+                end = data.find(readTermSeq[-1:], pos)
+                end = length if end == -1 else end + 1
+                rxBuffer.extend(data[pos:end])
+                pos = end
+            if rxBuffer[-readTermLen:] == readTermSeq:
+                # A line (or other logical segment) has been read
+                if metrics != None:
+                    metrics.bytesRead.inc((self.port,), len(rxBuffer))
+                line = rxBuffer[:-readTermLen].decode()
+                del rxBuffer[:]
+                if len(line) > 0:
+                    self._handleLineRead(line)
+            elif expectResponseTermSeq and rxBuffer[-len(expectResponseTermSeq):] == expectResponseTermSeq:
+                if metrics != None:
+                    metrics.bytesRead.inc((self.port,), len(rxBuffer))
+                line = rxBuffer.decode()
+                del rxBuffer[:]
+                self._handleLineRead(line, checkForResponseTerm=False)
+
+    def _handleFatalError(self, error):
+        """ Handles an error that makes the device unusable (e.g. it was unplugged) """
+        self.alive = False
+        try:
+            self.serial.close()
+        except Exception: #pragma: no cover
+            pass
+        # Notify the fatal error handler
+        self.fatalErrorCallback(error)
+
+    def write(self, data, waitForResponse=True, timeout=5, expectedResponseTermSeq=None, trace=None, priority=None, responseLineCallback=None):
+        """ Writes data to the serial port, optionally waiting for (and returning) the response
+
+        :param responseLineCallback: If set, the lines of the response (except the final status line)
+                                     are passed to this function as they arrive (in the read thread),
+                                     instead of being collected; only the status line is returned
+        :type responseLineCallback: func
+
+        :param priority: Priority class of this command (see gsmmodem.scheduler); if None, the
+                         priority set for the calling thread with commandPriority() is used
+        :type priority: int
+        :param trace: Trace object to use for this round trip (if tracing is enabled); created
+                      automatically if a tracer is set and this is None
+        :type trace: gsmmodem.tracing.CommandTrace
+        """
+        if trace == None and self.tracer != None:
+            trace = CommandTrace(self.tracer, self.port, data)
         data = data.encode()
-        with self._txLock:
+        metrics = self.metrics
+        if metrics != None:
+            metrics.bytesWritten.inc((self.port,), len(data))
+            waitStart = monotonic()
+        with commandPriority(priority), self._txLock:
+            if metrics != None:
+                metrics.commandWait.observe((self.port, PRIORITY_NAMES[currentPriority()]), monotonic() - waitStart)
+            if trace != None:
+                trace.lockAcquiredTime = monotonic()
+                trace.tracer.onCommandStart(trace)
             if waitForResponse:
                 if expectedResponseTermSeq:
                     self._expectResponseTermSeq = bytearray(expectedResponseTermSeq.encode())
                 self._response = []
+                self._responseLineCallback = responseLineCallback
                 self._responseEvent = threading.Event()
+                self._activeTrace = trace
                 self.serial.write(data)
+                if trace != None:
+                    # The response may start arriving before serial.write() returns
+                    writtenTime = monotonic()
+                    firstByteTime = trace.firstByteTime
+                    trace.writtenTime = min(writtenTime, firstByteTime) if firstByteTime != None else writtenTime
                 if self._responseEvent.wait(timeout):
+                    if not self.alive:
+                        # Woken up by close()
+                        self._responseEvent = None
+                        self._responseLineCallback = None
+                        self._expectResponseTermSeq = False
+                        self._activeTrace = None
+                        raise InterruptedException('Connection closed while waiting for a response')
                     self._responseEvent = None
+                    self._responseLineCallback = None
                     self._expectResponseTermSeq = False
+                    self._activeTrace = None
+                    if trace != None:
+                        trace.completeTime = monotonic()
+                        trace.responseLines = len(self._response)
+                        trace.tracer.onResponseComplete(trace)
                     return self._response
                 else: # Response timed out
                     self._responseEvent = None
+                    self._responseLineCallback = None
                     self._expectResponseTermSeq = False
+                    self._activeTrace = None
                     if len(self._response) > 0:
                         # Add the partial response to the timeout exception
-                        raise TimeoutException(self._response)
+                        error = TimeoutException(self._response)
                     else:
-                        raise TimeoutException()
+                        error = TimeoutException()
+                    if trace != None:
+                        trace.responseLines = len(self._response)
+                        trace.error = error
+                        trace.tracer.onError(trace, error)
+                    raise error
             else:
                 self.serial.write(data)
+                if trace != None:
+                    trace.writtenTime = trace.completeTime = monotonic()
+                    trace.tracer.onResponseComplete(trace)
@@ -0,0 +1,188 @@
+""" SMS message storage management
+
+Messages that are received while the modem's message storage (e.g. the SIM card) is full are
+not delivered: the network retries delivery later, and +CMTI notifications stop. Messages are
+normally deleted once they have been handled, but messages whose callback failed (and messages
+received while python-gsmmodem was not running) are left in storage, which slowly fills up.
+
+To keep storage from filling up, assign a StorageManager to the ``storageManager`` attribute of
+a modem before connecting::
+
+    modem.storageManager = StorageManager(highWater=0.8)
+
+The modem then keeps track of how many messages are stored in each memory (from AT+CPMS
+responses, and counting stored and deleted messages in between), processes the messages left
+in storage when connecting, and reads all stored messages in batches (one AT+CMGL command per
+read status) as soon as the usage of a memory reaches the high-water mark.
+"""
+
+import re, threading
+
+
+class StorageManager(object):
+    """ Tracks SMS message storage usage, and decides when stored messages should be drained """
+
+    # Memory usage in an AT+CPMS? response (memory, used, total), e.g. +CPMS: "SM",3,30,"SM",3,30,"SM",3,30
+    CPMS_QUERY_REGEX = re.compile(r'"([^"]+)",\s*(\d+),\s*(\d+)')
+    # Memory usage in the response to setting the memories (used, total), e.g. +CPMS: 3,30,3,30,3,30
+    CPMS_SET_REGEX = re.compile(r'(\d+),\s*(\d+)')
+
+    def __init__(self, highWater=0.8):
+        """
+        :param highWater: Fraction of a memory's capacity at which its stored messages are drained
+        :type highWater: float
+        """
+        if not 0 < highWater <= 1:
+            raise ValueError('High-water mark must be in range (0, 1]: {0}'.format(highWater))
+        self.highWater = highWater
+        self._usage = {} # key: memory name (e.g. "SM"); value: [used, total]
+        self._inFlight = set() # (memory, index) tuples of messages currently being handled (by a +CMTI handler or a drain)
+        self._lock = threading.Lock()
+        self._drainLock = threading.Lock()
+        # Statistics
+        self.drains = 0 # Number of times stored messages were drained
+        self.drainedMessages = 0 # Number of messages read by drains
+        self.peakUsed = 0 # Highest number of messages stored in a memory
+
+    @staticmethod
+    def _memoryName(memory):
+        return memory.strip('"') if memory else memory
+
+    def update(self, memory, used, total):
+        """ Records the number of messages stored in a memory, and the memory's capacity """
+        memory = self._memoryName(memory)
+        with self._lock:
+            self._usage[memory] = [used, total]
+            self.peakUsed = max(self.peakUsed, used)
+
+    def updateFromResponse(self, lines, memories=None):
+        """ Records memory usage from the response to an AT+CPMS command
+
+        :param lines: The response lines
+        :type lines: list
+        :param memories: The memories (in order) that the command set, for responses that do not
+                         name the memories (responses to AT+CPMS=<mem1>[,<mem2>[,<mem3>]])
+        :type memories: list
+        """
+        for line in lines:
+            if line.startswith('+CPMS:'):
+                data = line[6:]
+                queried = self.CPMS_QUERY_REGEX.findall(data)
+                if queried:
+                    for memory, used, total in queried:
+                        self.update(memory, int(used), int(total))
+                elif memories:
+                    for memory, (used, total) in zip(memories, self.CPMS_SET_REGEX.findall(data)):
+                        if memory:
+                            self.update(memory, int(used), int(total))
+                return
+
+    def stored(self, memory, count=1):
+        """ Records that messages were stored in a memory (e.g. when a +CMTI notification is received) """
+        memory = self._memoryName(memory)
+        with self._lock:
+            usage = self._usage.get(memory)
+            if usage != None:
+                usage[0] = min(usage[0] + count, usage[1])
+                self.peakUsed = max(self.peakUsed, usage[0])
+
+    def removed(self, memory, count=1):
+        """ Records that messages were deleted from a memory
+
+        :param count: The number of deleted messages, or None if all messages were deleted
+        :type count: int
+        """
+        memory = self._memoryName(memory)
+        with self._lock:
+            usage = self._usage.get(memory)
+            if usage != None:
+                usage[0] = max(usage[0] - count, 0) if count != None else 0
+
+    def invalidate(self, memory):
+        """ Forgets the usage of a memory (e.g. after deleting an unknown number of messages from it) """
+        with self._lock:
+            self._usage.pop(self._memoryName(memory), None)
+
+    def usage(self, memory):
+        """ :return: The (used, total) number of messages of a memory, or None if unknown
+        :rtype: tuple
+        """
+        with self._lock:
+            usage = self._usage.get(self._memoryName(memory))
+            return tuple(usage) if usage != None else None
+
+    def needsDrain(self, memory):
+        """ :return: True if the usage of the memory has reached the high-water mark
+        :rtype: bool
+        """
+        usage = self.usage(memory)
+        return usage != None and usage[1] > 0 and usage[0] >= usage[1] * self.highWater
+
+    def claim(self, memory, indexes):
+        """ Claims stored messages for handling, so that they are not handled by two threads at once
+
+        Messages that are already being handled are not claimed. Claimed messages must be
+        released with release().
+
+        Messages handled by a drain are deleted, and are not remembered: a +CMTI notification
+        that arrives after its message was drained is detected by the message's storage index
+        being empty. (Remembering drained indexes would swallow the notification of a newer
+        message stored at the same index, if the notification of the drained message never arrives.)
+
+        :param memory: The memory the messages are stored in
+        :type memory: str
+        :param indexes: The storage indexes of the messages
+        :type indexes: list of int
+
+        :return: The indexes of the messages that were claimed
+        :rtype: list of int
+        """
+        memory = self._memoryName(memory)
+        claimed = []
+        with self._lock:
+            for index in indexes:
+                key = (memory, int(index))
+                if key not in self._inFlight:
+                    self._inFlight.add(key)
+                    claimed.append(index)
+        return claimed
+
+    def release(self, memory, indexes):
+        """ Releases messages claimed with claim() """
+        memory = self._memoryName(memory)
+        with self._lock:
+            for index in indexes:
+                self._inFlight.discard((memory, int(index)))
+
+    def drained(self, memory, indexes):
+        """ Records that messages were handled (and deleted) by a drain """
+        with self._lock:
+            self.drainedMessages += len(indexes)
+
+    def startDrain(self):
+        """ :return: True if the caller may drain stored messages; False if a drain is already in progress
+        :rtype: bool
+        """
+        if self._drainLock.acquire(False):
+            self.drains += 1
+            return True
+        return False
+
+    def endDrain(self):
+        self._drainLock.release()
+
+    def reset(self):
+        """ Forgets all memory usage and claimed messages (e.g. when (re)connecting) """
+        with self._lock:
+            self._usage.clear()
+            self._inFlight.clear()
+
+    def stats(self):
+        """ :return: A snapshot of this manager's statistics
+        :rtype: dict
+        """
+        with self._lock:
+            return {'usage': dict((memory, tuple(usage)) for memory, usage in self._usage.items()),
+                    'drains': self.drains,
+                    'drainedMessages': self.drainedMessages,
+                    'peakUsed': self.peakUsed}
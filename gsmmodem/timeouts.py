@@ -0,0 +1,106 @@
+""" Per-command timeout profiles, learned from observed command latencies """
+
+import threading
+from collections import deque
+
+
+class TimeoutProfile(object):
+    """ Keeps a window of recent response latencies per AT command family (see
+    gsmmodem.util.commandFamily()) for a single modem, and derives command timeouts from them
+
+    Until enough samples have been recorded for a command family, its default timeout is used.
+    After that, the timeout is a high percentile of the observed latencies multiplied by a safety
+    factor, bounded by ``floor`` and ``ceiling``: stuck commands fail fast on quick modems, while
+    slow-but-healthy modems are given more time. Command families with an entry in
+    DEFAULT_TIMEOUTS never get less than that default: their latency depends on the network or the
+    SIM card rather than on the modem, and a false timeout (e.g. after the network accepted an SMS
+    message) makes callers repeat the command.
+    """
+
+    # Default timeouts (in seconds) for command families that need more (or less) time than defaultTimeout
+    DEFAULT_TIMEOUTS = {'+CPIN?': 15, # SIM card access can be slow directly after power-up
+                        '+CMGS=': 5, # Waiting for the "> " SMS data prompt
+                        '+CMGS=<data>': 35, # SMS data written after the prompt; waits for the network
+                        '+CMSS=': 35, # Sending a stored SMS message; waits for the network
+                        '+CUSD=': 15, # Starting/continuing a USSD session
+                        '+CUSD': 15} # USSD session round trip (until the +CUSD notification is received)
+
+    def __init__(self, defaultTimeout=10, floor=0.5, ceiling=35, percentile=0.99, headroom=3.0, minSamples=20, windowSize=200):
+        """
+        :param defaultTimeout: Timeout (in seconds) used for command families without a specific default
+        :type defaultTimeout: int or float
+        :param floor: Lower bound for derived timeouts, in seconds (command families listed in DEFAULT_TIMEOUTS use their default as the lower bound)
+        :type floor: int or float
+        :param ceiling: Upper bound for derived timeouts, in seconds
+        :type ceiling: int or float
+        :param percentile: The latency percentile (0-1) that derived timeouts are based on
+        :type percentile: float
+        :param headroom: Safety factor applied to the latency percentile
+        :type headroom: float
+        :param minSamples: Number of samples required before a timeout is derived for a command family
+        :type minSamples: int
+        :param windowSize: Number of recent samples kept per command family
+        :type windowSize: int
+        """
+        self.defaultTimeout = defaultTimeout
+        self.floor = floor
+        self.ceiling = ceiling
+        self.percentile = percentile
+        self.headroom = headroom
+        self.minSamples = minSamples
+        self.windowSize = windowSize
+        self._samples = {} # key: command family, value: deque of recent latencies
+        self._lock = threading.Lock()
+
+    def record(self, family, latency):
+        """ Records the response latency (in seconds) of a command of the specified family
+
+        Commands that timed out should be recorded with the timeout that was used; this allows the
+        profile to recover if a modem has become slower.
+        """
+        with self._lock:
+            samples = self._samples.get(family)
+            if samples == None:
+                samples = self._samples[family] = deque(maxlen=self.windowSize)
+            samples.append(latency)
+
+    def latencyPercentile(self, family, percentile):
+        """ :return: The specified percentile (0-1) of the recent latencies for the command family, or None if no samples are available """
+        with self._lock:
+            samples = self._samples.get(family)
+            if not samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+    def timeout(self, family, default=None):
+        """ Returns the timeout to use for a command of the specified family
+
+        :param family: The command family
+        :type family: str
+        :param default: Timeout to use until enough samples have been recorded. If None, the
+                        family's entry in DEFAULT_TIMEOUTS is used (or defaultTimeout if it has none)
+        :type default: int or float
+
+        :return: the timeout, in seconds
+        :rtype: float
+        """
+        if default == None:
+            default = self.DEFAULT_TIMEOUTS.get(family, self.defaultTimeout)
+        samples = self._samples.get(family)
+        if samples == None or len(samples) < self.minSamples:
+            return default
+        derived = self.latencyPercentile(family, self.percentile) * self.headroom
+        return max(self.floor, self.DEFAULT_TIMEOUTS.get(family, 0), min(self.ceiling, derived))
+
+    @property
+    def stats(self):
+        """ :return: Per-family latency statistics: sample count, median and the configured percentile
+        :rtype: dict
+        """
+        with self._lock:
+            families = list(self._samples)
+        return dict((family, {'samples': len(self._samples[family]),
+                              'median': self.latencyPercentile(family, 0.5),
+                              'percentile': self.latencyPercentile(family, self.percentile),
+                              'timeout': self.timeout(family)}) for family in families)
@@ -0,0 +1,95 @@
+""" Tracing hooks for AT command round trips
+
+To trace commands, assign a Tracer subclass instance to the ``tracer`` attribute of a modem
+(GsmModem or SerialComms). Its methods are called with a CommandTrace object at each stage of
+every command round trip. All timestamps are taken from a monotonic clock.
+
+Tracer methods are called synchronously (onFirstByte is called from the serial read thread),
+so they should return quickly.
+"""
+
+from .compat import monotonic
+
+
+class CommandTrace(object):
+    """ Timing information for a single AT command round trip
+
+    The round trip is split into the following phases:
+
+    - lockWait: time spent waiting for exclusive access to the serial port (other commands in progress)
+    - writeTime: time spent writing the command to the serial port
+    - processingTime: time between writing the command and receiving the first byte back (modem firmware/network)
+    - receiveTime: time between the first byte and the end of the response (receiving the response)
+
+    Note: the "first byte" is the first byte received after the command was written; this may
+    belong to an unsolicited notification that happened to arrive at the same time. If the
+    response starts arriving while the command is still being written, the command is considered
+    written when the first byte arrives (i.e. the processing time is 0).
+    """
+
+    def __init__(self, tracer, port, command):
+        self.tracer = tracer
+        self.port = port
+        self.command = command # The command/data that was written
+        self.attempt = 0 # Retry attempt number (0 for the first attempt)
+        self.startTime = monotonic() # write() was called
+        self.lockAcquiredTime = None # Exclusive access to the serial port was obtained
+        self.writtenTime = None # The command has been written to the serial port
+        self.firstByteTime = None # The first byte was received after writing the command
+        self.completeTime = None # The full response was received (or the command was written if no response was expected)
+        self.responseSize = 0 # Size of the response, in bytes
+        self.responseLines = 0 # Number of lines in the response
+        self.error = None # The exception raised for this command, if any
+
+    @staticmethod
+    def _duration(start, end):
+        # Timestamps taken by the read thread may be a little out of order with the writer's
+        return max(end - start, 0) if start != None and end != None else None
+
+    @property
+    def lockWait(self):
+        """ :return: Time (in seconds) spent waiting for the serial port transmit lock """
+        return self._duration(self.startTime, self.lockAcquiredTime)
+
+    @property
+    def writeTime(self):
+        """ :return: Time (in seconds) spent writing the command to the serial port """
+        return self._duration(self.lockAcquiredTime, self.writtenTime)
+
+    @property
+    def processingTime(self):
+        """ :return: Time (in seconds) between writing the command and receiving the first response byte """
+        return self._duration(self.writtenTime, self.firstByteTime)
+
+    @property
+    def receiveTime(self):
+        """ :return: Time (in seconds) between receiving the first response byte and the end of the response """
+        return self._duration(self.firstByteTime, self.completeTime)
+
+    @property
+    def totalTime(self):
+        """ :return: Total time (in seconds) of the round trip, including lock waiting time """
+        return self._duration(self.startTime, self.completeTime)
+
+    def __repr__(self):
+        return 'CommandTrace({0!r}, lockWait={1}, writeTime={2}, processingTime={3}, receiveTime={4}, responseSize={5})'.format(
+            self.command, self.lockWait, self.writeTime, self.processingTime, self.receiveTime, self.responseSize)
+
+
+class Tracer(object):
+    """ Base class for command tracers; all methods do nothing by default """
+
+    def onCommandStart(self, trace):
+        """ Called when a command is about to be written (after the transmit lock was acquired) """
+
+    def onFirstByte(self, trace):
+        """ Called (from the serial read thread) when the first byte is received after writing a command """
+
+    def onResponseComplete(self, trace):
+        """ Called when the full response to a command has been received """
+
+    def onError(self, trace, error):
+        """ Called when a command fails: it timed out, or the modem returned an error
+
+        :param error: The exception that will be raised (TimeoutException, CommandError, etc)
+        """
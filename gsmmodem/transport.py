@@ -0,0 +1,258 @@
+""" Transports: the byte streams that SerialComms reads from and writes to
+
+Besides local serial ports (pyserial Serial objects), the following transports are supported,
+selected by the modem's port string:
+
+- ``socket://<host>:<port>``: raw TCP connection, e.g. to a serial-over-IP concentrator
+- ``rfc2217://<host>:<port>``: RFC 2217 (Telnet COM port control) connection, via pyserial
+- ``fd://<number>``: an already-open file descriptor (e.g. a pseudo-terminal or socket)
+- ``replay://<path>``: a recorded session (see gsmmodem.capture)
+
+All transports provide the same interface as pyserial Serial objects (read(), write(),
+inWaiting() and close()). The transports in this module additionally expose fileno() and a
+non-blocking readAvailable() method, so that a single selector-based I/O thread can serve
+many modems.
+"""
+
+import os, errno, socket, select, threading
+
+import serial # pyserial: http://pyserial.sourceforge.net
+
+try:
+    import fcntl
+except ImportError: #pragma: no cover
+    fcntl = None # Windows
+
+# Maximum number of bytes read from the underlying file descriptor at once
+READ_CHUNK_SIZE = 4096
+
+
+class BufferedTransport(object):
+    """ Base class for transports based on a non-blocking file descriptor
+
+    Data is read from the file descriptor in bulk, and buffered; subclasses implement the
+    non-blocking _recv() and _send() methods, and fileno().
+    """
+
+    def __init__(self, timeout=None):
+        """
+        :param timeout: Read timeout, in seconds (None to block until data is available)
+        :type timeout: float
+        """
+        self.timeout = timeout
+        self._rxBuffer = bytearray()
+        self._txLock = threading.Lock()
+        self._open = True
+        self._cancelled = False
+        # Self-pipe used by cancel_read() to wake up a blocked read()
+        self._cancelReadFd, self._cancelWriteFd = os.pipe()
+
+    def fileno(self):
+        raise NotImplementedError()
+
+    def _recv(self):
+        """ Reads available data without blocking
+
+        :raise serial.SerialException: if the connection was closed by the remote end
+
+        :return: The data that was read (empty if no data was available)
+        :rtype: bytes
+        """
+        raise NotImplementedError()
+
+    def _send(self, data):
+        """ Writes data without blocking
+
+        :return: The number of bytes written
+        :rtype: int
+        """
+        raise NotImplementedError()
+
+    def readAvailable(self):
+        """ Returns all buffered and available data, without blocking
+
+        :raise serial.SerialException: if the connection was closed by the remote end
+
+        :rtype: bytes
+        """
+        self._rxBuffer.extend(self._recv())
+        data = bytes(self._rxBuffer)
+        del self._rxBuffer[:]
+        return data
+
+    def read(self, size=1):
+        """ Reads up to size bytes, waiting up to the read timeout for data to arrive """
+        if not self._rxBuffer and self._open and not self._cancelled:
+            self._rxBuffer.extend(self._recv())
+            if not self._rxBuffer and self._wait(0, self.timeout):
+                self._rxBuffer.extend(self._recv())
+        self._cancelled = False
+        data = bytes(self._rxBuffer[:size])
+        del self._rxBuffer[:size]
+        return data
+
+    def write(self, data):
+        """ Writes all of the data, waiting for the transport to become writable if required """
+        length = len(data)
+        with self._txLock:
+            while len(data) > 0:
+                data = data[self._send(data):]
+                if len(data) > 0:
+                    self._wait(1, self.timeout)
+        return length
+
+    def _wait(self, direction, timeout):
+        """ Waits for the file descriptor to become readable (direction 0) or writable (direction 1)
+
+        :return: True if the file descriptor is ready
+        """
+        fds = ([self, self._cancelReadFd], []) if direction == 0 else ([], [self])
+        try:
+            ready = select.select(fds[0], fds[1], [], timeout)
+        except (select.error, ValueError, OSError):
+            # The transport was closed while waiting
+            return False
+        if self._cancelReadFd in ready[0]:
+            os.read(self._cancelReadFd, 1024)
+            return False
+        return bool(ready[0] or ready[1])
+
+    def cancel_read(self):
+        """ Makes a (concurrently) blocked read() call return immediately """
+        if self._open:
+            self._cancelled = True
+            os.write(self._cancelWriteFd, b'x')
+
+    def inWaiting(self):
+        if self._open:
+            self._rxBuffer.extend(self._recv())
+        return len(self._rxBuffer)
+
+    def close(self):
+        if self._open:
+            self._open = False
+            os.close(self._cancelReadFd)
+            os.close(self._cancelWriteFd)
+
+
+class SocketTransport(BufferedTransport):
+    """ Transport for modems connected via a raw TCP socket ("socket://<host>:<port>") """
+
+    def __init__(self, host, port, timeout=None, connectTimeout=10):
+        """
+        :param host: Host name or address to connect to
+        :type host: str
+        :param port: TCP port number
+        :type port: int
+        :param timeout: Read timeout, in seconds
+        :type timeout: float
+        :param connectTimeout: Timeout for establishing the connection, in seconds
+
+        :raise serial.SerialException: if the connection could not be established
+        """
+        super(SocketTransport, self).__init__(timeout)
+        try:
+            self.socket = socket.create_connection((host, port), connectTimeout)
+        except socket.error as e:
+            raise serial.SerialException('Could not connect to {0}:{1}: {2}'.format(host, port, e))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def _recv(self):
+        try:
+            data = self.socket.recv(READ_CHUNK_SIZE)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return b''
+            raise serial.SerialException('Socket error: {0}'.format(e))
+        if not data:
+            raise serial.SerialException('Connection closed by remote end')
+        return data
+
+    def _send(self, data):
+        try:
+            return self.socket.send(data)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise serial.SerialException('Socket error: {0}'.format(e))
+
+    def close(self):
+        super(SocketTransport, self).close()
+        self.socket.close()
+
+
+class FdTransport(BufferedTransport):
+    """ Transport for an already-open file descriptor ("fd://<number>"), e.g. a pseudo-terminal """
+
+    def __init__(self, fd, timeout=None, closeFd=False):
+        """
+        :param fd: The file descriptor; it is switched to non-blocking mode
+        :type fd: int
+        :param timeout: Read timeout, in seconds
+        :type timeout: float
+        :param closeFd: Whether to close the file descriptor when the transport is closed
+        :type closeFd: bool
+        """
+        super(FdTransport, self).__init__(timeout)
+        self.fd = fd
+        self.closeFd = closeFd
+        if fcntl != None:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self.fd
+
+    def _recv(self):
+        try:
+            data = os.read(self.fd, READ_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return b''
+            raise serial.SerialException('Read error: {0}'.format(e))
+        if not data:
+            raise serial.SerialException('End of file reached')
+        return data
+
+    def _send(self, data):
+        try:
+            return os.write(self.fd, data)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise serial.SerialException('Write error: {0}'.format(e))
+
+    def close(self):
+        super(FdTransport, self).close()
+        if self.closeFd:
+            os.close(self.fd)
+
+
+def parseHostPort(address):
+    """ Parses a "<host>:<port>" address (the part of a socket:// URL after the scheme)
+
+    :raise ValueError: if the address is invalid
+
+    :return: tuple of (host, port)
+    """
+    address = address.split('?', 1)[0].rstrip('/')
+    host, sep, port = address.rpartition(':')
+    if not sep or not host or not port.isdigit():
+        raise ValueError('Invalid address (expected <host>:<port>): {0}'.format(address))
+    return host.strip('[]'), int(port)
+
+
+def readAvailable(transport):
+    """ Reads all data that is available from a transport (of any type), without blocking
+
+    :raise serial.SerialException: if the transport was closed or disconnected
+
+    :rtype: bytes
+    """
+    if isinstance(transport, BufferedTransport):
+        return transport.readAvailable()
+    waiting = transport.inWaiting()
+    return transport.read(waiting) if waiting > 0 else b''
@@ -6,6 +6,8 @@
 from datetime import datetime, timedelta, tzinfo
 import re
 
+from .grammar import compiled
+
 class SimpleOffsetTzInfo(tzinfo):    
     """ Very simple implementation of datetime.tzinfo offering set timezone offset for datetime instances """
     
@@ -44,6 +46,29 @@ def parseTextModeTimeStr(timeStr):
     tzOffsetHours = int(int(timeStr[-3:]) * 0.25)
     return datetime.strptime(msgTime, '%y/%m/%d,%H:%M:%S').replace(tzinfo=SimpleOffsetTzInfo(tzOffsetHours))
 
+# Used for splitting AT commands into command families (see commandFamily())
+AT_COMMAND_FAMILY_REGEX = re.compile(r'^AT([\+\^\$%#&\*][A-Za-z0-9]+|[A-Za-z]&?)(=\?|\?|=)?')
+
+def commandFamily(command):
+    """ Returns the "family" of the specified AT command: its name, combined with the
+    type of operation (set "=", read "?" or test "=?"), but without any parameters
+
+    Examples: "AT+CMGS=23" -> "+CMGS=", "AT+CPIN?" -> "+CPIN?", "ATD123;" -> "D", "AT" -> "AT"
+
+    :param command: The AT command (as written to the modem)
+    :type command: str
+
+    :return: the command family, or None if the specified data is not an AT command
+    :rtype: str or None
+    """
+    familyMatch = AT_COMMAND_FAMILY_REGEX.match(command)
+    if familyMatch:
+        return familyMatch.group(1).upper() + (familyMatch.group(2) or '')
+    elif command.rstrip().upper() == 'AT':
+        return 'AT'
+    else:
+        return None
+
 def lineStartingWith(string, lines):
     """ Searches through the specified list of strings and returns the 
     first line starting with the specified search string, or None if not found
@@ -66,7 +91,7 @@ def lineMatching(regexStr, lines):
     :return: the regular expression match for the first line that matches the specified regex, or None if no match was found
     :rtype: re.Match
     """
-    regex = re.compile(regexStr)
+    regex = compiled(regexStr)
     for line in lines:
         m = regex.match(line)
         if m:
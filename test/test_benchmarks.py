@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+""" Smoke test for the benchmark suite (benchmarks/) """
+
+import sys, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+import serial
+
+import gsmmodem.serial_comms
+
+
+@unittest.skipIf(sys.platform == 'win32', 'benchmarks use pseudo-terminals')
+class TestBenchmarks(unittest.TestCase):
+    """ Runs every benchmark with a small workload, in a single process """
+
+    def setUp(self):
+        # Other test suites replace the serial package; the benchmarks must work with the real one
+        self.serialPackage = gsmmodem.serial_comms.serial
+        gsmmodem.serial_comms.serial = serial
+
+    def tearDown(self):
+        gsmmodem.serial_comms.serial = self.serialPackage
+
+    def test_quickRun(self):
+        from benchmarks.run import BENCHMARKS, flatten
+        for name, run, fullArgs, quickArgs in BENCHMARKS:
+            results = run(**quickArgs)
+            self.assertIsInstance(results, dict, name)
+            self.assertTrue(len(flatten(results)) > 0, name)
+        # Benchmarks must not replace the serial package used by other modems in the process
+        self.assertIs(gsmmodem.serial_comms.serial, serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
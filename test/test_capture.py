@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.capture """
+
+import os, io, time, tempfile, threading, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.capture import CaptureWriter, readCapture, RecordingSerial, READ, WRITE
+from gsmmodem.serial_comms import SerialComms
+
+
+class TestCapture(unittest.TestCase):
+    """ Tests recording and replaying serial port sessions """
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.cap')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def writeCapture(self, records):
+        """ Writes a capture file containing the specified (direction, timestamp, data) records """
+        writer = CaptureWriter(self.path)
+        for direction, timestamp, data in records:
+            writer.record(direction, data, timestamp)
+        writer.close()
+
+    def test_writeRead(self):
+        """ Tests writing and reading a capture file """
+        captureFile = io.BytesIO()
+        writer = CaptureWriter(captureFile)
+        writer.record(WRITE, b'AT\r')
+        writer.record(READ, b'\r\nOK\r\n')
+        captureFile.seek(0)
+        records = readCapture(captureFile)
+        self.assertEqual([(direction, data) for direction, timestamp, data in records], [(WRITE, b'AT\r'), (READ, b'\r\nOK\r\n')])
+        self.assertTrue(0 <= records[0][1] <= records[1][1])
+        self.assertRaises(ValueError, readCapture, io.BytesIO(b'garbage'))
+
+    def test_recordingSerial(self):
+        """ Tests that RecordingSerial records reads and writes, and passes through everything else """
+        class FakeSerial(object):
+            def read(self, size=1):
+                return b'O'
+            def write(self, data):
+                return len(data)
+            def inWaiting(self):
+                return 5
+        captureFile = io.BytesIO()
+        serialPort = RecordingSerial(FakeSerial(), CaptureWriter(captureFile))
+        serialPort.write(b'AT\r')
+        self.assertEqual(serialPort.read(), b'O')
+        self.assertEqual(serialPort.inWaiting(), 5)
+        captureFile.seek(0)
+        self.assertEqual([(direction, data) for direction, timestamp, data in readCapture(captureFile)], [(WRITE, b'AT\r'), (READ, b'O')])
+
+    def test_replay(self):
+        """ Tests replaying a session into SerialComms, as fast as possible """
+        self.writeCapture([(READ, 0.1, b'\r\n+CMTI: "SM",1\r\n'),
+                           (WRITE, 0.2, b'AT\r'),
+                           (READ, 5.0, b'\r\nOK\r\n'),
+                           (WRITE, 5.1, b'AT+CSQ\r'),
+                           (READ, 5.2, b'\r\n+CSQ: 20,99\r\n\r\nOK\r\n')])
+        notifications = []
+        notified = threading.Event()
+        def notificationCallback(lines):
+            notifications.append(lines)
+            notified.set()
+        serialComms = SerialComms('replay://{0}?speed=0'.format(self.path), notifyCallbackFunc=notificationCallback)
+        serialComms.connect()
+        try:
+            notified.wait(1)
+            self.assertEqual(notifications, [['+CMTI: "SM",1']])
+            start = time.time()
+            self.assertEqual(serialComms.write('AT\r'), ['OK'])
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(serialComms.write('AT+CSQ\r'), ['+CSQ: 20,99', 'OK'])
+            self.assertEqual(serialComms.serial.mismatches, 0)
+            self.assertTrue(serialComms.serial.finished)
+        finally:
+            serialComms.close()
+
+    def test_replayTiming(self):
+        """ Tests that replays at the original speed keep the recorded response delays """
+        self.writeCapture([(WRITE, 0, b'AT\r'),
+                           (READ, 0.2, b'\r\nOK\r\n')])
+        serialComms = SerialComms('replay://{0}'.format(self.path))
+        serialComms.connect()
+        try:
+            start = time.time()
+            self.assertEqual(serialComms.write('AT\r'), ['OK'])
+            self.assertGreaterEqual(time.time() - start, 0.19)
+        finally:
+            serialComms.close()
+
+    def test_replayMismatch(self):
+        """ Tests that writes differing from the recording are counted """
+        self.writeCapture([(WRITE, 0, b'AT\r'),
+                           (READ, 0.1, b'\r\nOK\r\n')])
+        serialComms = SerialComms('replay://{0}?speed=0'.format(self.path))
+        serialComms.connect()
+        try:
+            self.assertEqual(serialComms.write('AZ\r'), ['OK'])
+            self.assertEqual(serialComms.serial.mismatches, 1)
+        finally:
+            serialComms.close()
+
+    def test_captureReplay(self):
+        """ Tests recording a (replayed) session with SerialComms.capture """
+        self.writeCapture([(WRITE, 0, b'AT\r'),
+                           (READ, 0.1, b'\r\nOK\r\n')])
+        captureFile = io.BytesIO()
+        serialComms = SerialComms('replay://{0}?speed=0'.format(self.path))
+        serialComms.capture = CaptureWriter(captureFile)
+        serialComms.connect()
+        try:
+            serialComms.write('AT\r')
+        finally:
+            serialComms.close()
+        captureFile.seek(0)
+        records = readCapture(captureFile)
+        self.assertEqual(records[0][::2], (WRITE, b'AT\r'))
+        self.assertEqual(b''.join(data for direction, timestamp, data in records[1:]), b'\r\nOK\r\n')
+        self.assertTrue(all(direction == READ for direction, timestamp, data in records[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
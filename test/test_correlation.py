@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.correlation """
+
+import gc, os, time, tempfile, unittest
+from datetime import datetime
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.correlation import CorrelationStore, normalizeNumber
+from gsmmodem.modem import SentSms
+from gsmmodem.util import SimpleOffsetTzInfo
+
+
+class FakeStatusReport(object):
+    """ Status report with just the attributes used for correlation """
+
+    def __init__(self, reference, number, timeSent=None, deliveryStatus=0):
+        self.reference = reference
+        self.number = number
+        self.timeSent = timeSent
+        self.deliveryStatus = deliveryStatus
+
+
+def smscTime(timestamp):
+    """ :return: The UNIX timestamp as a timezone-aware datetime (like the SMSC timestamps in status reports) """
+    return datetime.fromtimestamp(timestamp, SimpleOffsetTzInfo(2))
+
+
+class TestCorrelationStore(unittest.TestCase):
+    """ Tests matching status reports with sent messages """
+
+    def test_normalizeNumber(self):
+        self.assertEqual(normalizeNumber('+27821234567'), normalizeNumber('0821234567'))
+        self.assertNotEqual(normalizeNumber('0821234567'), normalizeNumber('0821234568'))
+        self.assertEqual(normalizeNumber('Operator'), 'Operator')
+        self.assertEqual(normalizeNumber(None), None)
+
+    def test_referenceWraparound(self):
+        """ Tests that reused references are resolved using the destination and send time """
+        store = CorrelationStore()
+        now = time.time()
+        first = SentSms('+27820000001', 'first', 5)
+        other = SentSms('+27820000002', 'other', 5)
+        second = SentSms('+27820000001', 'second', 5)
+        store.add(first, now - 600)
+        store.add(other, now - 300)
+        store.add(second, now)
+        self.assertEqual(len(store), 3)
+        self.assertIs(store.resolve(FakeStatusReport(5, '0820000001', smscTime(now + 2))), second)
+        self.assertIs(store.resolve(FakeStatusReport(5, '+27820000002', smscTime(now - 298))), other)
+        self.assertIs(store.resolve(FakeStatusReport(5, '+27820000001', smscTime(now + 2))), first)
+        self.assertEqual(store.resolve(FakeStatusReport(5, '+27820000001')), None)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.metrics['resolved'], 3)
+        self.assertEqual(store.metrics['unresolved'], 1)
+
+    def test_noTimestamp(self):
+        """ Tests that the oldest matching message is chosen if the report has no usable timestamp """
+        store = CorrelationStore()
+        first = SentSms('123', 'first', 7)
+        second = SentSms('123', 'second', 7)
+        store.add(first)
+        store.add(second)
+        self.assertIs(store.resolve(FakeStatusReport(7, '123', datetime.now())), first)
+        # Reports without a number are correlated by reference only
+        self.assertIs(store.resolve(FakeStatusReport(7, None)), second)
+
+    def test_mismatches(self):
+        """ Tests that reports are not attributed to messages sent to other numbers, or at other times """
+        store = CorrelationStore(maxTimeDifference=60)
+        now = time.time()
+        sms = SentSms('+27820000001', 'text', 3)
+        store.add(sms, now)
+        self.assertEqual(store.resolve(FakeStatusReport(3, '+27820000002', smscTime(now))), None)
+        self.assertEqual(store.resolve(FakeStatusReport(3, '+27820000001', smscTime(now + 3600))), None)
+        self.assertEqual(store.metrics['unresolved'], 2)
+        self.assertIs(store.resolve(FakeStatusReport(3, '+27820000001', smscTime(now + 30))), sms)
+
+    def test_weakReferences(self):
+        """ Tests that the store does not keep sent messages alive """
+        store = CorrelationStore()
+        store.add(SentSms('123', 'dropped', 4))
+        gc.collect()
+        self.assertTrue(4 in store)
+        self.assertRaises(KeyError, store.__getitem__, 4)
+        # The report is still matched with the message (and not with another one)
+        other = SentSms('456', 'other', 4)
+        store.add(other)
+        self.assertEqual(store.resolve(FakeStatusReport(4, '123')), None)
+        self.assertEqual(store.metrics['resolved'], 1)
+        self.assertIs(store[4], other)
+
+    def test_temporaryStatus(self):
+        """ Tests that messages stay tracked while the SMSC is still trying to deliver them """
+        store = CorrelationStore()
+        sms = SentSms('123', 'text', 1)
+        store.add(sms)
+        self.assertIs(store.resolve(FakeStatusReport(1, '123', deliveryStatus=0x30)), sms)
+        self.assertTrue(1 in store)
+        self.assertIs(store[1], sms)
+        self.assertIs(store.resolve(FakeStatusReport(1, '123', deliveryStatus=0)), sms)
+        self.assertFalse(1 in store)
+        self.assertRaises(KeyError, store.__getitem__, 1)
+
+    def test_eviction(self):
+        """ Tests the size bound and time-to-live """
+        store = CorrelationStore(maxSize=2, ttl=60)
+        now = time.time()
+        store.add(SentSms('1', 'expired', 1), now - 120)
+        store.add(SentSms('2', 'a', 2), now)
+        self.assertEqual(len(store), 1)
+        store.add(SentSms('3', 'b', 3), now)
+        store.add(SentSms('4', 'c', 4), now)
+        self.assertEqual(len(store), 2)
+        self.assertFalse(2 in store)
+        self.assertEqual(store.metrics['expired'], 1)
+        self.assertEqual(store.metrics['evicted'], 1)
+
+    def test_persistence(self):
+        """ Tests that tracked messages are restored from the database """
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            store = CorrelationStore(path=path, batchSize=2, commitInterval=3600)
+            store.add(SentSms('+27820000001', 'persisted', 10))
+            # Changes are written in batches
+            self.assertEqual(len(store._dbPending), 1)
+            store.add(SentSms('+27820000002', 'resolved', 11))
+            self.assertEqual(len(store._dbPending), 0)
+            store.resolve(FakeStatusReport(11, '+27820000002'))
+            self.assertEqual(len(store._dbPending), 1)
+            store.close()
+            store = CorrelationStore(path=path)
+            self.assertEqual(len(store), 1)
+            sms = store.resolve(FakeStatusReport(10, '0820000001'))
+            self.assertEqual((sms.number, sms.text, sms.reference), ('+27820000001', 'persisted', 10))
+            store.close()
+            store = CorrelationStore(path=path)
+            self.assertEqual(len(store), 0)
+            store.close()
+        finally:
+            os.remove(path)
+
+    def test_commitInterval(self):
+        """ Tests that pending changes are committed once the commit interval has passed, regardless of the send time """
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            store = CorrelationStore(path=path, batchSize=100, commitInterval=3600)
+            # A send time far in the past must not be mistaken for the current time
+            store.add(SentSms('+27820000001', 'a', 1), time.time() - 7200)
+            self.assertEqual(len(store._dbPending), 1)
+            store._lastCommit = time.time() - 3600
+            store.add(SentSms('+27820000002', 'b', 2), time.time() - 7200)
+            self.assertEqual(len(store._dbPending), 0)
+            # Nothing is written while the store is idle, until flush() is called
+            store._lastCommit = time.time()
+            store.add(SentSms('+27820000003', 'c', 3))
+            self.assertEqual(len(store._dbPending), 1)
+            store.flush()
+            self.assertEqual(len(store._dbPending), 0)
+            store.close()
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.grammar """
+
+import re, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem import grammar
+
+
+class TestGrammar(unittest.TestCase):
+    """ Tests the precompiled response grammar registry """
+
+    def test_registry(self):
+        self.assertIs(grammar.get('CMGL_TEXT'), grammar.CMGL_TEXT)
+        self.assertRaises(KeyError, grammar.get, 'NONEXISTENT')
+        self.assertRaises(ValueError, grammar.register, 'CMGL_TEXT', '^x$')
+        # Every registered pattern must only match lines starting with its prefix
+        for name, g in grammar.GRAMMARS.items():
+            self.assertEqual(g.name, name)
+            self.assertTrue(g.pattern.pattern.startswith('^'), name)
+
+    def test_match(self):
+        lines = ['+CGDCONT: 1,"IP","internet","0.0.0.0",0,0', 'ignored', '+CGDCONT: 2,"IP","apn2","0.0.0.0",0,0', 'OK']
+        self.assertEqual(grammar.CGDCONT.match(lines[1]), None)
+        self.assertEqual(grammar.CGDCONT.match(lines[0]).group(3), 'internet')
+        self.assertEqual(grammar.CGDCONT.matchLines(lines).group(1), '1')
+        self.assertEqual([m.group(3) for m in grammar.CGDCONT.allMatches(lines)], ['internet', 'apn2'])
+        self.assertEqual(grammar.CGDCONT.matchLines(['OK']), None)
+        m = grammar.CMGL_TEXT.match('+CMGL: 1,"REC READ","+27820001234",,"13/04/24,13:28:07+08"')
+        self.assertEqual(m.groups(), ('1', 'REC READ', '+27820001234', '13/04/24,13:28:07+08'))
+        self.assertEqual(grammar.CMGL_PDU.match('+CMGL:3,1,,31').group(1), '3')
+
+    def test_terminatorSet(self):
+        terminators = grammar.TerminatorSet()
+        for line in ('OK', 'ERROR', '+CME ERROR: 10', '+CMS ERROR: 500', 'COMMAND NOT SUPPORT', '+CME ERROR: SIM not inserted'):
+            self.assertTrue(terminators.match(line), line)
+            self.assertTrue(line in terminators, line)
+        for line in ('', 'O', 'OKAY', '+CMGL: 1,"REC READ"', 'Hello', ' OK', 'ERRORS', 'NO CARRIER', 'BUSY', '+CMTI: "SM",1'):
+            self.assertFalse(terminators.match(line), line)
+        # Vendor/profile-specific terminators
+        dialup = grammar.TERMINATOR_PROFILES['dialup']
+        for line in ('OK', '+CMS ERROR: 500', 'NO CARRIER', 'BUSY', 'NO ANSWER', 'NO DIALTONE'):
+            self.assertTrue(dialup.match(line), line)
+        self.assertFalse(dialup.match('NO'))
+        extended = terminators.extend(['SEND OK'], ['^ERROR:'])
+        self.assertTrue(extended.match('SEND OK'))
+        self.assertTrue(extended.match('^ERROR: 3'))
+        self.assertTrue(extended.match('OK'))
+        self.assertFalse(terminators.match('SEND OK'))
+
+    def test_notifications(self):
+        for line in ('+CMTI: "SM",1', '+CDSI: "SR",3', '+CMT: ,24', '+CDS: 24', '+CRING: VOICE', '+CLIP: "+27820001234",145,,,,0'):
+            self.assertTrue(grammar.isNotification(line), line)
+        for line in ('', 'OK', 'RING', '+CLIP: 1,1', '+CMGR: 0,,29', '+CUSD: 0,"Balance",15', 'Hello'):
+            self.assertFalse(grammar.isNotification(line), line)
+        self.assertTrue(grammar.URC_CMTI in grammar.NOTIFICATIONS)
+        self.assertRaises(ValueError, grammar.registerNotification, 'URC_CMTI', r'^\+CMTI:', '+CMTI:')
+        self.assertRaises(ValueError, grammar.registerNotification, 'URC_TEST', r'^x$', '')
+
+    def test_compiled(self):
+        pattern = grammar.compiled(r'^\d+$')
+        self.assertIs(grammar.compiled(r'^\d+$'), pattern)
+        self.assertIsNot(grammar.compiled(r'^\d+$', re.I), pattern)
+        # The cache is bounded
+        for i in range(grammar._COMPILED_CACHE_SIZE + 10):
+            grammar.compiled(r'^{0}$'.format(i))
+        self.assertTrue(len(grammar._compiledCache) <= grammar._COMPILED_CACHE_SIZE)
+        self.assertTrue(pattern.match('123'))
+
+
+if __name__ == "__main__":
+    unittest.main()
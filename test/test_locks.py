@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.locks """
+
+import threading, time, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.locks import ProfiledRLock
+
+class TestProfiledRLock(unittest.TestCase):
+    """ Tests recording lock contention statistics """
+
+    def test_reentrant(self):
+        lock = ProfiledRLock('test')
+        with lock:
+            with lock:
+                pass
+        stats = lock.stats()
+        self.assertEqual(stats['acquisitions'], 1)
+        self.assertEqual(stats['contended'], 0)
+        self.assertEqual(len(stats['holders']), 1)
+        site = list(stats['holders'].keys())[0]
+        self.assertIn('test_locks.py', site)
+        self.assertIn('test_reentrant', site)
+
+    def test_contention(self):
+        lock = ProfiledRLock('test')
+        holding = threading.Event()
+        def holder():
+            with lock:
+                holding.set()
+                time.sleep(0.1)
+        thread = threading.Thread(target=holder)
+        thread.start()
+        holding.wait()
+        with lock:
+            pass
+        thread.join()
+        stats = lock.stats()
+        self.assertEqual(stats['acquisitions'], 2)
+        self.assertEqual(stats['contended'], 1)
+        self.assertEqual(stats['maxWaiting'], 1)
+        self.assertEqual(stats['waiting'], 0)
+        self.assertGreater(stats['maxWait'], 0.05)
+        self.assertEqual(sum(stats['waitHistogram'].values()), 1)
+        holdTimes = sorted(holder['maxHold'] for holder in stats['holders'].values())
+        self.assertGreater(holdTimes[-1], 0.05)
+        self.assertIn('2 acquisitions, 1 contended', lock.dump())
+        lock.reset()
+        self.assertEqual(lock.stats()['acquisitions'], 0)
+
+    def test_nonBlocking(self):
+        lock = ProfiledRLock()
+        acquired = []
+        with lock:
+            thread = threading.Thread(target=lambda: acquired.append(lock.acquire(False)))
+            thread.start()
+            thread.join()
+        self.assertEqual(acquired, [False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.metrics """
+
+import unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.metrics import MetricsRegistry, notificationType
+
+class TestMetricsRegistry(unittest.TestCase):
+    """ Tests recording and exposing metrics """
+
+    def test_counter(self):
+        registry = MetricsRegistry()
+        registry.commands.inc(('/dev/ttyUSB0', '+CMGS='))
+        registry.commands.inc(('/dev/ttyUSB0', '+CMGS='))
+        registry.commands.inc(('/dev/ttyUSB1', 'Z'))
+        self.assertEqual(sorted(registry.commands.samples()), [(('/dev/ttyUSB0', '+CMGS='), 2), (('/dev/ttyUSB1', 'Z'), 1)])
+        exposition = registry.exposition()
+        self.assertIn('# TYPE gsmmodem_commands_total counter', exposition)
+        self.assertIn('gsmmodem_commands_total{port="/dev/ttyUSB0",command="+CMGS="} 2', exposition)
+
+    def test_histogram(self):
+        registry = MetricsRegistry(namespace='test')
+        histogram = registry.histogram('latency_seconds', 'Test latency', ('command',), buckets=(0.1, 1))
+        histogram.observe(('AT',), 0.05)
+        histogram.observe(('AT',), 0.5)
+        histogram.observe(('AT',), 5)
+        lines = registry.exposition().splitlines()
+        self.assertIn('test_latency_seconds_bucket{command="AT",le="0.1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{command="AT",le="1"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{command="AT",le="+Inf"} 3', lines)
+        self.assertIn('test_latency_seconds_sum{command="AT"} 5.55', lines)
+        self.assertIn('test_latency_seconds_count{command="AT"} 3', lines)
+
+    def test_labelEscaping(self):
+        registry = MetricsRegistry()
+        registry.bytesRead.inc(('C:\\COM"1"',), 10)
+        self.assertIn('gsmmodem_serial_read_bytes_total{port="C:\\\\COM\\"1\\""} 10', registry.exposition())
+
+    def test_listeners(self):
+        registry = MetricsRegistry()
+        updates = []
+        listener = lambda metric, labels, value: updates.append((metric.name, labels, value))
+        registry.addListener(listener)
+        registry.sms.inc(('port', 'sent'))
+        registry.commandLatency.observe(('port', 'Z'), 0.2)
+        self.assertEqual(updates, [('gsmmodem_sms_total', ('port', 'sent'), 1), ('gsmmodem_command_latency_seconds', ('port', 'Z'), 0.2)])
+        registry.removeListener(listener)
+        registry.sms.inc(('port', 'sent'))
+        self.assertEqual(len(updates), 2)
+
+    def test_notificationType(self):
+        tests = (('+CMTI: "SM",1', '+CMTI'), ('RING', 'RING'), ('^ORIG:1,0', '^ORIG'), ('NO CARRIER', 'NO CARRIER'),
+                 ('some random text: 123', 'other'), ('0791...', 'other'))
+        for line, notifType in tests:
+            self.assertEqual(notificationType(line), notifType)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,13 +5,13 @@
 
 from __future__ import print_function
 
-import sys, time, unittest, logging, codecs
+import sys, time, threading, unittest, logging, codecs
 from datetime import datetime
 from copy import copy
 
 from . import compat # For Python 2.6 compatibility
 from gsmmodem.exceptions import PinRequiredError, CommandError, InvalidStateException, TimeoutException,\
-    CmsError, CmeError, EncodingError
+    CmsError, CmeError, EncodingError, InterruptedException
 from gsmmodem.modem import StatusReport, Sms, ReceivedSms
 
 PYTHON_VERSION = sys.version_info[0]
@@ -19,6 +19,12 @@ PYTHON_VERSION = sys.version_info[0]
 import gsmmodem.serial_comms
 import gsmmodem.modem
 import gsmmodem.pdu
+import gsmmodem.retry
+import gsmmodem.metrics
+import gsmmodem.ratelimit
+import gsmmodem.scheduler
+import gsmmodem.storage
+import gsmmodem.tracing
 from gsmmodem.util import SimpleOffsetTzInfo
 
 from . import fakemodems
@@ -394,6 +400,58 @@ class TestGsmModemGeneralApi(unittest.TestCase):
             self.modem.serial.responseSequence = ['{0}\r\n'.format(toWrite), 'OK\r\n']
             self.assertEqual(name, self.modem.smsSupportedEncoding)
 
+    def test_busyErrorRetry(self):
+        """ Tests retrying of commands that fail with transient "device/SIM busy" errors """
+        self.modem.retryPolicy = gsmmodem.retry.RetryPolicy(maxAttempts=3, baseDelay=0.01)
+        # Two busy errors: the third attempt should succeed
+        self.modem.serial.modem.deviceBusyErrorCounter = 2
+        self.assertEqual(['OK'], self.modem.write('AT'))
+        self.assertEqual(self.modem.retryPolicy.retries, 2)
+        self.assertGreater(self.modem.retryPolicy.pace, 0)
+        # Three busy errors: all attempts are used up
+        self.modem.serial.modem.deviceBusyErrorCounter = 3
+        try:
+            self.modem.write('AT')
+        except CmeError as e:
+            self.assertEqual(e.code, 515)
+        else:
+            self.fail('CmeError not raised after retries were exhausted')
+        self.assertEqual(self.modem.retryPolicy.exhausted, 1)
+        # Pacing stops once the modem has recovered
+        self.modem.serial.modem.deviceBusyErrorCounter = 0
+        for i in range(self.modem.retryPolicy.recoveryCount):
+            self.modem.write('AT')
+        self.assertEqual(self.modem.retryPolicy.pace, 0)
+
+    def test_metrics(self):
+        """ Tests that commands, errors and serial traffic are recorded if metrics are enabled """
+        registry = gsmmodem.metrics.MetricsRegistry()
+        self.modem.metrics = registry
+        self.modem.write('AT+CGMI')
+        self.modem.serial.responseSequence = ['+CMS ERROR: 310\r\n']
+        self.assertRaises(CmsError, self.modem.write, 'AT+CMGR=1', priority=gsmmodem.scheduler.PRIORITY_BULK)
+        port = self.modem.port
+        self.assertIn(((port, '+CGMI'), 1), registry.commands.samples())
+        self.assertIn(((port, 'CMS', '310'), 1), registry.errors.samples())
+        self.assertEqual(registry.bytesWritten.samples(), [((port,), len('AT+CGMI\r') + len('AT+CMGR=1\r'))])
+        self.assertEqual(registry.commandLatency.samples()[0][1][2], 1)
+        self.assertEqual(sorted((labels, count) for labels, (buckets, total, count) in registry.commandWait.samples()), [((port, 'bulk'), 1), ((port, 'normal'), 1)])
+        self.modem.metrics = None
+
+    def test_tracing(self):
+        """ Tests that command errors are reported to the tracer """
+        errors = []
+        class TestTracer(gsmmodem.tracing.Tracer):
+            def onError(self, trace, error):
+                errors.append((trace.command, error))
+        self.modem.tracer = TestTracer()
+        self.modem.serial.responseSequence = ['+CME ERROR: 22\r\n']
+        self.assertRaises(CmeError, self.modem.write, 'AT+ZZZ')
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 'AT+ZZZ')
+        self.assertIsInstance(errors[0][1], CmeError)
+        self.modem.tracer = None
+
 
 class TestUssd(unittest.TestCase):
     """ Tests USSD session handling """
@@ -1665,6 +1723,109 @@ class TestSms(unittest.TestCase):
                     time.sleep(0.1)
         self.modem.close()
 
+    def test_receiveSmsDirect(self):
+        """ Tests receiving SMS messages routed directly to the TE (+CMT notifications) """
+        received = []
+        def smsReceivedCallbackFunc(sms):
+            received.append(sms)
+        self.initModem(smsReceivedCallbackFunc=smsReceivedCallbackFunc)
+        # Acknowledgements are only required when using the phase 2+ SMS service
+        self.assertFalse(self.modem._smsAckRequired)
+        def writeCallbackFunc(data):
+            self.assertEqual('AT+CSMS?\r', data)
+            self.modem.serial.responseSequence = ['+CSMS: 1,1,1,1\r\n', 'OK\r\n']
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.modem._setupSmsAcknowledgement('2,2,0,1,0')
+        self.assertTrue(self.modem._smsAckRequired)
+        # Messages stored by the modem (+CMTI) do not require acknowledgements
+        def writeCallbackFunc2(data):
+            self.fail('Unexpected data written to modem: {0}'.format(data))
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc2
+        self.modem._setupSmsAcknowledgement('2,1,0,0,0')
+        self.assertFalse(self.modem._smsAckRequired)
+        self.modem._smsAckRequired = True
+        written = []
+        self.modem.serial.writeCallbackFunc = written.append
+        # PDU mode: the message is decoded from the PDU; it is not read from (or deleted from) storage
+        self.modem.smsTextMode = False
+        del written[:]
+        number, message, index, smsTime, smsc, pdu, tpdu_length, ref, mem = self.tests[0]
+        self.modem.serial.responseSequence = ['+CMT: ,{0}\r\n'.format(tpdu_length), '{0}\r\n'.format(pdu)]
+        deadline = time.time() + 2
+        while len(received) == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(received), 1)
+        sms = received[0]
+        self.assertIsInstance(sms, gsmmodem.modem.ReceivedSms)
+        self.assertEqual(sms.number, number)
+        self.assertEqual(sms.text, message)
+        self.assertEqual(sms.time, smsTime)
+        self.assertEqual(sms.smsc, smsc)
+        self.assertEqual(sms.status, gsmmodem.modem.Sms.STATUS_RECEIVED_UNREAD)
+        self.assertEqual(written, ['AT+CNMA\r'])
+        # The header and the PDU may be read separately, with a delay in between
+        del written[:]
+        self.modem.serial.responseSequence = ['+CMT: ,{0}\r\n'.format(tpdu_length), 0.2, '{0}\r\n'.format(pdu)]
+        deadline = time.time() + 2
+        while len(received) == 1 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(received), 2)
+        self.assertEqual(received[1].text, message)
+        self.assertEqual(written, ['AT+CNMA\r'])
+        del received[1:]
+        # Invalid PDUs are rejected
+        del written[:]
+        self.modem.serial.responseSequence = ['+CMT: ,5\r\n', 'ZZZZ\r\n']
+        deadline = time.time() + 2
+        while len(written) == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(written, ['AT+CNMA=2\r'])
+        self.assertEqual(len(received), 1)
+        # Text mode
+        self.modem.smsTextMode = True
+        del written[:]
+        self.modem.serial.responseSequence = ['+CMT: "+0123456789",,"13/03/08,15:02:16+08"\r\n', 'Hello world!\r\n']
+        deadline = time.time() + 2
+        while len(received) == 1 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(received), 2)
+        sms = received[1]
+        self.assertEqual(sms.number, '+0123456789')
+        self.assertEqual(sms.text, 'Hello world!')
+        self.assertEqual(sms.time, datetime(2013, 3, 8, 15, 2, 16, tzinfo=SimpleOffsetTzInfo(2)))
+        self.assertEqual(written, ['AT+CNMA\r'])
+        # Text spanning several lines is collected using the length in the header (AT+CSDH=1)
+        self.modem.serial.responseSequence = ['+CMT: "+0123456789",,"13/03/08,15:02:16+08",145,4,0,0,"+27829999999",145,12\r\n', 'Hello\r\n', 'world!\r\n']
+        deadline = time.time() + 2
+        while len(received) == 2 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(received), 3)
+        self.assertEqual(received[2].number, '+0123456789')
+        self.assertEqual(received[2].text, 'Hello\nworld!')
+        self.modem.close()
+
+    def test_sendSms_commandFamilies(self):
+        """ Tests that the SMS data written after the prompt is attributed to the prompting command's family """
+        self.initModem(None)
+        def writeCallbackFunc(data):
+            if data.startswith(('AT+CMGS', 'AT+CMGW')):
+                self.modem.serial.flushResponseSequence = False
+                self.modem.serial.responseSequence = ['> \r\n', '{0}: 1\r\n'.format(data[2:7]), 'OK\r\n']
+            else:
+                self.modem.serial.flushResponseSequence = True
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.modem.smsTextMode = True
+        self.modem.sendSms('+27820000000', 'Test message')
+        self.modem.smsTextMode = False
+        self.modem.sendSms('+27820000000', 'Test message')
+        self.modem._writeStoredSms('+27820000000', 'Test message')
+        families = self.modem.timeoutProfile.stats
+        self.assertEqual(families['+CMGS=']['samples'], 2)
+        self.assertEqual(families['+CMGS=<data>']['samples'], 2)
+        self.assertEqual(families['+CMGW=<data>']['samples'], 1)
+        self.assertFalse('<data>' in families)
+        self.modem.close()
+
     def test_sendSms_refCount(self):
         """ Test the SMS reference counter operation when sending SMSs """
         self.initModem(None)
@@ -1717,6 +1878,8 @@ class TestSms(unittest.TestCase):
         self.modem.serial.writeCallbackFunc = writeCallbackFunc
         # Prepare send SMS response as well as "delivered" notification
         self.modem._smsRef = 183
+        # The status report was recorded from a modem; its SMSC timestamp is not close to the current time
+        self.modem.sentSms.maxTimeDifference = None
         sms = self.modem.sendSms('0829200000', 'Test message', waitForDeliveryReport=True)
         self.assertIsInstance(sms, gsmmodem.modem.SentSms)
         self.assertNotEqual(sms.report, None, 'Sent SMS\'s "report" attribute should not be None')
@@ -1729,6 +1892,164 @@ class TestSms(unittest.TestCase):
         self.assertRaises(gsmmodem.exceptions.TimeoutException, self.modem.sendSms, **{'destination': '0829200000', 'text': 'Test message', 'waitForDeliveryReport': True, 'deliveryTimeout': 0.05})
         self.modem.close()
     
+    def test_sendSms_concurrentDeliveryReports(self):
+        """ Tests that several threads can wait for the status reports of their own messages at the same time """
+        callbackReports = []
+        self.initModem(None)
+        self.modem.smsStatusReportCallback = callbackReports.append
+        sentTime = datetime.fromtimestamp(time.time(), SimpleOffsetTzInfo(2))
+        messages = [gsmmodem.modem.SentSms('+27820000001', 'first', 10), gsmmodem.modem.SentSms('+27820000002', 'second', 11)]
+        delivered = {}
+        def waitForReport(sms):
+            if sms.waitForReport(5):
+                delivered[sms.reference] = sms.report
+        threads = []
+        for sms in messages:
+            sms._reportAwaited = True
+            self.modem.sentSms.add(sms)
+            thread = threading.Thread(target=waitForReport, args=(sms,))
+            thread.start()
+            threads.append(thread)
+        reports = [gsmmodem.modem.StatusReport(self.modem, 0, sms.reference, sms.number, sentTime, sentTime, gsmmodem.modem.StatusReport.DELIVERED) for sms in messages]
+        # A temporary error report does not wake up the waiting thread
+        self.modem._dispatchStatusReport(gsmmodem.modem.StatusReport(self.modem, 0, 11, '+27820000002', sentTime, sentTime, 0x30))
+        self.modem._dispatchStatusReport(reports[1])
+        threads[1].join(5)
+        self.assertEqual(delivered, {11: reports[1]})
+        self.modem._dispatchStatusReport(reports[0])
+        threads[0].join(5)
+        self.assertEqual(delivered, {10: reports[0], 11: reports[1]})
+        self.assertEqual(callbackReports, [])
+        # Reports for messages nobody is waiting for still go to the callback
+        self.modem.sentSms.add(gsmmodem.modem.SentSms('+27820000003', 'third', 12))
+        report = gsmmodem.modem.StatusReport(self.modem, 0, 12, '+27820000003', sentTime, sentTime, gsmmodem.modem.StatusReport.DELIVERED)
+        self.modem._dispatchStatusReport(report)
+        self.assertEqual(callbackReports, [report])
+        # Errors raised by the callback are logged, not raised
+        def failingCallback(report):
+            callbackReports.append(report)
+            raise ValueError('callback failed')
+        self.modem.smsStatusReportCallback = failingCallback
+        self.modem.sentSms.add(gsmmodem.modem.SentSms('+27820000004', 'fourth', 13))
+        report = gsmmodem.modem.StatusReport(self.modem, 0, 13, '+27820000004', sentTime, sentTime, gsmmodem.modem.StatusReport.DELIVERED)
+        self.modem._dispatchStatusReport(report)
+        self.assertEqual(callbackReports[-1], report)
+        self.modem.close()
+
+    def test_sendSmsParts(self):
+        """ Tests sending a multipart SMS part by part, keeping the SMS relay link open, and retrying a failed part """
+        self.initModem(None)
+        self.modem.smsTextMode = False
+        self.modem._commands = ['+CMGS', '+CMMS']
+        written = []
+        responses = [['> \r\n', '+CMGS: 20\r\n', 'OK\r\n'], ['> \r\n', '+CMS ERROR: 500\r\n'], ['> \r\n', '+CMGS: 22\r\n', 'OK\r\n']]
+        def writeCallbackFunc(data):
+            written.append(data)
+            if data.startswith('AT+CMGS'):
+                self.modem.serial.flushResponseSequence = False
+                self.modem.serial.responseSequence = responses.pop(0)
+            else:
+                self.modem.serial.flushResponseSequence = True
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        text = 'x' * 200
+        parts = self.modem.sendSmsParts('+27820000000', text)
+        self.assertEqual(len(parts), 2)
+        self.assertEqual([command for command in written if command.startswith('AT+CM')][:2], ['AT+CMMS=2\r', 'AT+CMGS={0}\r'.format(parts[0].pdu.tpduLength)])
+        self.assertTrue(parts[0].sent)
+        self.assertEqual(parts[0].reference, 20)
+        self.assertEqual(parts[0].sms.reference, 20)
+        self.assertTrue(20 in self.modem.sentSms)
+        self.assertFalse(parts[1].sent)
+        self.assertIsInstance(parts[1].error, CmsError)
+        self.assertTrue(all(part.duration >= 0 for part in parts))
+        # Retry the failed part only
+        del written[:]
+        retried = self.modem.sendSmsParts('+27820000000', text, pdus=[part.pdu for part in parts if not part.sent])
+        self.assertEqual(len(retried), 1)
+        self.assertEqual(retried[0].reference, 22)
+        self.assertEqual(written[-1], '{0}{1}'.format(parts[1].pdu, chr(26)))
+        self.assertFalse('AT+CMMS=2\r' in written)
+        # sendSms() raises the error of the failed part
+        responses.extend([['> \r\n', '+CMGS: 23\r\n', 'OK\r\n'], ['> \r\n', '+CMS ERROR: 500\r\n']])
+        self.assertRaises(CmsError, self.modem.sendSms, '+27820000000', text)
+        # Text mode is restored after sending the parts
+        self.modem.smsTextMode = True
+        del written[:]
+        responses.append(['> \r\n', '+CMGS: 24\r\n', 'OK\r\n'])
+        retried = self.modem.sendSmsParts('+27820000000', text, pdus=[parts[1].pdu])
+        self.assertTrue(retried[0].sent)
+        self.assertTrue(self.modem.smsTextMode)
+        self.assertEqual(written[0], 'AT+CMGF=0\r')
+        self.assertEqual(written[-1], 'AT+CMGF=1\r')
+        # A timeout while asking to keep the link open does not stop the message from being sent
+        self.modem._cmmsSupported = None
+        def write(data, *args, **kwargs):
+            raise TimeoutException()
+        self.modem.write = write
+        self.assertFalse(self.modem._keepSmsLinkOpen())
+        self.assertEqual(self.modem._cmmsSupported, None)
+        del self.modem.write
+        self.modem.close()
+
+    def test_broadcastSms(self):
+        """ Tests broadcasting an SMS message from storage (AT+CMGW/AT+CMSS), and the fallback to sendSms() """
+        self.initModem(None)
+        self.modem.smsTextMode = True
+        self.modem._commands = ['+CMGS', '+CMGW', '+CMSS']
+        written = []
+        responses = {'AT+CMGW': [['> \r\n', '+CMGW: 4\r\n', 'OK\r\n']],
+                     'AT+CMSS': [['+CMSS: 30\r\n', 'OK\r\n'], ['+CMS ERROR: 500\r\n'], ['+CMSS: 31\r\n', 'OK\r\n']],
+                     'AT+CMGS': [['> \r\n', '+CMGS: 32\r\n', 'OK\r\n']]}
+        def writeCallbackFunc(data):
+            written.append(data)
+            if data[:7] in responses:
+                self.modem.serial.flushResponseSequence = data.startswith('AT+CMSS')
+                self.modem.serial.responseSequence = responses[data[:7]].pop(0)
+            else:
+                self.modem.serial.flushResponseSequence = True
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        results = self.modem.broadcastSms(['+27820000001', '0820000002', '+27820000003'], 'Alert')
+        self.assertEqual(len(results), 3)
+        self.assertEqual(written[:3], ['AT+CMGW="+27820000001"\r', 'Alert{0}'.format(chr(26)), 'AT+CMSS=4,"+27820000001",145\r'])
+        self.assertTrue('AT+CMSS=4,"0820000002",129\r' in written)
+        self.assertIsInstance(results[0], gsmmodem.modem.SentSms)
+        self.assertEqual((results[0].number, results[0].text, results[0].reference), ('+27820000001', 'Alert', 30))
+        self.assertIsInstance(results[1], CmsError)
+        self.assertEqual(results[2].reference, 31)
+        self.assertTrue(30 in self.modem.sentSms and 31 in self.modem.sentSms)
+        # The stored message is deleted afterwards
+        self.assertEqual(written[-1], 'AT+CMGD=4,0\r')
+        # Modems without AT+CMSS support: sendSms() is used instead
+        del written[:]
+        self.modem._commands = ['+CMGS']
+        results = self.modem.broadcastSms(['+27820000004'], 'Alert')
+        self.assertEqual(results[0].reference, 32)
+        self.assertFalse(any(command.startswith(('AT+CMGW', 'AT+CMSS', 'AT+CMGD')) for command in written))
+        self.modem.close()
+
+    def test_sendSms_rateLimit(self):
+        """ Tests that sending SMS messages waits for the send rate limiter """
+        self.initModem(None)
+        self.modem.rateLimiter = gsmmodem.ratelimit.SendRateLimiter(perMinute=600)
+        self.modem.metrics = gsmmodem.metrics.MetricsRegistry()
+        def writeCallbackFunc(data):
+            if data.startswith('AT+CMGS'):
+                self.modem.serial.flushResponseSequence = False
+                self.modem.serial.responseSequence = ['> \r\n', '+CMGS: 0\r\n', 'OK\r\n']
+            else:
+                self.modem.serial.flushResponseSequence = True
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        start = time.time()
+        for i in range(3):
+            self.modem.sendSms('+27820000000', 'Message {0}'.format(i))
+        self.assertGreater(time.time() - start, 0.15)
+        self.assertEqual(self.modem.rateLimiter.stats()['delayed'], 2)
+        buckets, total, count = self.modem.metrics.rateLimitWait.samples()[0][1]
+        self.assertEqual(count, 3)
+        self.assertGreater(total, 0.15)
+        self.modem.metrics = None
+        self.modem.close()
+
     def test_sendSms_reply(self):
         """ Test the reply() method of the ReceivedSms class """
         self.initModem(None)
@@ -1868,6 +2189,26 @@ class TestStoredSms(unittest.TestCase):
         self.assertIsInstance(messages, list)
         self.assertEqual(len(messages), 3, 'Invalid number of messages returned; expected 3, got {0}'.format(len(messages)))
 
+    def test_iterStoredSms(self):
+        """ Tests iterating over SMSs stored on the SIM card while the response is being received """
+        self.initFakeModemResponses(textMode=False)
+        self.initModem(False, None)
+        written = []
+        self.modem.serial.writeCallbackFunc = written.append
+        messages = self.modem.iterStoredSms(status=Sms.STATUS_RECEIVED_READ, delete=True)
+        self.assertFalse(isinstance(messages, list))
+        first = next(messages)
+        self.assertEqual(first.number, self.expectedMessages[1].number)
+        self.assertEqual(written, ['AT+CMGL=1\r'])
+        # Messages are only deleted once all of them have been read
+        messages = [first] + list(messages)
+        self.assertEqual([message.text for message in messages], [message.text for message in self.expectedMessages[1:]])
+        self.assertEqual(written, ['AT+CMGL=1\r', 'AT+CMGD=1,0\r', 'AT+CMGD=2,0\r'])
+        # Errors are raised by the iterator
+        self.modem.serial.modem.responses['AT+CMGL=4\r'] = ['+CMS ERROR: 321\r\n']
+        self.assertRaises(CmsError, list, self.modem.iterStoredSms())
+        self.modem.close()
+
     def test_listStoredSms_text(self):
         """ Tests listing/reading SMSs that are currently stored on the SIM card (text mode) """
         self.initFakeModemResponses(textMode=True)
@@ -2023,6 +2364,143 @@ class TestStoredSms(unittest.TestCase):
         for delFlag in tests:
             self.assertRaises(ValueError, self.modem.deleteMultipleStoredSms, **{'delFlag': delFlag})
     
+    def test_storageManager(self):
+        """ Tests reconciling stored messages when connecting, and draining storage at the high-water mark """
+        global SERIAL_WRITE_CALLBACK_FUNC
+        received = []
+        written = []
+        SERIAL_WRITE_CALLBACK_FUNC = written.append
+        mockSerial = MockSerialPackage()
+        gsmmodem.serial_comms.serial = mockSerial
+        self.modem = gsmmodem.modem.GsmModem('-- PORT IGNORED DURING TESTS --', smsReceivedCallbackFunc=received.append)
+        self.modem.smsTextMode = False
+        self.modem.storageManager = manager = gsmmodem.storage.StorageManager(highWater=0.8)
+        try:
+            self.modem.connect()
+        finally:
+            SERIAL_WRITE_CALLBACK_FUNC = None
+        # Messages left in storage are processed when connecting, and the storage usage is queried
+        for command in ('AT+CMGL=1\r', 'AT+CMGL=0\r', 'AT+CPMS?\r'):
+            self.assertTrue(command in written, command)
+        self.assertTrue(written.index('AT+CMGL=0\r') < written.index('AT+CPMS?\r'))
+        pdu = '06917228195339040A9110325476980000313080512061800CC8329BFD06DDDF72363904'
+        responses = {'AT+CMGR=1\r': ['+CMGR: 0,,29\r\n', pdu + '\r\n', 'OK\r\n'],
+                     'AT+CMGR=3\r': ['+CMGR: 1,,29\r\n', pdu + '\r\n', 'OK\r\n'],
+                     'AT+CMGL=1\r': ['+CMGL: 2,1,,29\r\n', pdu + '\r\n', 'OK\r\n'],
+                     'AT+CMGL=0\r': ['+CMGL: 3,0,,29\r\n', pdu + '\r\n', 'OK\r\n'],
+                     'AT+CPMS?\r': ['+CPMS: "SM",0,10,"SM",0,10,"SM",0,10\r\n', 'OK\r\n']}
+        written = []
+        def writeCallbackFunc(data):
+            written.append(data)
+            if data in responses:
+                self.modem.serial.responseSequence = list(responses[data])
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        # Below the high-water mark: the message is read and deleted
+        manager.update('SM', 6, 10)
+        self.modem.serial.responseSequence = ['+CMTI: "SM",1\r\n']
+        deadline = time.time() + 2
+        while ('AT+CMGD=1,0\r' not in written or manager.usage('SM') != (6, 10)) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(manager.usage('SM'), (6, 10))
+        self.assertFalse('AT+CMGL=1\r' in written)
+        # The high-water mark is reached: all stored messages are read and deleted in batches
+        manager.update('SM', 8, 10)
+        written = []
+        self.modem.serial.responseSequence = ['+CMTI: "SM",1\r\n']
+        deadline = time.time() + 2
+        while len(received) < 4 and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        self.assertEqual(len(received), 4)
+        self.assertEqual(received[2].status, Sms.STATUS_RECEIVED_READ)
+        self.assertEqual(received[3].status, Sms.STATUS_RECEIVED_UNREAD)
+        self.assertEqual(written[-5:], ['AT+CMGL=1\r', 'AT+CMGD=2,0\r', 'AT+CMGL=0\r', 'AT+CMGD=3,0\r', 'AT+CPMS?\r'])
+        self.assertEqual(manager.usage('SM'), (0, 10))
+        self.assertEqual(manager.drains, 1)
+        self.assertEqual(manager.drainedMessages, 2)
+        # The late notification for the drained unread message finds its storage index empty
+        responses['AT+CMGR=3\r'] = ['+CMS ERROR: 321\r\n']
+        written = []
+        self.modem.serial.responseSequence = ['+CMTI: "SM",3\r\n']
+        deadline = time.time() + 2
+        while 'AT+CMGR=3\r' not in written and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        self.assertEqual(written, ['AT+CMGR=3\r'])
+        self.assertEqual(len(received), 4)
+        # A newer message stored at the reused index is not mistaken for the drained one
+        responses['AT+CMGR=3\r'] = ['+CMGR: 0,,29\r\n', pdu + '\r\n', 'OK\r\n']
+        written = []
+        self.modem.serial.responseSequence = ['+CMTI: "SM",3\r\n']
+        deadline = time.time() + 2
+        while 'AT+CMGD=3,0\r' not in written and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(received), 5)
+        self.assertEqual(written[:2], ['AT+CMGR=3\r', 'AT+CMGD=3,0\r'])
+        # Messages whose callback fails are left in storage
+        def failingCallback(sms):
+            received.append(sms)
+            raise ValueError('callback failed')
+        self.modem.smsReceivedCallback = failingCallback
+        manager.update('SM', 8, 10)
+        written = []
+        self.modem.serial.responseSequence = ['+CMTI: "SM",1\r\n']
+        deadline = time.time() + 2
+        while 'AT+CPMS?\r' not in written and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        self.assertEqual(len(received), 8)
+        self.assertEqual(written, ['AT+CMGR=1\r', 'AT+CMGL=1\r', 'AT+CMGL=0\r', 'AT+CPMS?\r'])
+        self.assertEqual(manager.drainedMessages, 2)
+        # ...and their notifications are still handled
+        written = []
+        self.modem.serial.responseSequence = ['+CMTI: "SM",3\r\n']
+        deadline = time.time() + 2
+        while len(received) < 9 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(written[0], 'AT+CMGR=3\r')
+        self.assertEqual(len(received), 9)
+
+    def test_reconcileSmsStorage(self):
+        """ Tests that messages left in storage are only deleted once they have been handled """
+        global SERIAL_WRITE_CALLBACK_FUNC
+        written = []
+        SERIAL_WRITE_CALLBACK_FUNC = written.append
+        mockSerial = MockSerialPackage()
+        gsmmodem.serial_comms.serial = mockSerial
+        self.modem = gsmmodem.modem.GsmModem('-- PORT IGNORED DURING TESTS --')
+        self.modem.smsTextMode = False
+        self.modem.storageManager = gsmmodem.storage.StorageManager()
+        try:
+            self.modem.connect()
+        finally:
+            SERIAL_WRITE_CALLBACK_FUNC = None
+        # Without an SMS received callback, stored messages are left alone
+        self.assertFalse(any(command.startswith(('AT+CMGL', 'AT+CMGD')) for command in written))
+        self.assertTrue('AT+CPMS?\r' in written)
+        pdu = '06917228195339040A9110325476980000313080512061800CC8329BFD06DDDF72363904'
+        responses = {'AT+CMGL=1\r': ['+CMGL: 2,1,,29\r\n', pdu + '\r\n', '+CMGL: 4,1,,29\r\n', pdu + '\r\n', 'OK\r\n'],
+                     'AT+CMGL=0\r': ['+CMGL: 3,0,,29\r\n', pdu + '\r\n', 'OK\r\n'],
+                     'AT+CPMS?\r': ['+CPMS: "SM",1,10,"SM",1,10,"SM",1,10\r\n', 'OK\r\n']}
+        written = []
+        def writeCallbackFunc(data):
+            written.append(data)
+            if data in responses:
+                self.modem.serial.responseSequence = list(responses[data])
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        # A failing callback does not stop the rest of the messages from being handled
+        received = []
+        def smsReceivedCallbackFunc(sms):
+            received.append(sms)
+            if len(received) == 1:
+                raise ValueError('callback failed')
+        self.modem.smsReceivedCallback = smsReceivedCallbackFunc
+        self.modem._reconcileSmsStorage()
+        self.assertEqual(len(received), 3)
+        self.assertEqual(written, ['AT+CMGL=1\r', 'AT+CMGD=4,0\r', 'AT+CMGL=0\r', 'AT+CMGD=3,0\r', 'AT+CPMS?\r'])
+        self.assertEqual(self.modem.storageManager.usage('SM'), (1, 10))
+
     def test_readStoredSms_pdu(self):
         """ Tests reading stored SMS messages (PDU mode) """
         self.initFakeModemResponses(textMode=False)
@@ -2255,6 +2733,138 @@ class TestSmsStatusReports(unittest.TestCase):
 
 
 
+class TestReconnect(unittest.TestCase):
+    """ Tests restoring the connection after fatal serial port errors """
+
+    def setUp(self):
+        self.mockSerial = MockSerialPackage()
+        gsmmodem.serial_comms.serial = self.mockSerial
+        self.modem = gsmmodem.modem.GsmModem('-- PORT IGNORED DURING TESTS --')
+        self.modem.reconnectPolicy = gsmmodem.retry.RetryPolicy(maxAttempts=2, baseDelay=0.05, jitter=0)
+        self.fatalErrors = []
+        self.modem.fatalErrorCallback = self.fatalErrors.append
+        self.modem.connect()
+
+    def tearDown(self):
+        global SERIAL_WRITE_CALLBACK_FUNC
+        SERIAL_WRITE_CALLBACK_FUNC = None
+        self.modem.close()
+
+    def test_reconnect(self):
+        """ Tests that the modem is reopened and re-initialized, and that writes wait for this """
+        oldSerial = self.modem.serial
+        self.modem._handleFatalError(self.mockSerial.SerialException('Device disconnected'))
+        self.assertFalse(self.modem.alive)
+        self.assertEqual(self.modem.write('AT'), ['OK'])
+        self.assertTrue(self.modem.alive)
+        self.assertIsNot(self.modem.serial, oldSerial)
+        self.assertEqual(self.modem.reconnects, 1)
+        self.assertEqual(self.fatalErrors, [])
+
+    def test_interruptedCommandRetried(self):
+        """ Tests that a command waiting for a response when the connection is lost is sent again after reconnecting """
+        oldRxThread = self.modem.rxThread
+        def writeCallback(data):
+            self.modem.serial.writeCallbackFunc = None
+            self.modem._handleFatalError(self.mockSerial.SerialException('Device disconnected'))
+            oldRxThread.join()
+        self.modem.serial.writeCallbackFunc = writeCallback
+        self.assertEqual(self.modem.write('AT+CGMI'), ['OK'])
+        self.assertEqual(self.modem.reconnects, 1)
+
+    def test_interruptedCommandNotRetried(self):
+        """ Tests that commands with side effects are not sent again after reconnecting, unless the caller opts in """
+        for idempotent in (None, True):
+            written = []
+            oldRxThread = self.modem.rxThread
+            def writeCallback(data):
+                written.append(data)
+                self.modem.serial.writeCallbackFunc = None
+                self.modem._handleFatalError(self.mockSerial.SerialException('Device disconnected'))
+                oldRxThread.join()
+            self.modem.serial.writeCallbackFunc = writeCallback
+            if idempotent:
+                self.assertEqual(self.modem.write('AT+CMSS=3', idempotent=True), ['OK'])
+            else:
+                self.assertRaises(InterruptedException, self.modem.write, 'AT+CMSS=3')
+                # The connection is still restored
+                self.assertEqual(self.modem.write('AT'), ['OK'])
+            self.assertEqual(written, ['AT+CMSS=3\r'])
+        self.assertEqual(self.modem.reconnects, 2)
+        self.assertTrue(self.modem._isIdempotent('+CREG?'))
+        self.assertTrue(self.modem._isIdempotent('+CSQ'))
+        for family in ('D', '+CUSD=', '+CMGD=', '+CMGS=<data>'):
+            self.assertFalse(self.modem._isIdempotent(family), family)
+        self.assertFalse(self.modem._isIdempotent('+CMGS=', '> '))
+
+    def test_restoreSession(self):
+        """ Tests handling the messages stored while disconnected, and that pending USSD requests are not sent again """
+        pdu = '06917228195339040A9110325476980000313080512061800CC8329BFD06DDDF72363904'
+        responses = {'AT+CMGL=0\r': ['+CMGL: 2,0,,29\r\n', pdu + '\r\n', '+CMGL: 4,0,,29\r\n', pdu + '\r\n', 'OK\r\n']}
+        written = []
+        def writeCallbackFunc(data):
+            written.append(data)
+            if data in responses:
+                self.modem.serial.responseSequence = list(responses[data])
+        def reconnect():
+            del written[:]
+            self.modem._handleFatalError(self.mockSerial.SerialException('Device disconnected'))
+            self.modem.write('AT') # Waits until the session has been restored
+        global SERIAL_WRITE_CALLBACK_FUNC
+        SERIAL_WRITE_CALLBACK_FUNC = writeCallbackFunc
+        self.modem.smsTextMode = False
+        # Without an SMS received callback, stored messages are left alone
+        reconnect()
+        self.assertTrue('AT+CMGF=0\r' in written)
+        self.assertFalse(any(command.startswith(('AT+CMGL', 'AT+CMGD')) for command in written))
+        # Messages are only deleted once their callback returns
+        received = []
+        def smsReceivedCallbackFunc(sms):
+            received.append(sms)
+            if len(received) == 1:
+                raise ValueError('callback failed')
+        self.modem.smsReceivedCallback = smsReceivedCallbackFunc
+        reconnect()
+        self.assertEqual(len(received), 2)
+        self.assertEqual([command for command in written if command.startswith(('AT+CMGL', 'AT+CMGD'))], ['AT+CMGL=0\r', 'AT+CMGD=4,0\r'])
+        # A sendUssd() call waiting for its response fails instead of the request being sent again
+        errors = []
+        def sendUssd():
+            try:
+                self.modem.sendUssd('*101#', responseTimeout=5)
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=sendUssd)
+        thread.start()
+        deadline = time.time() + 2
+        while self.modem._ussdSessionEvent == None and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        del written[:]
+        self.modem._handleFatalError(self.mockSerial.SerialException('Device disconnected'))
+        thread.join(2)
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], InterruptedException)
+        self.assertEqual(self.modem.write('AT'), ['OK'])
+        self.assertTrue('AT+CMGL=0\r' in written)
+        self.assertFalse(any(command.startswith('AT+CUSD') for command in written))
+
+    def test_reconnectFailed(self):
+        """ Tests that the fatal error callback is called if all reconnection attempts fail """
+        openAttempts = []
+        def failingSerial(*args, **kwargs):
+            openAttempts.append(True)
+            raise self.mockSerial.SerialException('No such device')
+        self.mockSerial.Serial = failingSerial
+        self.modem._handleFatalError(self.mockSerial.SerialException('Device disconnected'))
+        self.assertRaises(InterruptedException, self.modem.write, 'AT')
+        self.assertEqual(len(openAttempts), 2)
+        self.assertEqual(len(self.fatalErrors), 1)
+        self.assertEqual(str(self.fatalErrors[0]), 'No such device')
+        self.assertFalse(self.modem.alive)
+
+
+
 
 if __name__ == "__main__":
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.notifications """
+
+import threading, time, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.notifications import NotificationAssembler
+
+
+class TestNotificationAssembler(unittest.TestCase):
+    """ Tests grouping the lines of unsolicited notifications """
+
+    def setUp(self):
+        self.notifications = []
+        self.event = threading.Event()
+        def callback(lines):
+            self.notifications.append(lines)
+            self.event.set()
+        self.assembler = NotificationAssembler(callback, idleTime=0.05, dataIdleTime=0.3)
+
+    def tearDown(self):
+        self.assembler.close()
+
+    def test_complete(self):
+        """ Tests that notifications known to be complete are passed on immediately """
+        self.assembler.feed('+CMTI: "SM",1')
+        self.assertEqual(self.notifications, [['+CMTI: "SM",1']])
+        # Header followed by exactly one data line
+        self.assembler.feed('+CMT: ,24')
+        self.assertEqual(self.assembler.expecting, 1)
+        self.assembler.feed('07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619')
+        self.assertEqual(self.notifications[1], ['+CMT: ,24', '07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619'])
+        self.assertEqual(self.assembler.expecting, 0)
+        # PDU mode status report; text mode status reports are a single line
+        self.assembler.feed('+CDS: 24')
+        self.assembler.feed('07912752800081F306A00B917228001032F4')
+        self.assembler.feed('+CDS: 6,202,"0123456789",129,"13/04/24,13:28:07+08","13/04/24,13:28:09+08",0')
+        self.assertEqual(len(self.notifications[2]), 2)
+        self.assertEqual(len(self.notifications[3]), 1)
+        # Incoming call: RING followed by caller ID
+        self.assembler.feed('RING')
+        self.assembler.feed('+CLIP: "+27820001234",145,,,,0')
+        self.assertEqual(self.notifications[4], ['RING', '+CLIP: "+27820001234",145,,,,0'])
+        # Multi-line USSD response
+        self.assembler.feed('+CUSD: 0,"Balance: R 0.00')
+        self.assembler.feed('Expires: never",15')
+        self.assertEqual(self.notifications[5], ['+CUSD: 0,"Balance: R 0.00', 'Expires: never",15'])
+        # Extra "session released" USSD notification, followed by the response
+        self.assembler.feed('+CUSD: 2,"Initiating Release",15')
+        self.assertEqual(len(self.notifications), 6)
+        self.assembler.feed('+CUSD: 0,"Test",15')
+        self.assertEqual(self.notifications[6], ['+CUSD: 2,"Initiating Release",15', '+CUSD: 0,"Test",15'])
+        # Vendor-specific extended result codes
+        self.assembler.feed('^CEND:1,0,104,16')
+        self.assertEqual(self.notifications[7], ['^CEND:1,0,104,16'])
+        self.assembler.feed('HANGUP: 1')
+        self.assertEqual(self.notifications[8], ['HANGUP: 1'])
+        self.assembler.feed('NO CARRIER')
+        self.assertEqual(self.notifications[9], ['NO CARRIER'])
+        self.assertEqual(self.assembler.completed, 10)
+        self.assertEqual(self.assembler.idleFlushed, 0)
+
+    def test_textLength(self):
+        """ Tests collecting text mode +CMT messages spanning several lines, using the length in the header """
+        header = '+CMT: "+27820001234",,"13/03/08,15:02:16+08",145,4,0,{0},"+27829999999",145,{1}'
+        self.assembler.feed(header.format(0, 17))
+        self.assembler.feed('Hello')
+        self.assembler.feed('world')
+        self.assertEqual(self.notifications, [])
+        self.assembler.feed('again')
+        self.assertEqual(self.notifications, [[header.format(0, 17), 'Hello', 'world', 'again']])
+        # UCS2 text is hex-encoded: 4 characters per character
+        self.assembler.feed(header.format(8, 4))
+        self.assembler.feed('00480069')
+        self.assertEqual(self.notifications[1], [header.format(8, 4), '00480069'])
+        # Without the length, the text is a single line
+        self.assembler.feed('+CMT: "+27820001234",,"13/03/08,15:02:16+08"')
+        self.assembler.feed('Hello')
+        self.assertEqual(len(self.notifications[2]), 2)
+        self.assertEqual(self.assembler.expecting, 0)
+        self.assertEqual(self.assembler.idleFlushed, 0)
+
+    def test_idle(self):
+        """ Tests that other notifications are grouped until no further lines are read for the idle time """
+        self.assembler.feed(' blah blah blah ')
+        time.sleep(0.02)
+        self.assembler.feed('12345')
+        self.assertEqual(self.notifications, [])
+        self.assertTrue(self.event.wait(1))
+        self.assertEqual(self.notifications, [[' blah blah blah ', '12345']])
+        self.assertEqual(self.assembler.idleFlushed, 1)
+        # Data lines may arrive later than the idle time...
+        self.event.clear()
+        self.assembler.feed('+CMT: ,24')
+        time.sleep(0.1)
+        self.assertEqual(len(self.notifications), 1)
+        self.assembler.feed('07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619')
+        self.assertEqual(len(self.notifications[1]), 2)
+        # ...but a missing data line does not hold up notifications
+        self.event.clear()
+        self.assembler.feed('+CMT: ,24')
+        self.assertTrue(self.event.wait(1))
+        self.assertEqual(self.notifications[2], ['+CMT: ,24'])
+        self.assertEqual(self.assembler.expecting, 0)
+
+    def test_close(self):
+        self.assembler.feed('RING')
+        self.assembler.close()
+        time.sleep(0.1)
+        self.assertEqual(self.notifications, [])
+        # The assembler can be used again after closing
+        self.assembler.feed('RING')
+        self.assertTrue(self.event.wait(1))
+        self.assertEqual(self.notifications, [['RING']])
+
+    def test_flush(self):
+        self.assembler.feed('RING')
+        self.assembler.flush()
+        self.assertEqual(self.notifications, [['RING']])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.ratelimit """
+
+import unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.ratelimit import TokenBucket, SendRateLimiter
+
+
+class TestTokenBucket(unittest.TestCase):
+    """ Tests the token bucket used by the send rate limiter """
+
+    def test_refill(self):
+        bucket = TokenBucket(2, capacity=2)
+        now = bucket._updated
+        self.assertEqual(bucket.consume(2, now), 0)
+        self.assertAlmostEqual(bucket.delay(1, now), 0.5)
+        # Tokens are added at the bucket's rate, up to its capacity
+        self.assertEqual(bucket.delay(1, now + 0.5), 0)
+        self.assertEqual(bucket.delay(2, now + 10), 0)
+        # Requests exceeding the capacity wait for a full bucket, and are paid back afterwards
+        self.assertEqual(bucket.consume(3, now + 10), 0)
+        self.assertAlmostEqual(bucket.delay(1, now + 10), 1)
+
+    def test_reservations(self):
+        """ Tests that reserved tokens make later callers wait in turn """
+        bucket = TokenBucket(10)
+        now = bucket._updated
+        self.assertEqual(bucket.consume(1, now), 0)
+        self.assertAlmostEqual(bucket.consume(1, now), 0.1)
+        self.assertAlmostEqual(bucket.consume(1, now), 0.2)
+        self.assertAlmostEqual(bucket.delay(1, now + 0.1), 0.2)
+
+    def test_invalidRate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
+class TestSendRateLimiter(unittest.TestCase):
+    """ Tests the per-modem and per-prefix send rate limits """
+
+    def test_limits(self):
+        limiter = SendRateLimiter(perMinute=600, prefixes={'+2782': 60, '27821': (6, 2)})
+        self.assertEqual(limiter.reserve('+27720000000'), 0)
+        # Overall limit: 10 messages per second
+        self.assertAlmostEqual(limiter.delay('+27720000000'), 0.1, places=2)
+        # The longest matching prefix applies; messages wait for all of their buckets
+        self.assertAlmostEqual(limiter.reserve('27821000000', 2), 0.1, places=2)
+        self.assertAlmostEqual(limiter.delay('27821000000'), 10.1, places=1)
+        self.assertAlmostEqual(limiter.reserve('+27820000000'), 0.3, places=2)
+        self.assertAlmostEqual(limiter.delay('+27820000000'), 1.3, places=1)
+        stats = limiter.stats()
+        self.assertEqual(stats['reservations'], 4)
+        self.assertEqual(stats['delayed'], 3)
+        self.assertAlmostEqual(stats['totalWait'], 0.4, places=2)
+        self.assertAlmostEqual(stats['maxWait'], 0.3, places=2)
+
+    def test_noLimits(self):
+        limiter = SendRateLimiter()
+        for i in range(100):
+            self.assertEqual(limiter.acquire('123'), 0)
+        self.assertEqual(limiter.stats()['delayed'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.reactor """
+
+import socket, threading, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.reactor import Reactor
+from gsmmodem.serial_comms import SerialComms
+
+
+class Responder(object):
+    """ Fake modem on the remote end of a socket pair; responds "OK" to every command """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _serve(self):
+        rxBuffer = b''
+        while True:
+            try:
+                data = self.socket.recv(1024)
+            except socket.error:
+                return
+            if not data:
+                return
+            rxBuffer += data
+            while b'\r' in rxBuffer:
+                command, rxBuffer = rxBuffer.split(b'\r', 1)
+                self.socket.sendall(b'\r\n' + command[2:] + b'\r\nOK\r\n')
+
+
+class TestReactor(unittest.TestCase):
+    """ Tests serving several modems from a single reactor thread """
+
+    def setUp(self):
+        self.reactor = Reactor()
+        self.reactor.start()
+        self.sockets = []
+        self.notifications = []
+        self.fatalErrors = []
+        self.notified = threading.Event()
+
+    def tearDown(self):
+        self.reactor.close()
+        for sock in self.sockets:
+            sock.close()
+
+    def createModem(self):
+        local, remote = socket.socketpair()
+        self.sockets.extend((local, remote))
+        Responder(remote)
+        def notificationCallback(lines):
+            self.notifications.append(lines)
+            self.notified.set()
+        modem = SerialComms('fd://{0}'.format(local.fileno()), notifyCallbackFunc=notificationCallback, fatalErrorCallbackFunc=self.fatalErrors.append)
+        modem.reactor = self.reactor
+        modem.connect()
+        return modem, remote
+
+    def test_multipleModems(self):
+        """ Tests concurrent commands and notifications on several modems """
+        modems = [self.createModem() for i in range(5)]
+        self.assertEqual(len(self.reactor.modems), 5)
+        self.assertEqual([modem.rxThread for modem, remote in modems], [None] * 5)
+        results = []
+        def sendCommands(modem, number):
+            for i in range(20):
+                results.append(modem.write('AT+TEST={0},{1}\r'.format(number, i)) == ['+TEST={0},{1}'.format(number, i), 'OK'])
+        threads = [threading.Thread(target=sendCommands, args=(modem, number)) for number, (modem, remote) in enumerate(modems)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 100)
+        # Unsolicited notification, delivered in two chunks
+        modems[2][1].sendall(b'\r\n+CMTI: "S')
+        modems[2][1].sendall(b'M",1\r\n')
+        self.notified.wait(2)
+        self.assertEqual(self.notifications, [['+CMTI: "SM",1']])
+        for modem, remote in modems:
+            modem.close()
+        self.assertEqual(self.reactor.modems, [])
+
+    def test_fatalError(self):
+        """ Tests that modems are unregistered (and the fatal error callback called) if their transport fails """
+        modem, remote = self.createModem()
+        remote.shutdown(socket.SHUT_RDWR)
+        for i in range(100):
+            if self.fatalErrors:
+                break
+            threading.Event().wait(0.02)
+        self.assertEqual(len(self.fatalErrors), 1)
+        self.assertFalse(modem.alive)
+        self.assertEqual(self.reactor.modems, [])
+
+    def test_registrationErrors(self):
+        """ Tests that registration errors are raised in the caller, without stopping the reactor """
+        class NoFdTransport(object):
+            def close(self):
+                pass
+        class BrokenFdTransport(NoFdTransport):
+            def fileno(self):
+                raise IOError('no file descriptor')
+        for transport in (NoFdTransport, BrokenFdTransport):
+            modem = SerialComms('-- PORT IGNORED DURING TESTS --')
+            modem.serial = transport()
+            self.assertRaises((ValueError, IOError), self.reactor.register, modem)
+            self.assertEqual(self.reactor.modems, [])
+        self.assertTrue(self.reactor.alive)
+        # The reactor still serves other modems
+        modem, remote = self.createModem()
+        self.assertEqual(modem.write('AT+TEST\r'), ['+TEST', 'OK'])
+        modem.close()
+
+    def test_threadFailure(self):
+        """ Tests that registration changes do not hang if the I/O thread dies """
+        def brokenSelect(*args):
+            raise RuntimeError('select failed')
+        self.reactor._selector.select = brokenSelect
+        self.reactor._wakeup()
+        self.reactor.thread.join(2)
+        self.assertFalse(self.reactor.alive)
+        modem, remote = self.createModem()
+        self.assertEqual(self.reactor.modems, [modem])
+        modem.serial.close()
+        self.reactor.unregister(modem)
+        self.assertEqual(self.reactor.modems, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
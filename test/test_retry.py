@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.retry """
+
+import unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.retry import RetryPolicy, LatencyModel
+
+class TestLatencyModel(unittest.TestCase):
+    """ Tests the EWMA latency model """
+
+    def test_record(self):
+        model = LatencyModel(alpha=0.5)
+        self.assertEqual(model.average, None)
+        model.record(1.0)
+        self.assertEqual(model.average, 1.0)
+        model.record(2.0)
+        self.assertEqual(model.average, 1.5)
+        self.assertEqual(model.samples, 2)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """ Tests the retry/backoff decisions of RetryPolicy """
+
+    def test_retryDelay(self):
+        """ Tests bounded, exponential backoff for transient errors """
+        policy = RetryPolicy(maxAttempts=4, baseDelay=0.1, maxDelay=0.3, jitter=0)
+        self.assertEqual(policy.retryDelay('CME', 515, 0), 0.1)
+        self.assertEqual(policy.retryDelay('CME', 14, 1), 0.2)
+        self.assertEqual(policy.retryDelay('CME', 515, 2), 0.3) # capped at maxDelay
+        self.assertEqual(policy.retryDelay('CME', 515, 3), None) # attempts exhausted
+        self.assertEqual(policy.retries, 3)
+        self.assertEqual(policy.exhausted, 1)
+        self.assertEqual(policy.busyErrors, 4)
+
+    def test_retryDelayJitter(self):
+        """ Tests that jitter only ever shortens the backoff delay """
+        policy = RetryPolicy(baseDelay=0.1, jitter=0.5)
+        for i in range(20):
+            delay = policy.retryDelay('CME', 515, 0)
+            self.assertTrue(0.05 <= delay <= 0.1, 'Jittered delay out of range: {0}'.format(delay))
+
+    def test_backoffDelay(self):
+        """ Tests that backoffDelay() uses the retry backoff, without counting retries """
+        policy = RetryPolicy(maxAttempts=2, baseDelay=0.1, maxDelay=0.3, jitter=0)
+        self.assertEqual([policy.backoffDelay(attempt) for attempt in range(4)], [0.1, 0.2, 0.3, 0.3])
+        self.assertEqual(policy.retries, 0)
+
+    def test_nonTransientErrors(self):
+        """ Tests that other errors are never retried """
+        policy = RetryPolicy()
+        self.assertEqual(policy.retryDelay('CME', 22, 0), None)
+        self.assertEqual(policy.retryDelay('CMS', 515, 0), None)
+        self.assertEqual(policy.busyErrors, 0)
+
+    def test_pace(self):
+        """ Tests that writes are only paced while the modem is struggling """
+        policy = RetryPolicy(paceFactor=0.5, maxPace=1.0, recoveryCount=2)
+        policy.recordLatency(0.4)
+        self.assertEqual(policy.pace, 0)
+        policy.retryDelay('CME', 515, 0)
+        self.assertEqual(policy.pace, 0.2)
+        policy.recordLatency(0.4)
+        self.assertEqual(policy.pace, 0.2)
+        policy.recordLatency(0.4)
+        self.assertEqual(policy.pace, 0)
+        self.assertEqual(policy.metrics['retries'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.scheduler """
+
+import threading, time, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.scheduler import PriorityLock, commandPriority, currentPriority, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK
+from gsmmodem.locks import ProfiledRLock
+
+
+class TestPriorityLock(unittest.TestCase):
+    """ Tests serving waiting threads by priority class """
+
+    def _queueWaiters(self, lock, priorities, order):
+        """ Starts a thread per priority (in order) that waits for the (held) lock, then records its priority """
+        threads = []
+        for priority in priorities:
+            def waiter(priority=priority):
+                with commandPriority(priority):
+                    with lock:
+                        order.append(priority)
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            threads.append(thread)
+            # Make sure the threads are queued in order
+            while len(lock._waiters) < len(threads):
+                time.sleep(0.001)
+        return threads
+
+    def test_commandPriority(self):
+        self.assertEqual(currentPriority(), PRIORITY_NORMAL)
+        with commandPriority(PRIORITY_BULK):
+            self.assertEqual(currentPriority(), PRIORITY_BULK)
+            with commandPriority(PRIORITY_HIGH):
+                self.assertEqual(currentPriority(), PRIORITY_HIGH)
+            with commandPriority(None):
+                self.assertEqual(currentPriority(), PRIORITY_BULK)
+            self.assertEqual(currentPriority(), PRIORITY_BULK)
+        self.assertEqual(currentPriority(), PRIORITY_NORMAL)
+
+    def test_priorityOrder(self):
+        """ Tests that high priority commands are served before queued bulk work, and FIFO order within a class """
+        lock = PriorityLock('test', agingInterval=None)
+        order = []
+        with lock:
+            with lock: # Re-entrant
+                threads = self._queueWaiters(lock, (PRIORITY_BULK, PRIORITY_NORMAL, PRIORITY_BULK, PRIORITY_HIGH, PRIORITY_NORMAL), order)
+                self.assertEqual(lock.waiting, {'high': 1, 'normal': 2, 'bulk': 2})
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_NORMAL, PRIORITY_BULK, PRIORITY_BULK])
+        stats = lock.stats()
+        self.assertEqual(stats['classes']['normal']['acquisitions'], 3)
+        self.assertEqual(stats['classes']['normal']['contended'], 2)
+        self.assertEqual(stats['classes']['bulk']['contended'], 2)
+        self.assertGreater(stats['classes']['bulk']['maxWait'], stats['classes']['high']['maxWait'])
+        self.assertEqual(stats['promotions'], 0)
+        self.assertFalse(lock._is_owned())
+
+    def test_aging(self):
+        """ Tests that bulk work that has waited long enough is served before newer, higher priority commands """
+        lock = PriorityLock('test', agingInterval=0.05)
+        order = []
+        with lock:
+            threads = self._queueWaiters(lock, (PRIORITY_BULK,), order)
+            time.sleep(0.12)
+            threads.extend(self._queueWaiters(lock, (PRIORITY_NORMAL, PRIORITY_HIGH), order))
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [PRIORITY_BULK, PRIORITY_HIGH, PRIORITY_NORMAL])
+        self.assertEqual(lock.stats()['promotions'], 1)
+
+    def test_timeout(self):
+        lock = PriorityLock()
+        results = []
+        with lock:
+            thread = threading.Thread(target=lambda: results.extend([lock.acquire(False), lock.acquire(True, 0.05)]))
+            thread.start()
+            thread.join()
+        self.assertEqual(results, [False, False])
+        self.assertEqual(lock._waiters, [])
+        self.assertRaises(RuntimeError, lock.release)
+        # The lock is still usable
+        self.assertTrue(lock.acquire(True, 0.05))
+        lock.release()
+
+    def test_profiled(self):
+        """ Tests instrumenting a PriorityLock with ProfiledRLock """
+        lock = PriorityLock('test', agingInterval=None)
+        profiled = ProfiledRLock('test', lock=lock)
+        order = []
+        with profiled:
+            threads = self._queueWaiters(lock, (PRIORITY_BULK, PRIORITY_HIGH), order)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [PRIORITY_HIGH, PRIORITY_BULK])
+        self.assertEqual(profiled.stats()['acquisitions'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,7 +10,10 @@ from copy import copy
 from . import compat # For Python 2.6 compatibility
 
 import gsmmodem.serial_comms
+import gsmmodem.tracing
+import gsmmodem.grammar
 from gsmmodem.exceptions import TimeoutException
+from gsmmodem.scheduler import commandPriority, currentPriority, PRIORITY_HIGH, PRIORITY_BULK
 
 class MockSerialPackage(object):
     """ Fake serial package for the GsmModem/SerialComms classes to import during tests """
@@ -114,9 +117,32 @@ class TestNotifications(unittest.TestCase):
             # Wait a bit for the event to be picked up
             while len(serialComms.serial._readQueue) > 0 or len(serialComms.serial.responseSequence) > 0:
                 time.sleep(0.05)
+            # Notifications of unknown types are passed on once no further lines have been read for a while
+            deadline = time.time() + 1
+            while not callbackCalled[0] and time.time() < deadline:
+                time.sleep(0.01)
             self.assertTrue(callbackCalled[0], 'Notification callback function not called')
             serialComms.close()
     
+    def test_duringResponse(self):
+        """ Tests that notifications read while waiting for a command's response are not added to the response """
+        notifications = []
+        serialComms = gsmmodem.serial_comms.SerialComms('-- PORT IGNORED DURING TESTS --', notifyCallbackFunc=notifications.append)
+        serialComms.connect()
+        try:
+            serialComms.serial.responseSequence = ['+CMGR: 0,,29\r\n', '+CMTI: "SM",2\r\n', '07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619\r\n', 'OK\r\n']
+            serialComms.serial.flushResponseSequence = True
+            response = serialComms.write('AT+CMGR=1\r')
+            self.assertEqual(response, ['+CMGR: 0,,29', '07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619', 'OK'])
+            self.assertEqual(notifications, [['+CMTI: "SM",2']])
+            # Data lines following a notification header are part of the notification
+            serialComms.serial.responseSequence = ['+CLIP: 1,1\r\n', '+CMT: ,24\r\n', '07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619\r\n', 'OK\r\n']
+            response = serialComms.write('AT+CLIP?\r')
+            self.assertEqual(response, ['+CLIP: 1,1', 'OK'])
+            self.assertEqual(notifications[1], ['+CMT: ,24', '07912752800081F3040B917228001032F40000312042315072800DC8329BFD06DDDF723619'])
+        finally:
+            serialComms.close()
+
     def test_noCallback(self):
         """ Tests notifications when no callback method was specified (nothing should happen) """
         for test in self.tests:
@@ -192,8 +218,47 @@ class TestWrite(unittest.TestCase):
             self.assertEqual(response, expected)
             # Now write without expecting a response
             response = self.serialComms.write('test2\r', waitForResponse=False)
-            self.assertEqual(response, None) 
-    
+            self.assertEqual(response, None)
+
+    def test_writeTerminators(self):
+        """ Tests ending responses with profile-specific terminators """
+        self.serialComms.serial.flushResponseSequence = True
+        self.serialComms.serial.responseSequence = ['OKAY\r\n', '+CME ERROR: SIM not inserted\r\n']
+        self.assertEqual(self.serialComms.write('test\r'), ['OKAY', '+CME ERROR: SIM not inserted'])
+        self.serialComms.responseTerminators = gsmmodem.grammar.TERMINATOR_PROFILES['dialup']
+        self.serialComms.serial.responseSequence = ['BUSY\r\n']
+        self.assertEqual(self.serialComms.write('ATD123;\r'), ['BUSY'])
+        self.serialComms.responseTerminators = gsmmodem.grammar.TerminatorSet().extend(['SEND OK'])
+        self.serialComms.serial.responseSequence = ['data\r\n', 'SEND OK\r\n']
+        self.assertEqual(self.serialComms.write('test\r'), ['data', 'SEND OK'])
+
+    def test_writeStreaming(self):
+        """ Tests passing response lines to a callback, and iterating over them, as they are received """
+        lines = []
+        self.serialComms.serial.responseSequence = ['first line\r\n', 'second line\r\n', 'OK\r\n']
+        self.serialComms.serial.flushResponseSequence = True
+        self.assertEqual(self.serialComms.write('test\r', responseLineCallback=lines.append), ['OK'])
+        self.assertEqual(lines, ['first line', 'second line'])
+        self.assertEqual(self.serialComms._response, ['OK'])
+        self.serialComms.serial.responseSequence = ['first line\r\n', 'second line\r\n', 'OK\r\n']
+        self.assertEqual(list(self.serialComms.iterResponse('test\r')), ['first line', 'second line'])
+        # The calling thread holds the transmit lock, so the command cannot be written by another thread
+        self.serialComms.serial.responseSequence = ['line\r\n', 'OK\r\n']
+        with self.serialComms._txLock:
+            self.assertEqual(list(self.serialComms.iterResponse('test\r')), ['line'])
+        # Errors are raised by the iterator
+        self.assertRaises(TimeoutException, list, self.serialComms.iterResponse('test\r', timeout=0.1))
+        # The command is written with the calling thread's priority
+        priorities = []
+        self.serialComms.serial.writeCallbackFunc = lambda data: priorities.append(currentPriority())
+        self.serialComms.serial.responseSequence = ['line\r\n', 'OK\r\n']
+        with commandPriority(PRIORITY_HIGH):
+            self.assertEqual(list(self.serialComms.iterResponse('test\r')), ['line'])
+        self.serialComms.serial.responseSequence = ['line\r\n', 'OK\r\n']
+        self.assertEqual(list(self.serialComms.iterResponse('test\r', priority=PRIORITY_BULK)), ['line'])
+        self.assertEqual(priorities, [PRIORITY_HIGH, PRIORITY_BULK])
+        self.serialComms.serial.writeCallbackFunc = None
+
     def test_writeTimeout(self):
         """ Tests that the serial comms write timeout parameter """
         # Serial comms will not response (no response sequence specified)
@@ -220,6 +285,46 @@ class TestWrite(unittest.TestCase):
         else:
             self.fail('TimeoutException not thrown')
 
+    def test_writeTracing(self):
+        """ Tests that the tracer is notified of each stage of a command round trip """
+        events = []
+        class TestTracer(gsmmodem.tracing.Tracer):
+            def onCommandStart(self, trace):
+                events.append(('start', trace.command))
+            def onFirstByte(self, trace):
+                events.append(('firstByte', trace.command))
+            def onResponseComplete(self, trace):
+                events.append(('complete', trace.command))
+            def onError(self, trace, error):
+                events.append(('error', trace.command))
+        self.serialComms.tracer = tracer = TestTracer()
+        self.serialComms.serial.responseSequence = ['first line\r\n', 'OK\r\n']
+        self.serialComms.serial.flushResponseSequence = True
+        trace = gsmmodem.tracing.CommandTrace(tracer, self.serialComms.port, 'test\r')
+        self.serialComms.write('test\r', trace=trace)
+        self.assertEqual(events, [('start', 'test\r'), ('firstByte', 'test\r'), ('complete', 'test\r')])
+        self.assertEqual(trace.responseSize, len('first line\r\nOK\r\n'))
+        self.assertEqual(trace.responseLines, 2)
+        for duration in (trace.lockWait, trace.writeTime, trace.processingTime, trace.receiveTime):
+            self.assertGreaterEqual(duration, 0)
+        self.assertAlmostEqual(trace.totalTime, trace.lockWait + trace.writeTime + trace.processingTime + trace.receiveTime)
+        # The response may start arriving before the command has been written completely
+        def writeCallbackFunc(data):
+            self.serialComms._handleRxBytes(b'OK\r\n')
+            time.sleep(0.02)
+        self.serialComms.serial.writeCallbackFunc = writeCallbackFunc
+        self.serialComms.serial.responseSequence = []
+        trace = gsmmodem.tracing.CommandTrace(tracer, self.serialComms.port, 'test\r')
+        self.assertEqual(self.serialComms.write('test\r', trace=trace), ['OK'])
+        self.assertEqual(trace.processingTime, 0)
+        self.assertGreaterEqual(trace.writeTime, 0)
+        self.assertAlmostEqual(trace.totalTime, trace.lockWait + trace.writeTime + trace.processingTime + trace.receiveTime)
+        self.serialComms.serial.writeCallbackFunc = None
+        # Timeouts are reported as errors
+        del events[:]
+        self.assertRaises(TimeoutException, self.serialComms.write, 'test2\r', timeout=0.1)
+        self.assertEqual(events, [('start', 'test2\r'), ('error', 'test2\r')])
+
 
 if __name__ == "__main__":
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
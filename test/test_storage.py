@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.storage """
+
+import unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.storage import StorageManager
+
+
+class TestStorageManager(unittest.TestCase):
+    """ Tests tracking SMS message storage usage """
+
+    def test_responses(self):
+        manager = StorageManager()
+        self.assertEqual(manager.usage('SM'), None)
+        # AT+CPMS? names the memories
+        manager.updateFromResponse(['+CPMS: "SM",3,30,"ME",10,100,"SM",3,30', 'OK'])
+        self.assertEqual(manager.usage('SM'), (3, 30))
+        self.assertEqual(manager.usage('"ME"'), (10, 100))
+        # Responses to setting the memories only contain the usage
+        manager.updateFromResponse(['+CPMS: 14,50,14,50', 'OK'], ['"SM"', '"SR"'])
+        self.assertEqual(manager.usage('SM'), (14, 50))
+        self.assertEqual(manager.usage('SR'), (14, 50))
+        manager.updateFromResponse(['OK'], ['ME'])
+        self.assertEqual(manager.usage('ME'), (10, 100))
+        self.assertEqual(manager.peakUsed, 14)
+
+    def test_highWater(self):
+        manager = StorageManager(highWater=0.5)
+        self.assertFalse(manager.needsDrain('SM'))
+        manager.update('SM', 3, 8)
+        self.assertFalse(manager.needsDrain('SM'))
+        manager.stored('SM')
+        self.assertTrue(manager.needsDrain('SM'))
+        manager.removed('SM', 2)
+        self.assertEqual(manager.usage('SM'), (2, 8))
+        self.assertFalse(manager.needsDrain('SM'))
+        # The estimate stays within the memory's capacity
+        manager.stored('SM', 10)
+        self.assertEqual(manager.usage('SM'), (8, 8))
+        manager.removed('SM', None)
+        self.assertEqual(manager.usage('SM'), (0, 8))
+        manager.invalidate('SM')
+        self.assertEqual(manager.usage('SM'), None)
+        self.assertRaises(ValueError, StorageManager, 0)
+        self.assertRaises(ValueError, StorageManager, 1.5)
+
+    def test_drain(self):
+        manager = StorageManager()
+        self.assertTrue(manager.startDrain())
+        self.assertFalse(manager.startDrain())
+        manager.drained('"SM"', [3, 4])
+        manager.drained('SM', [1])
+        manager.endDrain()
+        self.assertTrue(manager.startDrain())
+        manager.endDrain()
+        # Drained indexes are not remembered, so a newer message stored at a reused index is claimed
+        self.assertEqual(manager.claim('SM', ['3']), ['3'])
+        stats = manager.stats()
+        self.assertEqual(stats['drains'], 2)
+        self.assertEqual(stats['drainedMessages'], 3)
+        manager.reset()
+        self.assertEqual(manager.claim('SM', [3]), [3])
+
+    def test_claim(self):
+        """ Tests that stored messages are only handled by one thread at a time """
+        manager = StorageManager()
+        self.assertEqual(manager.claim('SM', [1, 2]), [1, 2])
+        # Claimed messages are skipped until they are released
+        self.assertEqual(manager.claim('"SM"', [2, 3]), [3])
+        self.assertEqual(manager.claim('ME', [2]), [2])
+        manager.release('SM', [2])
+        self.assertEqual(manager.claim('SM', [1, 2]), [2])
+        manager.release('SM', [1, 2, 3])
+        self.assertEqual(manager.claim('SM', [1, 2, 3]), [1, 2, 3])
+
+if __name__ == "__main__":
+    unittest.main()
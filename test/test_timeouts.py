@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.timeouts """
+
+import unittest
+
+from . import compat # For Python 2.6 compatibility
+
+from gsmmodem.timeouts import TimeoutProfile
+from gsmmodem.util import commandFamily
+
+class TestTimeoutProfile(unittest.TestCase):
+    """ Tests deriving command timeouts from observed latencies """
+
+    def test_defaults(self):
+        """ Tests that default timeouts are used until enough samples are available """
+        profile = TimeoutProfile(defaultTimeout=10, minSamples=5)
+        self.assertEqual(profile.timeout('Z'), 10)
+        self.assertEqual(profile.timeout('+CMGS='), 5)
+        self.assertEqual(profile.timeout('AT', 0.5), 0.5)
+        for i in range(4):
+            profile.record('Z', 0.1)
+        self.assertEqual(profile.timeout('Z'), 10)
+
+    def test_derivedTimeouts(self):
+        """ Tests fast failure on quick modems, and longer timeouts for slow ones """
+        profile = TimeoutProfile(floor=0.5, ceiling=35, percentile=0.9, headroom=2.0, minSamples=10)
+        for i in range(10):
+            profile.record('+CSQ', 0.01)
+            profile.record('+CMGS=', 0.01)
+            profile.record('+CMGS=<data>', 2 + i)
+            profile.record('+CLAC', 15)
+        self.assertEqual(profile.timeout('+CSQ'), 0.5) # floor
+        # Command families with a default timeout never get less than the default
+        self.assertEqual(profile.timeout('+CMGS='), 5)
+        self.assertEqual(profile.timeout('+CMGS=<data>'), 35)
+        self.assertEqual(profile.timeout('+CLAC'), 30)
+        # Sending a stored message waits for the network, like sending the message data
+        family = commandFamily('AT+CMSS=3,"+27820001234",145')
+        self.assertEqual(family, '+CMSS=')
+        for i in range(10):
+            profile.record(family, 0.05)
+        self.assertEqual(profile.timeout(family), 35)
+        for i in range(3):
+            profile.record('+CLAC', 30)
+        self.assertEqual(profile.timeout('+CLAC'), 35) # ceiling
+
+    def test_window(self):
+        """ Tests that only recent samples are considered """
+        profile = TimeoutProfile(percentile=0.99, headroom=1.0, minSamples=5, windowSize=5)
+        for i in range(5):
+            profile.record('+CSQ', 5)
+        self.assertEqual(profile.timeout('+CSQ'), 5)
+        for i in range(5):
+            profile.record('+CSQ', 1)
+        self.assertEqual(profile.timeout('+CSQ'), 1)
+        self.assertEqual(profile.stats['+CSQ']['samples'], 5)
+        self.assertEqual(profile.latencyPercentile('+CMGS=', 0.5), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+""" Test suite for gsmmodem.transport """
+
+import socket, threading, time, unittest
+
+from . import compat # For Python 2.6 compatibility
+
+import serial
+
+from gsmmodem.transport import SocketTransport, FdTransport, parseHostPort
+from gsmmodem.serial_comms import SerialComms
+from gsmmodem.exceptions import InterruptedException
+
+
+class FakeModemServer(object):
+    """ TCP server that accepts a single connection, and responds "OK" to every command """
+
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.connection = None
+        self.connected = threading.Event()
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _serve(self):
+        self.connection = self.listener.accept()[0]
+        self.connected.set()
+        rxBuffer = b''
+        while True:
+            try:
+                data = self.connection.recv(1024)
+            except socket.error:
+                return
+            if not data:
+                return
+            rxBuffer += data
+            while b'\r' in rxBuffer:
+                command, rxBuffer = rxBuffer.split(b'\r', 1)
+                self.connection.sendall(b'\r\n' + command + b'\r\n\r\nOK\r\n')
+
+    def close(self):
+        if self.connection != None:
+            self.connection.close()
+        self.listener.close()
+
+
+class TestTransports(unittest.TestCase):
+    """ Tests the non-serial transports """
+
+    def test_parseHostPort(self):
+        self.assertEqual(parseHostPort('127.0.0.1:5000'), ('127.0.0.1', 5000))
+        self.assertEqual(parseHostPort('modems.example.com:7001/'), ('modems.example.com', 7001))
+        self.assertEqual(parseHostPort('[::1]:23'), ('::1', 23))
+        self.assertRaises(ValueError, parseHostPort, 'localhost')
+        self.assertRaises(ValueError, parseHostPort, 'localhost:abc')
+
+    def test_socketTransport(self):
+        """ Tests reading and writing via a TCP socket """
+        server = FakeModemServer()
+        try:
+            transport = SocketTransport('127.0.0.1', server.port, timeout=1)
+            self.assertEqual(transport.read(), b'') # Read timeout
+            transport.write(b'AT\r')
+            self.assertEqual(transport.read(1), b'\r')
+            time.sleep(0.1)
+            self.assertEqual(transport.inWaiting(), 11)
+            self.assertEqual(transport.readAvailable(), b'\nAT\r\n\r\nOK\r\n')
+            self.assertEqual(transport.readAvailable(), b'')
+            server.connection.shutdown(socket.SHUT_RDWR)
+            time.sleep(0.1)
+            self.assertRaises(serial.SerialException, transport.read)
+            transport.close()
+        finally:
+            server.close()
+        self.assertRaises(serial.SerialException, SocketTransport, '127.0.0.1', server.port, connectTimeout=1)
+
+    def test_fdTransport(self):
+        """ Tests reading and writing via a file descriptor """
+        local, remote = socket.socketpair()
+        try:
+            transport = FdTransport(local.fileno(), timeout=0.1)
+            self.assertEqual(transport.fileno(), local.fileno())
+            transport.write(b'AT\r')
+            self.assertEqual(remote.recv(10), b'AT\r')
+            remote.sendall(b'OK\r\n')
+            self.assertEqual(transport.read(2), b'OK')
+            self.assertEqual(transport.readAvailable(), b'\r\n')
+            self.assertEqual(transport.read(), b'')
+        finally:
+            local.close()
+            remote.close()
+
+    def test_serialCommsSocket(self):
+        """ Tests SerialComms with a socket:// port """
+        server = FakeModemServer()
+        serialComms = SerialComms('socket://127.0.0.1:{0}'.format(server.port))
+        serialComms.connect()
+        try:
+            self.assertIsInstance(serialComms.serial, SocketTransport)
+            self.assertEqual(serialComms.write('AT+CSQ\r'), ['AT+CSQ', 'OK'])
+        finally:
+            serialComms.close()
+            server.close()
+
+    def test_fastClose(self):
+        """ Tests that close() cancels blocked reads, interrupts pending commands and waits for worker threads """
+        local, remote = socket.socketpair() # Nothing responds on the remote end
+        serialComms = SerialComms('fd://{0}'.format(local.fileno()))
+        serialComms.connect()
+        try:
+            time.sleep(0.05) # Let the read thread block in read()
+            errors = []
+            def writeCommand():
+                try:
+                    serialComms.write('AT\r', timeout=10)
+                except InterruptedException as e:
+                    errors.append(e)
+            writer = threading.Thread(target=writeCommand)
+            writer.start()
+            workerDone = []
+            serialComms._startWorker(lambda: serialComms._stopEvent.wait(10) and workerDone.append(True))
+            time.sleep(0.05)
+            start = time.time()
+            serialComms.close()
+            self.assertLess(time.time() - start, 0.5)
+            writer.join(1)
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(workerDone, [True])
+            self.assertFalse(serialComms.rxThread.is_alive())
+        finally:
+            local.close()
+            remote.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,7 @@ from datetime import timedelta
 
 from . import compat # For Python 2.6 compatibility
 
-from gsmmodem.util import allLinesMatchingPattern, lineMatching, lineStartingWith, lineMatchingPattern, SimpleOffsetTzInfo
+from gsmmodem.util import allLinesMatchingPattern, commandFamily, lineMatching, lineStartingWith, lineMatchingPattern, SimpleOffsetTzInfo
 
 class TestUtil(unittest.TestCase):
     """ Tests misc utilities from gsmmodem.util """
@@ -24,6 +24,14 @@ class TestUtil(unittest.TestCase):
         result = lineStartingWith('zzz', lines)
         self.assertEqual(result, None)
         
+    def test_commandFamily(self):
+        """ Tests function: commandFamily """
+        tests = (('AT+CMGS=23', '+CMGS='), ('AT+CPIN?', '+CPIN?'), ('AT+COPS=?', '+COPS=?'), ('AT+CLAC', '+CLAC'),
+                 ('AT^USSDMODE=0', '^USSDMODE='), ('ATD0123456789;', 'D'), ('ATZ', 'Z'), ('AT', 'AT'),
+                 ('0011000B915121551532F4', None))
+        for command, family in tests:
+            self.assertEqual(commandFamily(command), family)
+
     def test_lineMatching(self):
         """ Tests function: lineMatching """
         lines = ['12345', 'abc', 'defghi', 'abcdef', 'efg']